@@ -0,0 +1,193 @@
+import time
+import logging
+
+try:
+  import asyncio
+except ImportError:
+  # asyncio backport for python 2
+  import trollius as asyncio
+
+import irc.client
+
+import lineparser
+
+ensure_future = getattr(asyncio, "ensure_future", None) or getattr(asyncio, "async")
+
+logger = logging.getLogger("DontMindMe.AsyncCore")
+
+# asyncio based replacement for the select loop of the irc library
+#
+# install() swaps the reactors and connections of the networks for the classes
+# below, everything else, including the plugins, keeps using the usual
+# connection and scheduling API. the code sticks to callbacks, no coroutine
+# syntax, so it runs on both asyncio and trollius.
+
+class IRCProtocol(asyncio.Protocol):
+  def __init__(self, connection):
+    self.connection = connection
+
+  def connection_made(self, transport):
+    self.connection.connection_made(transport)
+
+  def data_received(self, data):
+    self.connection.data_received(data)
+
+  def connection_lost(self, exc):
+    self.connection.connection_lost(exc)
+
+class AsyncServerConnection(irc.client.ServerConnection):
+  def connect(self, server, port, nickname, password=None, username=None, ircname=None, **kwargs):
+    if self.connected:
+      self.disconnect("Changing servers")
+
+    self.buffer = self.buffer_class()
+    self.handlers = {}
+    self.real_server_name = ""
+    self.real_nickname = nickname
+    self.server = server
+    self.port = port
+    self.server_address = (server, port)
+    self.nickname = nickname
+    self.username = username or nickname
+    self.ircname = ircname or nickname
+    self.password = password
+    self.socket = None
+
+    # the result is only known later, a failure is reported as disconnect
+    # just like a dropped connection, so the bot's reconnect logic kicks in
+    task = ensure_future(self.irclibobj.loop.create_connection(lambda: IRCProtocol(self), server, port))
+    task.add_done_callback(self.connect_done)
+    return self
+
+  def connect_done(self, future):
+    if future.cancelled() or future.exception() is None:
+      return
+
+    logger.error("Couldn't connect to %s:%s: %s" % (self.server, self.port, future.exception()))
+    self._handle_event(irc.client.Event("disconnect", self.server, "", [str(future.exception())]))
+
+  def connection_made(self, transport):
+    self.socket = transport
+    self.connected = True
+    self.irclibobj._on_connect(transport)
+
+    # Log on...
+    if self.password:
+      self.pass_(self.password)
+    self.nick(self.nickname)
+    self.user(self.username, self.ircname)
+
+  def data_received(self, data):
+    self.buffer.feed(data)
+
+    # an exception would make asyncio close the transport,
+    # so errors are logged per line instead
+    for line in self.buffer:
+      if not line:
+        continue
+
+      try:
+        self._process_line(line)
+      except Exception:
+        logger.exception("Error on handling line %r!", line)
+
+  # same checks as the base class, but written to the transport, which
+  # buffers the line and never blocks
+  def send_raw(self, string):
+    if "\n" in string:
+      raise irc.client.InvalidCharacters("Carriage returns not allowed in privmsg(text)")
+
+    line = string.encode("utf-8") + b"\r\n"
+    if len(line) > 512:
+      raise irc.client.MessageTooLong("Messages limited to 512 bytes including CR/LF")
+
+    if self.socket is None:
+      raise irc.client.ServerNotConnectedError("Not connected.")
+
+    self.socket.write(line)
+
+  def connection_lost(self, exc):
+    if not self.connected:
+      return
+
+    self.connected = False
+    self.socket = None
+    self._handle_event(irc.client.Event("disconnect", self.server, "", ["Connection reset by peer"]))
+
+  def disconnect(self, message=""):
+    if not self.connected:
+      return
+
+    self.connected = False
+    self.quit(message)
+
+    transport = self.socket
+    self.socket = None
+    transport.close()
+    self._handle_event(irc.client.Event("disconnect", self.server, "", [message]))
+
+  def process_data(self):
+    pass
+
+class LazyAsyncServerConnection(lineparser.LazyLineParser, AsyncServerConnection):
+  pass
+
+class AsyncReactor(irc.client.IRC):
+  def __init__(self, loop=None):
+    irc.client.IRC.__init__(self)
+    self.loop = loop or asyncio.get_event_loop()
+
+  def server(self, lazy=False):
+    c = (LazyAsyncServerConnection if lazy else AsyncServerConnection)(self)
+    with self.mutex:
+      self.connections.append(c)
+    return c
+
+  def execute_at(self, at, function, arguments=()):
+    self.execute_delayed(at - time.time(), function, arguments)
+
+  def execute_delayed(self, delay, function, arguments=()):
+    self.loop.call_later(max(0, delay), self.run_scheduled, function, arguments)
+
+  def execute_every(self, period, function, arguments=()):
+    def periodic():
+      self.loop.call_later(period, periodic)
+      self.run_scheduled(function, arguments)
+
+    self.loop.call_later(period, periodic)
+
+  # a failing timer must not take the loop down
+  def run_scheduled(self, function, arguments):
+    try:
+      function(*arguments)
+    except Exception:
+      logger.exception("Error on running scheduled function %r!" % (function))
+
+  def process_once(self, timeout=0):
+    self.loop.call_later(timeout, self.loop.stop)
+    self.loop.run_forever()
+
+  def process_forever(self, timeout=0.2):
+    self.loop.run_forever()
+
+# makes all networks of a BotCore run on one asyncio loop, call before core.start()
+def install(core, loop=None):
+  core.loop = loop or asyncio.get_event_loop()
+
+  # offloaded handlers hand their results back from a worker thread
+  core.workers.notify = lambda: core.loop.call_soon_threadsafe(core.workers.process)
+
+  for bot in core.networks.values():
+    reactor = AsyncReactor(core.loop)
+
+    # keep the global handlers the bot has registered so far and the
+    # callback that starts the capability negotiation
+    reactor.handlers = bot.ircobj.handlers
+    reactor._on_connect = bot.ircobj._on_connect
+    bot.ircobj = reactor
+    if isinstance(bot.connection, lineparser.LazyLineParser):
+      bot.connection = reactor.server(lazy=True)
+      bot.connection.attach(bot, bot.count_line)
+    else:
+      bot.connection = reactor.server()
+    bot.sendq.connection = bot.connection
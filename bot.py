@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 
 import time, datetime
+import select
+import collections
+import threading
 import getpass
 import os
+import sys
 import imp
 import logging
 import logging.handlers
@@ -13,8 +17,22 @@ import irc.bot
 import irc.strings
 import irc.client
 from irc.dict import IRCDict
+from sendqueue import SendQueue, join_lines
+import workers
+import metrics
+import persistence
+import pluginindex
+import hostmask
+import lineparser
+import moderation
+import capabilities
+import servers
+import logqueue
+from timeit import default_timer
 
 CTCP_VERSION           = "DontMindMe - General Purpose IRC Bot (skyr.at)"
+AUTOJOIN_DELAY         = 10    # seconds after the welcome to join even if the MOTD never ends
+RESYNC_TIMEOUT         = 60    # seconds after the welcome channels we couldn't rejoin are dropped
 
 class PluginError(Exception):
   def __init__(self, msg):
@@ -30,10 +48,18 @@ class BotError(Exception):
   def __str__(self):
     return repr(self.msg)
 
+# a user we share at least one channel with, there is only one per nick
+# for all channels of a network
 class User(object):
+  __slots__ = ("nick", "host", "account", "away", "channels", "opped")
+
   def __init__(self, nick, host):
     self.nick = nick
     self.host = host
+    self.account = None  # services account, only known with extended-join or account-notify
+    self.away = False
+    self.channels = set()
+    self.opped = 0     # number of our channels the user has operator status in
 
   def get_nick(self):
     return self.nick
@@ -41,51 +67,255 @@ class User(object):
   def get_host(self):
     return self.host
 
-  def get_host(self):
-    return self.host
-
   def set_host(self, host):
     self.host = host
-    
-class Channel(irc.bot.Channel):
+
+  def get_account(self):
+    return self.account
+
+  def is_registered(self):
+    return self.account is not None
+
+# the users of all channels of a network by nick
+#
+# channels only keep references to the users, so memory grows with the
+# number of distinct users rather than with users times channels. a NICK
+# is a single rename here, a QUIT only touches the channels the user was
+# in. a user is dropped once we don't share any channel anymore.
+class UserRegistry(object):
   def __init__(self):
+    # keyed by the case folded nick, which is cheaper than an IRCDict
+    self.users = {}
+
+  def get(self, nick):
+    return self.users.get(hostmask.fold(nick))
+
+  # the user with the given nick, created if we don't know it yet
+  def intern(self, nick, host):
+    key = hostmask.fold(nick)
+    user = self.users.get(key)
+    if user is None:
+      user = User(nick, host)
+      self.users[key] = user
+    elif host and not user.host:
+      user.host = host
+    return user
+
+  def rename(self, before, after):
+    user = self.users.pop(hostmask.fold(before), None)
+    if user is None:
+      return None
+
+    user.nick = after
+    self.users[hostmask.fold(after)] = user
+    return user
+
+  def quit(self, nick):
+    user = self.get(nick)
+    if user is None:
+      return
+
+    for channel in list(user.channels):
+      channel.remove_member(user)
+
+  # called by the channels when a user left the last one
+  def release(self, user):
+    key = hostmask.fold(user.nick)
+    if self.users.get(key) is user:
+      del self.users[key]
+
+  def clear(self):
+    self.users.clear()
+
+  def __len__(self):
+    return len(self.users)
+
+# a channel's members and their prefix modes as sets of users from the
+# network's registry, the base class's dicts keyed by nick stay empty
+class Channel(irc.bot.Channel):
+  def __init__(self, registry):
     irc.bot.Channel.__init__(self)
-    self.users = IRCDict()
-  
-  def add_user(self, nick, host):
-    irc.bot.Channel.add_user(self, nick)
-    self.users[nick] = User(nick, host)
+    self.registry = registry
+    self.members = set()
+    self.ranks = {"o": set(), "v": set(), "q": set(), "h": set()}
+    self.stale = False     # kept from before a reconnect, not rejoined yet
+    self.syncing = None    # user: prefix modes, from NAMES while resyncing
 
-  def remove_user(self, nick):
-    irc.bot.Channel.remove_user(self, nick)
-    if nick in self.users:
-      del self.users[nick]
+  def users(self):
+    return [x.nick for x in self.members]
+
+  def opers(self):
+    return [x.nick for x in self.ranks["o"]]
+
+  def voiced(self):
+    return [x.nick for x in self.ranks["v"]]
+
+  def owners(self):
+    return [x.nick for x in self.ranks["q"]]
+
+  def halfops(self):
+    return [x.nick for x in self.ranks["h"]]
+
+  def has_user(self, nick):
+    return self.get_user(nick) is not None
+
+  def has_rank(self, mode, nick):
+    user = self.registry.get(nick)
+    return user is not None and user in self.ranks[mode]
+
+  def is_oper(self, nick):
+    return self.has_rank("o", nick)
 
+  def is_voiced(self, nick):
+    return self.has_rank("v", nick)
+
+  def is_owner(self, nick):
+    return self.has_rank("q", nick)
+
+  def is_halfop(self, nick):
+    return self.has_rank("h", nick)
+
+  def add_user(self, nick, host=""):
+    user = self.registry.intern(nick, host)
+    self.members.add(user)
+    user.channels.add(self)
+    if self.syncing is not None:
+      self.syncing.setdefault(user, set())
+    return user
+
+  def remove_user(self, nick):
+    user = self.get_user(nick)
+    if user is not None:
+      self.remove_member(user)
+
+  def remove_member(self, user):
+    for mode in self.ranks:
+      self.remove_rank(mode, user)
+
+    if self.syncing is not None:
+      self.syncing.pop(user, None)
+    self.members.discard(user)
+    user.channels.discard(self)
+    if not user.channels:
+      self.registry.release(user)
+
+  # nicks are kept once for all channels
   def change_nick(self, before, after):
-    irc.bot.Channel.change_nick(self, before, after)
-    self.users[after] = self.users.pop(before)
-    self.users[after].name = after
+    self.registry.rename(before, after)
+
+  def set_mode(self, mode, value=None):
+    if mode not in self.ranks:
+      irc.bot.Channel.set_mode(self, mode, value)
+      return
+
+    user = self.get_user(value)
+    if user is not None:
+      self.add_rank(mode, user)
+
+  def clear_mode(self, mode, value=None):
+    if mode not in self.ranks:
+      irc.bot.Channel.clear_mode(self, mode, value)
+      return
+
+    user = self.get_user(value)
+    if user is not None:
+      self.remove_rank(mode, user)
+
+  def add_rank(self, mode, user):
+    if user in self.ranks[mode]:
+      return
+
+    self.ranks[mode].add(user)
+    if mode == "o":
+      user.opped += 1
+
+  def remove_rank(self, mode, user):
+    if user not in self.ranks[mode]:
+      return
+
+    self.ranks[mode].remove(user)
+    if mode == "o":
+      user.opped -= 1
+
+  # after a reconnect the members are kept and compared with the NAMES list
+  # once it ended: users that left meanwhile are dropped and the prefix
+  # modes are replaced, the users that stayed keep their host and account
+  def begin_sync(self):
+    self.stale = False
+    self.syncing = {}
+
+  # returns the number of users kept and dropped
+  def end_sync(self):
+    seen, self.syncing = self.syncing, None
+    left = [x for x in self.members if x not in seen]
+    for user in left:
+      self.remove_member(user)
+
+    for mode, users in self.ranks.items():
+      for user in list(users):
+        if mode not in seen[user]:
+          self.remove_rank(mode, user)
+
+    for user, modes in seen.items():
+      for mode in modes:
+        self.set_mode(mode, user.nick)
+    return len(seen), len(left)
+
+  # has to be called before the channel is dropped, e.g. when we leave it
+  def clear(self):
+    for user in list(self.members):
+      self.remove_member(user)
 
   def get_user(self, nick):
-    if nick in self.users:
-      return self.users[nick]
-    else:
-      return None
+    user = self.registry.get(nick)
+    if user is not None and user in self.members:
+      return user
+    return None
+
+# an entry in the bot's command table
+# plugin is None for core commands, public commands may be run by anyone
+class Command(object):
+  def __init__(self, name, plugin, handler, usage=None, public=False):
+    self.name = name
+    self.plugin = plugin
+    self.handler = handler
+    self.usage = usage
+    self.public = public
+
+  def get_owner(self):
+    if self.plugin is None:
+      return "core"
+    return self.plugin.name
 
 # Plugin class
 class Plugin(object):
-  def __init__(self, bot, name, long_name, author, desc):
-    self.bot = bot
+  def __init__(self, core, name, long_name, author, desc):
+    self.core = core
     self.name = name
     self.long_name = long_name
     self.author = author
     self.description = desc
     self.command_handler = {}
     self.event_handler = {}
+    self.offloaded = set()
     self.instance = None
+    self.load_order = 0
 
+  # plugins are shared by all networks, this is the network
+  # of the event or command that is being handled
   def get_bot(self):
-    return self.bot
+    return self.core.current
+
+  def get_networks(self):
+    return self.core.networks
+
+  # handler timings and traffic counters, see metrics.py
+  def get_metrics(self):
+    return self.core.metrics
+
+  # the plugin's persistent key value store, see persistence.py
+  def get_store(self):
+    return self.core.database.namespace("plugin:" + self.name)
 
   def get_description(self):
     return self.description
@@ -93,26 +323,45 @@ class Plugin(object):
   def __str__(self):
     return "%s - %s" % (self.long_name, self.author)
 
+  # a [<plugin>:<network>] section overrides the plugin's section
+  # for the network that is being handled
   def get_config_value(self, key, default=""):
-    try:
-      return self.bot.config.get(self.name, key)
-    except (ConfigParser.NoSectionError, ConfigParser.NoOptionError) as e:
-      return default
+    sections = [self.name]
+    if self.core.current is not None:
+      sections.insert(0, "%s:%s" % (self.name, self.core.current.name))
+
+    for section in sections:
+      if self.core.config.has_option(section, key):
+        return self.core.config.get(section, key)
+
+    return default
 
   def set_instance(self, instance):
     self.instance = instance
 
-  def add_command_handler(self, command, handler):
+  # raises a PluginError if another plugin already owns the command
+  # offloaded handlers run on a worker thread, for anything that blocks
+  def add_command_handler(self, command, handler, usage=None, offload=False):
+    command = command.lower()
+    self.core.register_command(Command(command, self, handler, usage))
     self.command_handler[command] = handler
+    if offload:
+      self.offloaded.add(command)
 
-  def add_event_handler(self, event, handler):
+  def add_event_handler(self, event, handler, offload=False):
     self.event_handler[event] = handler
+    self.core.index_event_handler(self, event)
+    if offload:
+      self.offloaded.add(event)
+
+  def is_offloaded(self, name):
+    return name in self.offloaded
 
   def handle_command(self, conn, command, data):
-    self.command_handler[command[0]](conn, command[1:], data)
+    return self.command_handler[command[0]](conn, command[1:], data)
 
   def handle_event(self, conn, event, data):
-    self.event_handler[event](conn, data)
+    return self.event_handler[event](conn, data)
 
   def handle_help(self, conn, event):
     if not hasattr(self.instance, "_help_"):
@@ -128,131 +377,478 @@ class Plugin(object):
   def has_event_handler(self, event):
     return event in self.event_handler
 
-class FloodBot(irc.bot.SingleServerIRCBot):
+# holds everything that is shared by the networks: the config, the plugins,
+# the command table and the event index. every [network:<name>] section of
+# the config is a FloodBot of its own, options missing there are taken from
+# [core]. without any network section [core] describes the only network.
+class BotCore(object):
   def __init__(self, logger, config, nickname, server, port):
     self.logger             = logger
-    self.admins             = set()
     self.plugins            = {}
+    self.event_index        = {}
+    self.commands           = {}
+    self.plugin_load_count  = 0
     self.config             = ConfigParser.ConfigParser()
-    self.admin_secret       = ""
-    self.autojoin_channels  = []
+    self.networks           = collections.OrderedDict()
+    self.context            = threading.local()
+    self.metrics            = metrics.Metrics()
+    self.current            = None
+    self.loop               = None
+
+    # core commands are FloodBot methods, run on the network they were issued on
+    self.register_command(Command("!plugin", None, FloodBot.cmd_plugin, "!plugin load <name>|unload <name>|reload <name>|info <name>|list - Manage the bot's plugins"))
+    self.register_command(Command("!admin", None, FloodBot.cmd_admin, "!admin list|add <hostmask>|remove <hostmask>|purge - Manage administrators"))
+    self.register_command(Command("!help", None, FloodBot.cmd_help, "!help [<plugin>|<command>] - Show available commands or help on a plugin"))
+    self.register_command(Command("!secret", None, FloodBot.cmd_secret, "!secret <secret> - Authenticate as administrator", public=True))
+    self.register_command(Command("!sendq", None, FloodBot.cmd_sendq, "!sendq - Show depth and latency of the send queue"))
+    self.register_command(Command("!moderation", None, FloodBot.cmd_moderation, "!moderation - Show pending quiets and their latency"))
+    self.register_command(Command("!networks", None, FloodBot.cmd_networks, "!networks - List the networks the bot is connected to"))
+
+    if config and config not in self.config.read(config):
+      raise BotError("Could not read configuration file '%s'!" % (config))
+
+    # state that survives restarts, without a database it's only kept in memory
+    self.database = persistence.Database(self.get_option(None, "database"))
+
+    # what is known about the plugins without importing them
+    self.plugin_index = pluginindex.PluginIndex("plugins", self.database.namespace("plugin-index"))
+
+    # offloaded plugin handlers run on these threads
+    self.workers = workers.WorkerPool(self,
+      int(self.get_option(None, "workers", workers.WORKERS)),
+      float(self.get_option(None, "worker_timeout", workers.TIMEOUT)),
+      int(self.get_option(None, "worker_queue", workers.MAX_PENDING)))
+
+    names = [x.split(":", 1)[1] for x in self.config.sections() if x.startswith("network:")]
+    if not names:
+      names = ["default"]
 
-    if config:
-      if config not in self.config.read(config):
-        raise BotError("Could not read configuration file '%s'!" % (config))
+    logger.info("Starting up DontMindMe.")
 
-      self.autoload_plugins()
+    for name in names:
+      self.networks[name] = FloodBot(self, name, nickname, server, port)
 
-      if self.config.has_option("core", "channels"):
-        self.autojoin_channels = self.config.get("core", "channels").split(",")
+    if config:
+      self.autoload_plugins()
 
-      if self.config.has_option("core", "secret"):
-        self.admin_secret = self.config.get("core", "secret")
+  # the network being handled, kept per thread for the offloaded handlers
+  @property
+  def current(self):
+    return getattr(self.context, "network", None)
 
-      if self.config.has_option("core", "server"):
-        server = self.config.get("core", "server")
-      
-      if self.config.has_option("core", "port"):
-        port = int(self.config.get("core", "port"))
-      
-      if self.config.has_option("core", "nickname"):
-        nickname = self.config.get("core", "nickname")
+  @current.setter
+  def current(self, network):
+    self.context.network = network
 
-    if len(self.autojoin_channels):
-      self.logger.info("Auto joining channels: " + ', '.join(self.autojoin_channels))
-  
-    logger.info("Starting up DontMindMe.")
-    logger.debug("Server: " + server + ":" + str(port) + ", Nickname: " + nick)
+  # looks an option up in the network's section, then in [core]
+  def get_option(self, network, key, default=None):
+    sections = ("core",) if network is None else ("network:" + network, "core")
+    for section in sections:
+      if self.config.has_option(section, key):
+        return self.config.get(section, key)
 
-    irc.bot.SingleServerIRCBot.__init__(self, [(server, port)], nickname, nickname)
+    return default
 
-  # tries to load the modules specified in the config file
+  # tries to load the modules specified in the config file,
+  # they are only set up once one of their commands or events comes in
   def autoload_plugins(self):
     try:
       for plugin in self.config.get("core", "plugins").split(","):
         try:
-          self.load_plugin(plugin.strip())
+          self.load_plugin(plugin.strip(), lazy=True)
         except PluginError, e:
           # silently ignore PluginErrors and try to load the next one
           pass
     except (ConfigParser.NoSectionError, ConfigParser.NoOptionError) as e:
       return
 
-  # checks if a user is a channel op in one of our channels
-  def is_user_admin(self, source):
-    if source in self.admins:
-      return True
-
-    for _, channel in self.channels.items():
-      if channel.is_oper(source.nick):
-        return True
-
-    return False
-
   # plugin management
   def get_plugin_list(self):
-    return [x[:-3] for x in os.listdir("plugins") if os.path.splitext(x)[1].lower() == ".py" and x != "__init__.py"]
+    return self.plugin_index.names()
+
+  # a lazy plugin gets the commands and events its manifest declares and
+  # is activated when the first of them is handled
+  def load_plugin(self, plugin, lazy=False):
+    info = self.plugin_index.get(plugin)
+    if info is None:
+      raise PluginError("No such plugin '%s'!" % (plugin,))
+
+    self.plugin_load_count += 1
+    self.plugins[plugin] = Plugin(self, plugin, info.long_name, info.author, info.description)
+    self.plugins[plugin].load_order = self.plugin_load_count
+
+    if lazy and info.lazy:
+      try:
+        for command, usage in info.commands:
+          self.register_command(Command(command, self.plugins[plugin], None, usage))
+        for event in info.events:
+          self.index_event_handler(self.plugins[plugin], event)
+      except PluginError, e:
+        self.unindex_plugin(self.plugins.pop(plugin))
+        self.logger.error("Error loading plugin '%s': %s" % (plugin, e.msg))
+        raise
+
+      self.logger.info("Loaded plugin '%s', it is set up on first use." % (plugin))
+      return
+
+    self.activate_plugin(self.plugins[plugin])
+    self.logger.info("Successfully loaded plugin '%s'!" % (plugin))
 
-  # dynamically imports a python file
-  def load_plugin(self, plugin):
-    py_mod = imp.load_source(plugin, "plugins/%s.py" % (plugin))
-    py_mod.User = User
+  # runs the plugin's cached code in a fresh module and sets it up
+  def activate_plugin(self, plugin):
+    name = plugin.name
+
+    # a plugin is set up for all networks, not the one that asked for it
+    current = self.current
+    self.current = None
 
     try:
+      py_mod = imp.new_module(name)
+      py_mod.__file__ = self.plugin_index.get(name).path
+      py_mod.User = User
+      exec self.plugin_index.get_code(name) in py_mod.__dict__
+      sys.modules[name] = py_mod
+
       plugin_class = py_mod.Plugin
-      self.plugins[plugin] = Plugin(self, plugin, plugin_class._name_, plugin_class._author_, plugin_class._description_)
-      self.plugins[plugin].set_instance(plugin_class(self.plugins[plugin]))
+      plugin.long_name = plugin_class._name_
+      plugin.author = plugin_class._author_
+      plugin.description = plugin_class._description_
+      plugin.set_instance(plugin_class(plugin))
     except AttributeError, e:
-      if plugin in self.plugins:
-        del self.plugins[plugin]
-      self.logger.exception("Error loading plugin '%s': " % (plugin))
-      raise PluginError("No class 'Plugin' found in plugin '%s'!" % (plugin,))
-    
-    self.logger.info("Successfully loaded plugin '%s'!" % (plugin))
+      if self.plugins.get(name) is plugin:
+        self.unindex_plugin(self.plugins.pop(name))
+      self.logger.exception("Error loading plugin '%s': " % (name))
+      raise PluginError("No class 'Plugin' found in plugin '%s'!" % (name,))
+    except PluginError, e:
+      if self.plugins.get(name) is plugin:
+        self.unindex_plugin(self.plugins.pop(name))
+      self.logger.error("Error loading plugin '%s': %s" % (name, e.msg))
+      raise
+    except Exception, e:
+      if self.plugins.get(name) is plugin:
+        self.unindex_plugin(self.plugins.pop(name))
+      self.logger.exception("Error loading plugin '%s': " % (name))
+      raise PluginError("Error loading plugin '%s': %s" % (name, e))
+    finally:
+      self.current = current
+
+  # activates a lazy plugin, a plugin that fails to set up is dropped
+  def ensure_active(self, plugin):
+    if plugin.instance is not None:
+      return True
+
+    try:
+      self.activate_plugin(plugin)
+    except PluginError:
+      return False
+
+    self.logger.info("Set up plugin '%s'." % (plugin.name))
+    return True
 
   def unload_plugin(self, plugin):
     self.logger.info("Unloading plugin '%s'." % (plugin))
-    del self.plugins[plugin]
+    self.unindex_plugin(self.plugins.pop(plugin))
+
+  # the event index maps an event name to a tuple of the plugins handling it,
+  # ordered by the time they were loaded. tuples are rebuilt on every change
+  # so a dispatch loop is never affected by a plugin being unloaded mid-event
+  def index_event_handler(self, plugin, event):
+    handlers = [x for x in self.event_index.get(event, ()) if x is not plugin]
+    handlers.append(plugin)
+    handlers.sort(key=lambda x: x.load_order)
+    self.event_index[event] = tuple(handlers)
+
+  # every command has exactly one owner, a conflicting registration is refused
+  def register_command(self, command):
+    if command.name in self.commands and self.commands[command.name].plugin is not command.plugin:
+      raise PluginError("Command '%s' is already provided by '%s'!" % (command.name, self.commands[command.name].get_owner()))
+
+    self.commands[command.name] = command
+
+  # lazy plugins have entries for handlers they don't have yet,
+  # so the whole tables are searched, plugins are rarely unloaded
+  def unindex_plugin(self, plugin):
+    for command in [x for x in self.commands if self.commands[x].plugin is plugin]:
+      del self.commands[command]
+
+    for event in [x for x in self.event_index if plugin in self.event_index[x]]:
+      handlers = tuple(x for x in self.event_index[event] if x is not plugin)
+      if handlers:
+        self.event_index[event] = handlers
+      else:
+        del self.event_index[event]
 
-  def plugin_handle_command(self, conn, cmd, data):
-    for name, plugin in self.plugins.items():
-      if plugin.has_command_handler(cmd[0]):
+  def plugin_handle_command(self, conn, plugin, cmd, data):
+    if not self.ensure_active(plugin):
+      raise PluginError("Plugin '%s' could not be set up and was unloaded!" % (plugin.name))
 
-        # run this encapsulated in a dirty catch-all try
-        # to prevent the bot from crashing when a plugin 
-        # is errornous and unload the plugin in case
-        try:
-          plugin.handle_command(conn, cmd, data)
-        except:
-          self.logger.exception("Error on running plugin command handler for '%s'!" % (cmd[0]))
-          self.unload_plugin(name)
-          raise PluginError("Error on running plugin command handler! Unloading plugin ...")
+    if not plugin.has_command_handler(cmd[0]):
+      return False
+
+    if plugin.is_offloaded(cmd[0]):
+      if not self.workers.submit(plugin, cmd[0], plugin.command_handler[cmd[0]], conn, (cmd[1:], data)):
+        raise PluginError("Plugin '%s' is busy, try again later!" % (plugin.name))
+      return True
+
+    # run this encapsulated in a dirty catch-all try
+    # to prevent the bot from crashing when a plugin 
+    # is errornous and unload the plugin in case
+    start = default_timer()
+    try:
+      self.watch_result(plugin, cmd[0], plugin.handle_command(conn, cmd, data))
+    except:
+      self.metrics.error(plugin.name, "command", cmd[0])
+      self.logger.exception("Error on running plugin command handler for '%s'!" % (cmd[0]))
+      if self.plugins.get(plugin.name) is plugin:
+        self.unload_plugin(plugin.name)
+      raise PluginError("Error on running plugin command handler! Unloading plugin ...")
+    finally:
+      self.metrics.observe(plugin.name, "command", cmd[0], default_timer() - start)
+
+    return True
+
+  # handlers may return a future, e.g. when running on the asyncio core,
+  # a plugin whose future fails is unloaded just like one that raises
+  def watch_result(self, plugin, name, result):
+    if hasattr(result, "add_done_callback"):
+      result.add_done_callback(lambda future: self.check_result(plugin, name, future))
+
+  def check_result(self, plugin, name, future):
+    if future.cancelled() or future.exception() is None:
+      return
 
-        return True
-    return False
+    self.logger.error("Error on running plugin handler for '%s' in plugin '%s', unloading it: %s" % (name, plugin.name, future.exception()))
+    if self.plugins.get(plugin.name) is plugin:
+      self.unload_plugin(plugin.name)
 
   # this method does not return once a fitting handler is found
   # to let more than one plugin handle things
   def plugin_handle_event(self, conn, event, data):
-    for name, plugin in self.plugins.items():
-      if plugin.has_event_handler(event):
-        
-        # run this encapsulated in a dirty catch-all try
-        # to prevent the bot from crashing when a plugin 
-        # is errornous and unload the plugin in case
+    for plugin in self.event_index.get(event, ()):
+      if not self.ensure_active(plugin) or not plugin.has_event_handler(event):
+        continue
+
+      # run this encapsulated in a dirty catch-all try
+      # to prevent the bot from crashing when a plugin 
+      # is errornous and unload only that plugin in case,
+      # the remaining plugins still get to see the event
+      start = default_timer()
+      try:
+        if plugin.is_offloaded(event):
+          self.workers.submit(plugin, event, plugin.event_handler[event], conn, (data,))
+        else:
+          self.watch_result(plugin, event, plugin.handle_event(conn, event, data))
+      except:
+        self.metrics.error(plugin.name, "event", event)
+        self.logger.exception("Error on running plugin event handler for '%s' in plugin '%s', unloading it!" % (event, plugin.name))
+        if self.plugins.get(plugin.name) is plugin:
+          self.unload_plugin(plugin.name)
+      finally:
+        self.metrics.observe(plugin.name, "event", event, default_timer() - start)
+
+  def start(self):
+    port = self.get_option(None, "metrics_port")
+    if port:
+      metrics.serve(self, int(port))
+
+    for network in self.networks.values():
+      network._connect()
+
+    self.process_forever()
+
+  # the networks have a reactor each, they are driven by a single loop.
+  # aiocore.install sets self.loop, then the asyncio loop does the work
+  def process_forever(self, timeout=0.2):
+    if self.loop is not None:
+      self.loop.run_forever()
+      return
+
+    while True:
+      self.process_once(timeout)
+
+  # writes out what is left to persist
+  def close(self):
+    self.database.close()
+
+  def process_once(self, timeout=0):
+    # finished offloaded handlers are picked up without waiting long
+    if self.workers.busy():
+      timeout = min(timeout, workers.POLL_INTERVAL)
+
+    sockets = [c.socket for network in self.networks.values() for c in network.ircobj.connections if c.socket is not None]
+    if sockets:
+      readable = select.select(sockets, [], [], timeout)[0]
+    else:
+      readable = []
+      time.sleep(timeout)
+
+    for network in self.networks.values():
+      self.current = network
+      network.ircobj.process_data(readable)
+      network.ircobj.process_timeout()
+
+    self.workers.process()
+
+# a connection to a single network, its channels, admins and send queue
+class FloodBot(irc.bot.SingleServerIRCBot):
+  def __init__(self, core, name, nickname, server, port):
+    self.core               = core
+    self.name               = name
+    self.logger             = core.logger.getChild(name)
+    self.state              = core.database.namespace("network:" + name)
+    self.admins             = hostmask.MaskSet(self.state.get("admins", []))
+    self.users              = UserRegistry()
+    self.autojoin_channels  = []
+
+    channels = core.get_option(name, "channels")
+    if channels:
+      self.autojoin_channels = channels.split(",")
+
+    # admins given as hostmasks in the config, such as *!*@staff.example.com or $a:account
+    admins = core.get_option(name, "admins")
+    if admins:
+      for mask in admins.split(","):
         try:
-          plugin.handle_event(conn, event, data)
-        except:
-          self.logger.exception("Error on running plugin event handler for '%s'!" % (event))
-          self.unload_plugin(name)
-          raise PluginError("Error on running plugin command handler! Unloading plugin ...")
+          self.admins.add(mask)
+        except ValueError, e:
+          self.logger.warning("Skipping admin from config file: %s", e)
+
+    self.admin_secret = core.get_option(name, "secret", "")
+    # one or more servers, host[:port] separated by commas
+    server = core.get_option(name, "server", server)
+    port = int(core.get_option(name, "port", port))
+    self.servers = servers.ServerPool(servers.parse_servers(server, port),
+      float(core.get_option(name, "reconnect_base", servers.BACKOFF_BASE)),
+      float(core.get_option(name, "reconnect_max", servers.BACKOFF_MAX)))
+    nickname = core.get_option(name, "nickname", nickname)
+    send_rate = float(core.get_option(name, "send_rate", 1.0))
+    send_burst = int(core.get_option(name, "send_burst", 5))
+    lazy_parser = core.get_option(name, "lazy_parser", "no").lower() in ("yes", "true", "on", "1")
+    caps = core.get_option(name, "capabilities", ",".join(capabilities.WANTED))
+    moderation_window = float(core.get_option(name, "moderation_window", moderation.WINDOW))
+
+    if len(self.autojoin_channels):
+      self.logger.info("Auto joining channels: " + ', '.join(self.autojoin_channels))
+  
+    self.logger.debug("Servers: %s, Nickname: %s" % (", ".join(str(x) for x in self.servers.servers), nickname))
+
+    irc.bot.SingleServerIRCBot.__init__(self, [(x.host, x.port) for x in self.servers.servers], nickname, nickname)
+
+    # reconnects are scheduled by _on_disconnect, see servers.py
+    self.session = 0              # counts successful connects, timers of an older one stop
+    self.registered = False
+    self.reconnect_scheduled = False
+    self.autojoined = False
+    self.lag_ping = None          # time the unanswered lag PING was sent
+
+    # CAP LS has to be sent before NICK and USER, the reactor calls this
+    # right after connecting and before registering
+    self.caps = capabilities.Negotiation([x.strip() for x in caps.split(",") if x.strip()])
+    self.ircobj._on_connect = self.on_socket_connect
+
+    if lazy_parser:
+      self.use_lazy_parser()
+
+    # all replies of the core and the plugins go through the send queue
+    self.sendq = SendQueue(self.connection, send_rate, send_burst)
+
+    # quiets are collected for a moment and sent in batches, see moderation.py
+    self.moderation = moderation.Dispatcher(self, moderation_window)
+
+  # lines nothing handles are dropped before they are parsed completely,
+  # has to be called before the send queue or anything else takes the connection
+  def use_lazy_parser(self):
+    self.ircobj.connections.remove(self.connection)
+    self.connection = lineparser.LazyServerConnection(self.ircobj)
+    self.ircobj.connections.append(self.connection)
+    self.connection.attach(self, self.count_line)
+
+  def on_socket_connect(self, sock):
+    self.caps.start(self.connection)
+
+  # connects to the best server of the pool, a failure schedules the next attempt
+  def _connect(self):
+    server = self.servers.choose()
+    self.registered = False
+    self.logger.info("Connecting to %s ...", server)
+    try:
+      self.connect(server.host, server.port, self._nickname, server.password, ircname=self._realname)
+    except irc.client.ServerConnectionError, e:
+      self.logger.warning("Couldn't connect to %s: %s", server, e)
+      self.servers.failed(server)
+      self.schedule_reconnect()
+
+  def schedule_reconnect(self):
+    if self.reconnect_scheduled:
+      return
+
+    delay = self.servers.delay()
+    self.reconnect_scheduled = True
+    self.logger.info("Reconnecting in %.1f seconds.", delay)
+    self.connection.execute_delayed(delay, self.reconnect)
+
+  def reconnect(self):
+    self.reconnect_scheduled = False
+    if not self.connection.is_connected():
+      self._connect()
+
+  # PINGs the server every LAG_INTERVAL seconds, a connection whose PONG
+  # doesn't come back within LAG_TIMEOUT is dropped and the server avoided
+  def check_lag(self, session):
+    if session != self.session or not self.connection.is_connected():
+      return
+
+    now = time.time()
+    if self.lag_ping is not None and now - self.lag_ping > servers.LAG_TIMEOUT:
+      self.logger.warning("No PONG from %s for %d seconds, reconnecting.", self.servers.current, now - self.lag_ping)
+      self.servers.failed(self.servers.current)
+      self.connection.disconnect("Ping timeout")
+      return
+
+    if self.lag_ping is None:
+      self.lag_ping = now
+      self.connection.ping("lag")
+    self.connection.execute_delayed(servers.LAG_INTERVAL, self.check_lag, (session,))
+
+  def on_pong(self, c, e):
+    if self.lag_ping is not None:
+      self.servers.current.observe(time.time() - self.lag_ping)
+      self.lag_ping = None
+
+  # checks if a user is an admin by hostmask or account, or a channel op in one of our channels
+  def is_user_admin(self, source):
+    user = self.users.get(source.nick)
+    if self.admins.match_source(source, user.account if user is not None else None):
+      return True
 
-    return False
+    return user is not None and user.opped > 0
+
+  # marks the event with the network for the shared plugins
+  def enter(self, data):
+    data.network = self.name
+    self.core.current = self
+
+  # looks up the command table once and runs either a core or a plugin command
+  def handle_command(self, conn, cmd, data):
+    command = self.core.commands.get(cmd[0])
+    if command is None:
+      return False
+
+    if command.plugin is None:
+      command.handler(self, conn, cmd[1:], data)
+      return True
+
+    self.enter(data)
+    return self.core.plugin_handle_command(conn, command.plugin, cmd, data)
+
+  def plugin_handle_event(self, conn, event, data):
+    self.enter(data)
+    self.core.plugin_handle_event(conn, event, data)
 
   # small helper function for !plugin load
   def cmd_plugin_load(self, c, nick, plugin):
     try:
-      self.load_plugin(plugin)
+      self.core.load_plugin(plugin)
     except (ImportError, PluginError) as e:
       c.privmsg(nick, "Error loading plugin: %s" % (e,))
     else:
@@ -266,9 +862,45 @@ class FloodBot(irc.bot.SingleServerIRCBot):
     ch = e.target
     nick = e.source.nick
     if nick == c.get_nickname():
-      self.channels[ch] = Channel()
+      # a channel kept over a reconnect is resynced with the NAMES list
+      if ch in self.channels and self.channels[ch].stale:
+        self.channels[ch].begin_sync()
+      else:
+        if ch in self.channels:
+          self.channels[ch].clear()
+        self.channels[ch] = Channel(self.users)
+      self.save_channels()
+
+    user = self.channels[ch].add_user(nick, e.source.host)
+
+    # with extended-join the account ("*" if none) and the real name follow the channel
+    if e.arguments and self.caps.has("extended-join"):
+      user.account = None if e.arguments[0] == "*" else e.arguments[0]
 
-    self.channels[ch].add_user(nick, e.source.host)
+  def _on_part(self, c, e):
+    self.leave(c, e.target, e.source.nick)
+
+  def _on_kick(self, c, e):
+    self.leave(c, e.target, e.arguments[0])
+
+  def leave(self, c, channel_name, nick):
+    if channel_name not in self.channels:
+      return
+
+    channel = self.channels[channel_name]
+    if nick == c.get_nickname():
+      channel.clear()
+      del self.channels[channel_name]
+      self.save_channels()
+    else:
+      channel.remove_user(nick)
+
+  # a single update for all channels we share with the user
+  def _on_nick(self, c, e):
+    self.users.rename(e.source.nick, e.target)
+
+  def _on_quit(self, c, e):
+    self.users.quit(e.source.nick)
 
   def _on_namreply(self, c, e):
     # e.arguments[0] == "@" for secret channels,
@@ -278,16 +910,59 @@ class FloodBot(irc.bot.SingleServerIRCBot):
     # e.arguments[2] == nick list
 
     ch = e.arguments[1]
+    if ch not in self.channels:
+      return
+
+    channel = self.channels[ch]
+    prefixes = c.features.prefix
     for nick in e.arguments[2].split():
-        if nick[0] == "@":
-            nick = nick[1:]
-            self.channels[ch].set_mode("o", nick)
-        elif nick[0] == "+":
-            nick = nick[1:]
-            self.channels[ch].set_mode("v", nick)
+      # with multi-prefix a nick can have several, e.g. @+nick
+      modes = []
+      while nick and nick[0] in prefixes:
+        modes.append(prefixes[nick[0]])
+        nick = nick[1:]
+
+      # with userhost-in-names the entries are nick!user@host, without it
+      # the host is only known once the user says something
+      host = ""
+      if "!" in nick:
+        nick, _, userhost = nick.partition("!")
+        host = userhost.partition("@")[2]
+
+      user = channel.add_user(nick, host)
+      if channel.syncing is not None:
+        # the modes are set once the list ended
+        channel.syncing[user].update(modes)
+      else:
+        for mode in modes:
+          channel.set_mode(mode, nick)
+
+  def on_endofnames(self, c, e):
+    ch = e.arguments[0]
+    if ch in self.channels and self.channels[ch].syncing is not None:
+      kept, left = self.channels[ch].end_sync()
+      self.logger.info("Resynced %s: %d users, %d left while we were away.", ch, kept, left)
+
+  def on_all_raw_messages(self, c, e):
+    self.count_line()
+
+  def count_line(self):
+    self.core.metrics.inbound[self.name] += 1
+
+  def on_cap(self, c, e):
+    self.caps.handle(c, e.arguments)
+
+  # account-notify, the account is "*" when the user logged out
+  def on_account(self, c, e):
+    user = self.users.get(e.source.nick)
+    if user is not None:
+      user.account = None if e.target == "*" else e.target
 
-        # there's no hostmask on the NAMES list
-        self.channels[ch].add_user(nick, "")
+  # away-notify, without a message the user is back
+  def on_away(self, c, e):
+    user = self.users.get(e.source.nick)
+    if user is not None:
+      user.away = bool(e.target)
 
   # automatically append an underscore when the desired nickname is in use
   def on_nicknameinuse(self, c, e):
@@ -295,17 +970,15 @@ class FloodBot(irc.bot.SingleServerIRCBot):
 
   def on_join(self, c, e):
     # run JOIN event
-    try:
-      self.plugin_handle_event(c, "JOIN", e)
-    except PluginError, e:
-      return
+    self.plugin_handle_event(self.sendq, "JOIN", e)
 
   def on_part(self, c, e):
     # run PART event
-    try:
-      self.plugin_handle_event(c, "PART", e)
-    except PluginError, e:
-      return
+    self.plugin_handle_event(self.sendq, "PART", e)
+
+  def on_quit(self, c, e):
+    # run QUIT event
+    self.plugin_handle_event(self.sendq, "QUIT", e)
   
   def on_pubmsg(self, c, e):
     channel_name = e.target
@@ -318,32 +991,26 @@ class FloodBot(irc.bot.SingleServerIRCBot):
     channel = self.channels[channel_name]
     user = channel.get_user(nick)
 
-    # this should actually never happen
-    # but it does on servers with specific channel owner mode ("~")
-    # this probably is a bug in python-irc
+    # this should actually never happen, the NAMES prefixes are taken
+    # from the server's PREFIX, so owners ("~") are known as well
     if user == None:
-      self.logger.error("Unknown user: '%s'. I'm scared!" % (nick))
+      self.logger.error("Unknown user: '%s'. I'm scared!", nick)
       return
 
-    # when we join a channel, we don't have the host of users already in there
-    # so we update this once they say something
+    # without userhost-in-names we don't have the host of users that were
+    # in a channel before us, so we update this once they say something
     if user.host == "":
       user.set_host(e.source.host)
     
     # run PUBMSG event
-    try:
-      self.plugin_handle_event(c, "PUBMSG", e)
-    except PluginError, e:
-      return
+    self.plugin_handle_event(self.sendq, "PUBMSG", e)
 
   def on_privnotice(self, c, e):
     # run PRIVNOTICE event
-    try:
-      self.plugin_handle_event(c, "PRIVNOTICE", e)
-    except PluginError, e:
-      return
+    self.plugin_handle_event(self.sendq, "PRIVNOTICE", e)
 
   def on_privmsg(self, c, e):
+    c = self.sendq
     nick = e.source.nick
 
     # extract message from arguments, strip
@@ -353,142 +1020,264 @@ class FloodBot(irc.bot.SingleServerIRCBot):
     if not msg.startswith("!"):
       return
 
-    # allow authorization of non-op admins
-    if msg.startswith("!secret"):
-      if " " not in msg:
-        return
+    cmd = msg.split(" ")
 
-      secret = msg.split(" ")[1]
+    # only lower the first part as this is the command
+    cmd[0] = cmd[0].lower()
 
-      if self.admin_secret and secret == self.admin_secret:
-        self.admins.add(e.source)
-        self.logger.info("Authorized '" + e.source + "' as admin!")
-        c.privmsg(nick, "You have been authorized!")
-      else:
-        self.logger.warning("Unsuccessful login attempt by '" + nick + "' (" + e.source + "): '" + msg + "'")
-      
+    # public commands such as !secret don't need authorization
+    command = self.core.commands.get(cmd[0])
+    if command is not None and command.public:
+      command.handler(self, c, cmd[1:], e)
       return
 
     # only allow admins to issue commands
     # log unauthorized tries
     if not self.is_user_admin(e.source):
-      self.logger.warning("Unauthorized command by user '" + nick + "' (" + e.source + ")")
+      self.logger.warning("Unauthorized command by user '%s' (%s)", nick, e.source)
       return False
     
-    self.logger.info("User '" + nick + "' (" + e.source + ") issued command: '" + msg + "'")
+    self.logger.info("User '%s' (%s) issued command: '%s'", nick, e.source, msg)
 
-    cmd = msg.split(" ")
+    # run core or plugin handler
+    try:
+      self.handle_command(c, cmd, e)
+    except PluginError, e:
+      c.privmsg(nick, e.msg)
+      return
 
-    # only lower the first part as this is the command
-    cmd[0] = cmd[0].lower()
+  # allow authorization of non-op admins
+  def cmd_secret(self, c, params, e):
+    nick = e.source.nick
+
+    if len(params) < 1:
+      return
 
-    if cmd[0] == "!plugin":
-      if len(cmd) < 2:
-        c.privmsg(nick, "!plugin load <name>|unload <name>|info <name|list - Manage the bot's plugins")
-        return
-
-      if len(cmd) == 2:
-        if cmd[1] == "list":
-          plugin_list = [x if x not in self.plugins else x + "*" for x in self.get_plugin_list() ]
-          c.privmsg(nick, "Plugins: %s" % (', '.join(plugin_list)))
-      elif len(cmd) == 3:
-        if cmd[1] == "load":
-          plugin = cmd[2]
-          if plugin in self.plugins:
-            c.privmsg(nick, "This plugin is already running.")
-            return
-
-          if plugin not in self.get_plugin_list():
-            c.privmsg(nick, "No such plugin '%s'!" % (plugin,))
-            return
-
-          self.cmd_plugin_load(c, nick, plugin)
-
-        elif cmd[1] == "unload":
-          plugin = cmd[2]
-          if plugin not in self.plugins:
-            c.privmsg(nick, "This plugin is not running.")
-            return
-
-          self.unload_plugin(plugin)
-
-        elif cmd[1] == "reload":
-          plugin = cmd[2]
-          if plugin not in self.plugins:
-            c.privmsg(nick, "This plugin is not running.")
-            return
-         
-          self.unload_plugin(plugin)
-          self.cmd_plugin_load(c, nick, plugin)
-
-        elif cmd[1] == "info":
-          plugin = cmd[2]
-
-          if plugin not in self.plugins:
-            c.privmsg(nick, "Plugin has to be running first.")
-            return
-
-          c.privmsg(nick, str(self.plugins[plugin]))
-          c.privmsg(nick, self.plugins[plugin].get_description())
+    if self.admin_secret and params[0] == self.admin_secret:
+      self.admins.add(e.source)
+      self.save_admins()
+      self.logger.info("Authorized '%s' as admin!", e.source)
+      c.privmsg(nick, "You have been authorized!")
+    else:
+      self.logger.warning("Unsuccessful login attempt by '%s' (%s): '%s'", nick, e.source, " ".join(params))
+
+  def cmd_plugin(self, c, params, e):
+    nick = e.source.nick
+
+    if len(params) < 1:
+      c.privmsg(nick, self.core.commands["!plugin"].usage)
+      return
+
+    if len(params) == 1:
+      if params[0] == "list":
+        plugin_list = [x if x not in self.core.plugins else x + "*" for x in self.core.get_plugin_list() ]
+        c.privmsg(nick, "Plugins: %s" % (', '.join(plugin_list)))
+    elif len(params) == 2:
+      plugin = params[1]
+
+      if params[0] == "load":
+        if plugin in self.core.plugins:
+          c.privmsg(nick, "This plugin is already running.")
+          return
+
+        if plugin not in self.core.get_plugin_list():
+          c.privmsg(nick, "No such plugin '%s'!" % (plugin,))
+          return
+
+        self.cmd_plugin_load(c, nick, plugin)
+
+      elif params[0] == "unload":
+        if plugin not in self.core.plugins:
+          c.privmsg(nick, "This plugin is not running.")
+          return
+
+        self.core.unload_plugin(plugin)
+
+      elif params[0] == "reload":
+        if plugin not in self.core.plugins:
+          c.privmsg(nick, "This plugin is not running.")
+          return
+       
+        self.core.unload_plugin(plugin)
+        self.cmd_plugin_load(c, nick, plugin)
+
+      elif params[0] == "info":
+        info = self.core.plugin_index.get(plugin)
+        if info is None:
+          c.privmsg(nick, "No such plugin '%s'!" % (plugin,))
+          return
+
+        if plugin in self.core.plugins:
+          state = "running" if self.core.plugins[plugin].instance is not None else "loaded, set up on first use"
+        else:
+          state = "not loaded"
+
+        c.privmsg(nick, "%s - %s (%s)" % (info.long_name, info.author, state))
+        c.privmsg(nick, info.description)
+        if info.commands or info.events:
+          c.privmsg(nick, "Commands: %s, events: %s" % (', '.join(x[0] for x in info.commands) or "none", ', '.join(info.events) or "none"))
+
+  # the command list is generated from the command table
+  def cmd_help(self, c, params, e):
+    nick = e.source.nick
 
+    if len(params) < 1:
+      owners = {}
+      for name, command in self.core.commands.items():
+        owners.setdefault(command.get_owner(), []).append(name)
+
+      c.privmsg(nick, CTCP_VERSION)
+      c.privmsg(nick, "For help on a certain plugin or command, use !help <plugin> or !help <command>.")
+      c.privmsg(nick, "Available core commands: %s" % (', '.join(sorted(owners.pop("core", [])))))
+      for owner in sorted(owners):
+        c.privmsg(nick, "Commands of plugin '%s': %s" % (owner, ', '.join(sorted(owners[owner]))))
       return
 
-    elif cmd[0] == "!help":
-      if len(cmd) < 2:
-        c.privmsg(nick, CTCP_VERSION)
-        c.privmsg(nick, "For help on a certain plugin, use !help <plugin>.")
-        c.privmsg(nick, "Available core commands: !plugin, !admin, !secret")
+    if params[0] in self.core.plugins:
+      if self.core.ensure_active(self.core.plugins[params[0]]):
+        self.core.plugins[params[0]].handle_help(c, e)
       else:
-        if cmd[1] in self.plugins:
-          self.plugins[cmd[1]].handle_help(c, e)
-
-    # admin management
-    elif cmd[0] == "!admin":
-      if len(cmd) < 2:
-        c.privmsg(nick, "!admin list|remove <hostmask>|purge - Manage administrators")
-        return
-      
-      if len(cmd) == 2:
-        if cmd[1] == "list":
-          if not len(self.admins):
-            c.privmsg(nick, "There are no administrators!")
-
-          for admin in self.admins:
-            c.privmsg(nick, admin)
-        elif cmd[1] == "purge":
-          c.privmsg(nick, "Administrator list purged! Admins will have to log in again next time.")
-          c.admins = set()
-      elif len(cmd) == 3:
-        if cmd[1] == "remove":
-          if cmd[2] in self.admins:
-            c.privmsg(nick, "Removing " + cmd[2] + " from admin list ...")
-            self.admins.remove(cmd[2])
-          else:
-            c.privmsg(nick, "No such hostmask on the admin list: '" + cmd[2] + "'")
-
-    # run plugin handlers and return in case one has been found
-    try:
-      if self.plugin_handle_command(c, cmd, e):
-        return
-    except PluginError, e:
-      c.privmsg(nick, e.msg)
+        c.privmsg(nick, "Plugin '%s' could not be set up and was unloaded!" % (params[0]))
       return
 
+    name = params[0].lower()
+    if not name.startswith("!"):
+      name = "!" + name
+
+    if name not in self.core.commands:
+      c.privmsg(nick, "No such plugin or command '%s'!" % (params[0]))
+    elif self.core.commands[name].usage:
+      c.privmsg(nick, self.core.commands[name].usage)
+    else:
+      c.privmsg(nick, "%s is provided by plugin '%s', see !help %s" % (name, self.core.commands[name].get_owner(), self.core.commands[name].get_owner()))
+
+  def cmd_sendq(self, c, params, e):
+    c.privmsg(e.source.nick, "Send queue: %s" % (self.sendq))
+
+  def cmd_moderation(self, c, params, e):
+    c.privmsg(e.source.nick, "Moderation: %s" % (self.moderation))
+
+  def cmd_networks(self, c, params, e):
+    for network in self.core.networks.values():
+      state = "connected" if network.connection.is_connected() else "disconnected"
+      c.privmsg(e.source.nick, "%s (%s): %s, channels: %s" % (network.name, network.servers.current, state, ", ".join(network.channels) or "none"))
+      c.privmsg(e.source.nick, "%s servers: %s" % (network.name, network.servers))
+
+  # admin management
+  def cmd_admin(self, c, params, e):
+    nick = e.source.nick
+
+    if len(params) < 1:
+      c.privmsg(nick, self.core.commands["!admin"].usage)
+      return
+    
+    if len(params) == 1:
+      if params[0] == "list":
+        if not len(self.admins):
+          c.privmsg(nick, "There are no administrators!")
+
+        for admin in self.admins:
+          c.privmsg(nick, admin)
+      elif params[0] == "purge":
+        c.privmsg(nick, "Administrator list purged! Admins will have to log in again next time.")
+        self.admins.clear()
+        self.save_admins()
+    elif len(params) == 2:
+      if params[0] == "add":
+        try:
+          mask = self.admins.add(params[1])
+        except ValueError, e:
+          c.privmsg(nick, str(e))
+          return
+        self.save_admins()
+        c.privmsg(nick, "Added " + mask + " to admin list.")
+      elif params[0] == "remove":
+        if params[1] in self.admins:
+          c.privmsg(nick, "Removing " + params[1] + " from admin list ...")
+          self.admins.remove(params[1])
+          self.save_admins()
+        else:
+          c.privmsg(nick, "No such hostmask on the admin list: '" + params[1] + "'")
+
+  def save_admins(self):
+    self.state.set("admins", list(self.admins))
+
+  # the channels we are in are rejoined after a restart
+  def save_channels(self):
+    self.state.set("channels", sorted(self.channels.keys()))
+
   def on_welcome(self, c, e):
-    for channel in self.autojoin_channels:
-      c.join(channel)
+    self.session += 1
+    self.registered = True
+    self.autojoined = False
+    self.lag_ping = None
+    self.servers.connected(self.servers.current)
+    self.logger.info("Connected to %s.", self.servers.current)
+
+    self.connection.execute_delayed(servers.LAG_INTERVAL, self.check_lag, (self.session,))
+    self.connection.execute_delayed(AUTOJOIN_DELAY, self.autojoin, (self.session,))
+    self.connection.execute_delayed(RESYNC_TIMEOUT, self.drop_stale_channels, (self.session,))
+
+  # channels are joined once the server sent its ISUPPORT (005) and MOTD,
+  # so TARGMAX is known, with as many channels per JOIN as it allows
+  def on_endofmotd(self, c, e):
+    self.autojoin(self.session)
+
+  def on_nomotd(self, c, e):
+    self.autojoin(self.session)
+
+  def autojoin(self, session):
+    if session != self.session or self.autojoined:
+      return
+    self.autojoined = True
+
+    channels = collections.OrderedDict()
+    for channel in self.autojoin_channels + self.state.get("channels", []) + list(self.channels.keys()):
+      channels.setdefault(irc.strings.lower(channel.strip()), channel.strip())
+
+    targmax = getattr(self.connection.features, "targmax", None) or {}
+    for line in join_lines(channels.values(), targmax.get("JOIN")):
+      self.sendq.send_raw(line)
+
+  # channels kept over a reconnect that we couldn't rejoin, e.g. because
+  # of a ban, are dropped but stay on the list of channels to join
+  def drop_stale_channels(self, session):
+    if session != self.session:
+      return
+
+    for name, channel in list(self.channels.items()):
+      if channel.stale:
+        self.logger.warning("Couldn't rejoin %s, dropping it.", name)
+        channel.clear()
+        del self.channels[name]
 
   # the default method causes the bot to crash on my server
   # Overwriting this is a good idea anyway
   def get_version(self):
     return CTCP_VERSION
 
+  # replaces the library's reconnect to the same server after a fixed time,
+  # channels and users are kept as a snapshot until they are rejoined
   def _on_disconnect(self, c, e):
-    self.logger.info("Disconnected, attempting to reconnect ...")
-    super(FloodBot, self)._on_disconnect(c, e)
+    if self.registered:
+      self.logger.info("Disconnected from %s, attempting to reconnect ...", self.servers.current)
+    else:
+      self.logger.warning("Lost connection to %s before registering.", self.servers.current)
+      self.servers.failed(self.servers.current)
+
+    self.session += 1
+    self.registered = False
+    self.sendq.clear()
+    self.moderation.clear()
+    for channel in self.channels.values():
+      channel.stale = True
+      channel.syncing = None
+
+    self.servers.probe()
+    self.schedule_reconnect()
 
 
-def main(nick, server, port, log_level, config, stdout):
+def main(nick, server, port, log_level, config, stdout, use_asyncio=False):
   import sys
 
   numeric_level = getattr(logging, log_level.upper(), None)
@@ -496,22 +1285,27 @@ def main(nick, server, port, log_level, config, stdout):
     print('Invalid log level: %s' % loglevel)
     sys.exit(-1)
 
-  # logging setup
-  logger = logging.getLogger("DontMindMe")
-  logger.setLevel(numeric_level)
-
-  fmt = logging.Formatter("%(asctime)s %(message)s")
-
+  # logging setup, the core logs as DontMindMe, plugins as Core.<plugin>
   if stdout:
-    sh = logging.StreamHandler()
-    sh.setFormatter(logging.Formatter("%(asctime)s [%(name)s::%(levelname)s] %(message)s"))
-    sh.setLevel(numeric_level)
-    logger.addHandler(sh)
+    target = logging.StreamHandler()
   else:
-    fh = logging.handlers.SysLogHandler(address="/dev/log", facility=logging.handlers.SysLogHandler.LOG_DAEMON)
-    fh.setFormatter(logging.Formatter("%(asctime)s [%(name)s::%(levelname)s] %(message)s"))
-    fh.setLevel(numeric_level)
-    logger.addHandler(fh)
+    target = logging.handlers.SysLogHandler(address="/dev/log", facility=logging.handlers.SysLogHandler.LOG_DAEMON)
+  target.setFormatter(logging.Formatter("%(asctime)s [%(name)s::%(levelname)s] %(message)s"))
+  target.setLevel(numeric_level)
+
+  # the format uses neither, so they don't have to be looked up for every record
+  logging.logThreads = 0
+  logging.logProcesses = 0
+  logging.logMultiprocessing = 0
+
+  # records are written by a background thread and limited per call site
+  log_queue = logqueue.QueueHandler([target])
+  log_queue.setLevel(numeric_level)
+
+  logger = logging.getLogger("DontMindMe")
+  for name in ("DontMindMe", "Core"):
+    logging.getLogger(name).setLevel(numeric_level)
+    logging.getLogger(name).addHandler(log_queue)
 
   # no config file supplied, look for one
   if not config:
@@ -528,15 +1322,26 @@ def main(nick, server, port, log_level, config, stdout):
   irc.client.ServerConnection.buffer_class = irc.client.LineBuffer
   
   
+  core = None
   try:
-    bot = FloodBot(logger, config, nick, server, port)
-    bot.start()
+    core = BotCore(logger, config, nick, server, port)
+    log_queue.rate = float(core.get_option(None, "log_rate", logqueue.RATE))
+    log_queue.burst = int(core.get_option(None, "log_burst", logqueue.BURST))
+
+    if use_asyncio:
+      import aiocore
+      aiocore.install(core)
+
+    core.start()
   except BotError, e:
     logger.exception("Bot Error: ")
     logging.shutdown()
   except KeyboardInterrupt:
     logger.info("Application terminated, shutting down ...")
     logging.shutdown()
+  finally:
+    if core is not None:
+      core.close()
 
 if __name__ == "__main__":
   import argparse
@@ -549,6 +1354,7 @@ if __name__ == "__main__":
   parser.add_argument("--config", "-c", type=str, default="", help="Path to the bot's config file")
   parser.add_argument("--stdout", action="store_true", help="Print log to stdout")
   parser.add_argument("--foreground", action="store_true", help="Don't daemonize")
+  parser.add_argument("--asyncio", action="store_true", help="Run on asyncio instead of the irc library's select loop")
   args = parser.parse_args()
 
   nick = args.nickname
@@ -557,9 +1363,10 @@ if __name__ == "__main__":
   log_level = args.log_level
   config = args.config
   stdout = args.stdout
+  use_asyncio = args.asyncio
 
   if args.foreground:
-    main(nick, server, port, log_level, config, stdout)
+    main(nick, server, port, log_level, config, stdout, use_asyncio)
   else:
     with daemon.DaemonContext(pidfile=pidfile.PidFile("/var/run/dontmindme.pid"), uid=1006, gid=1006):
-      main(nick, server, port, log_level, config, stdout)
+      main(nick, server, port, log_level, config, stdout, use_asyncio)
@@ -0,0 +1,97 @@
+import logging
+
+import lineparser
+
+# the IRCv3 capabilities the bot asks for, if the server offers them
+WANTED                 = ("multi-prefix", "userhost-in-names", "extended-join", "account-notify", "away-notify", "message-tags")
+
+# only asked for with the lazy parser: the irc library takes message tags
+# for the command and fails on an AWAY without parameters (away-notify)
+LAZY_ONLY              = ("message-tags", "away-notify")
+
+logger = logging.getLogger("DontMindMe.Capabilities")
+
+# negotiates the capabilities of a connection
+#
+# CAP LS 302 is sent right after connecting, before NICK and USER, so the
+# server holds the registration until CAP END. all wanted capabilities the
+# server lists are requested with one CAP REQ and the negotiation ends once
+# the server acknowledged or rejected them. a server without CAP answers
+# with an unknown command error and registers us as usual. capabilities
+# offered or removed later with CAP NEW and CAP DEL are followed as well.
+class Negotiation(object):
+  def __init__(self, wanted=WANTED):
+    self.wanted = set(wanted)
+    self.offered = set()
+    self.requested = set()
+    self.enabled = set()
+    self.registering = False
+
+  def start(self, connection):
+    self.offered.clear()
+    self.requested.clear()
+    self.enabled.clear()
+    if not self.wanted:
+      return
+
+    self.registering = True
+    connection.cap("LS", "302")
+
+  # the arguments of a CAP event, such as ["LS", "*", "multi-prefix sasl"]
+  def handle(self, connection, arguments):
+    if not arguments:
+      return
+
+    subcommand = arguments[0].upper()
+    # values like sasl=PLAIN,EXTERNAL aren't used
+    caps = [x.split("=", 1)[0] for x in arguments[-1].split()] if len(arguments) > 1 else []
+
+    if subcommand == "LS":
+      self.offered.update(caps)
+      # a "*" before the list means more lines follow
+      if len(arguments) < 3 or arguments[1] != "*":
+        self.request(connection, self.offered)
+    elif subcommand == "NEW":
+      self.offered.update(caps)
+      self.request(connection, caps)
+    elif subcommand == "DEL":
+      self.offered.difference_update(caps)
+      self.enabled.difference_update(caps)
+    elif subcommand == "ACK":
+      for cap in caps:
+        if cap.startswith("-"):
+          self.enabled.discard(cap[1:])
+        else:
+          self.enabled.add(cap)
+      self.requested.clear()
+      logger.info("Enabled capabilities: %s", ", ".join(sorted(self.enabled)) or "none")
+      self.end(connection)
+    elif subcommand == "NAK":
+      logger.warning("Server rejected capabilities: %s", " ".join(caps))
+      self.requested.clear()
+      self.end(connection)
+
+  def request(self, connection, caps):
+    wanted = self.wanted
+    if not isinstance(connection, lineparser.LazyLineParser):
+      wanted = wanted.difference(LAZY_ONLY)
+
+    caps = sorted(wanted.intersection(caps) - self.enabled)
+    if not caps:
+      self.end(connection)
+      return
+
+    self.requested.update(caps)
+    connection.cap("REQ", *caps)
+
+  # registration goes on once nothing is waiting for an answer
+  def end(self, connection):
+    if self.registering and not self.requested:
+      self.registering = False
+      connection.cap("END")
+
+  def has(self, cap):
+    return cap in self.enabled
+
+  def __str__(self):
+    return ", ".join(sorted(self.enabled)) or "none"
@@ -0,0 +1,250 @@
+import re
+import socket
+import string
+import binascii
+
+WILDCARDS              = "*?"
+ACCOUNT_PREFIX         = "$a:"
+
+# RFC 1459 case mapping, []\^ are the upper case of {}|~
+UPPER                  = string.ascii_uppercase + "[]\\^"
+LOWER                  = string.ascii_lowercase + "{}|~"
+FOLD_BYTES             = string.maketrans(UPPER, LOWER)
+FOLD_UNICODE           = dict(zip(map(ord, UPPER), map(ord, LOWER)))
+
+# completes a mask to nick!user@host, a plain nick matches any user and host.
+# raises a ValueError for masks that can't be completed, such as a@b!c
+def normalize(text):
+  mask = text.strip()
+  if mask.startswith(ACCOUNT_PREFIX):
+    if len(mask) == len(ACCOUNT_PREFIX):
+      raise ValueError("Invalid hostmask, no account: '%s'" % (text))
+    return mask
+
+  if "!" not in mask and "@" not in mask:
+    mask += "!*@*"
+  elif "!" not in mask:
+    mask = "*!" + mask
+  elif "@" not in mask:
+    mask += "@*"
+
+  nick, _, rest = mask.partition("!")
+  user, _, host = rest.rpartition("@")
+  if not nick or not user or not host or "@" in nick:
+    raise ValueError("Invalid hostmask, expected nick!user@host: '%s'" % (text))
+  return mask
+
+def has_wildcards(text):
+  return any(x in text for x in WILDCARDS)
+
+# * and ? only, brackets are valid in nicks and match themselves
+def translate(pattern):
+  return "".join(".*" if x == "*" else "." if x == "?" else re.escape(x) for x in pattern) + r"\Z"
+
+def fold(text):
+  if isinstance(text, unicode):
+    return text.translate(FOLD_UNICODE)
+  return text.translate(FOLD_BYTES)
+
+# (version, address as int) or None if text is no IP address
+def parse_ip(text):
+  for family, version in ((socket.AF_INET, 4), (socket.AF_INET6, 6)):
+    try:
+      return version, int(binascii.hexlify(socket.inet_pton(family, text)), 16)
+    except (socket.error, ValueError, UnicodeError):
+      pass
+  return None
+
+# (version, prefix length, network as int) or None if text is no CIDR range
+def parse_cidr(text):
+  if "/" not in text:
+    return None
+
+  address, length = text.rsplit("/", 1)
+  ip = parse_ip(address)
+  if ip is None or not length.isdigit():
+    return None
+
+  version, value = ip
+  bits = 32 if version == 4 else 128
+  length = int(length)
+  if length > bits:
+    return None
+  return version, length, value >> (bits - length) << (bits - length)
+
+class Mask(object):
+  __slots__ = ("mask", "regex")
+
+  def __init__(self, mask, cidr=False):
+    self.mask = mask
+
+    # with a CIDR range only nick and user are left to the regex
+    if cidr:
+      pattern = mask.rsplit("@", 1)[0]
+    else:
+      pattern = mask
+    self.regex = re.compile(translate(fold(pattern)), re.DOTALL)
+
+# a set of hostmasks that can be matched against a user as a whole
+#
+# masks are nick!user@host with * and ? wildcards, the host may be a CIDR
+# range, or $a:<account>. they are indexed by the most specific part
+# they have: the account, the exact host, a host suffix (*.example.com),
+# a host prefix (gateway/web/*), a CIDR range or the exact nick. a match
+# costs a lookup per index (and per distinct suffix, prefix or range
+# length), only masks without any literal part are tried one by one.
+class MaskSet(object):
+  def __init__(self, masks=()):
+    self.masks = {}
+    self.accounts = {}
+    self.hosts = {}
+    self.suffixes = {}
+    self.prefixes = {}
+    self.cidrs = {}
+    self.nicks = {}
+    self.others = []
+
+    for mask in masks:
+      self.add(mask)
+
+  def index(self, mask):
+    if mask.startswith(ACCOUNT_PREFIX):
+      return self.accounts, fold(mask[len(ACCOUNT_PREFIX):]), None
+
+    nick, rest = mask.split("!", 1)
+    host = rest.rsplit("@", 1)[1]
+
+    cidr = parse_cidr(host)
+    if cidr is not None:
+      return self.cidrs, cidr[:2], cidr[2]
+    if not has_wildcards(host):
+      return self.hosts, fold(host), None
+    if len(host) > 1 and host.startswith("*") and not has_wildcards(host[1:]):
+      return self.suffixes, len(host) - 1, fold(host[1:])
+    if len(host) > 1 and host.endswith("*") and not has_wildcards(host[:-1]):
+      return self.prefixes, len(host) - 1, fold(host[:-1])
+    if not has_wildcards(nick):
+      return self.nicks, fold(nick), None
+    return None, None, None
+
+  # returns the normalized mask, raises a ValueError for invalid masks
+  def add(self, mask):
+    mask = normalize(mask)
+    if mask in self.masks:
+      return mask
+
+    table, key, value = self.index(mask)
+    entry = Mask(mask, table is self.cidrs)
+    self.masks[mask] = entry
+
+    if table is None:
+      self.others.append(entry)
+    elif table is self.accounts or table is self.hosts or table is self.nicks:
+      table.setdefault(key, []).append(entry)
+    else:
+      # suffixes and prefixes by length, CIDR ranges by (version, length)
+      table.setdefault(key, {}).setdefault(value, []).append(entry)
+
+    return mask
+
+  def remove(self, mask):
+    try:
+      mask = normalize(mask)
+    except ValueError:
+      return False
+
+    entry = self.masks.pop(mask, None)
+    if entry is None:
+      return False
+
+    table, key, value = self.index(mask)
+    if table is None:
+      self.others.remove(entry)
+      return True
+
+    if table is self.accounts or table is self.hosts or table is self.nicks:
+      bucket = table[key]
+    else:
+      bucket = table[key][value]
+
+    bucket.remove(entry)
+    if not bucket:
+      if table is self.accounts or table is self.hosts or table is self.nicks:
+        del table[key]
+      else:
+        del table[key][value]
+        if not table[key]:
+          del table[key]
+    return True
+
+  def clear(self):
+    for mask in list(self.masks):
+      self.remove(mask)
+
+  # the first mask matching the user or None
+  def find(self, nick, user, host, account=None):
+    if not self.masks:
+      return None
+
+    if account and self.accounts:
+      for entry in self.accounts.get(fold(account), ()):
+        return entry.mask
+
+    host = fold(host or "")
+    full = "%s!%s@%s" % (fold(nick), fold(user or ""), host)
+
+    for entry in self.hosts.get(host, ()):
+      if entry.regex.match(full):
+        return entry.mask
+
+    for length, table in self.suffixes.items():
+      for entry in table.get(host[-length:], ()) if len(host) >= length else ():
+        if entry.regex.match(full):
+          return entry.mask
+
+    for length, table in self.prefixes.items():
+      for entry in table.get(host[:length], ()) if len(host) >= length else ():
+        if entry.regex.match(full):
+          return entry.mask
+
+    if self.cidrs:
+      ip = parse_ip(host)
+      if ip is not None:
+        version, value = ip
+        bits = 32 if version == 4 else 128
+        name = full.rsplit("@", 1)[0]
+        for (cidr_version, length), table in self.cidrs.items():
+          if cidr_version != version:
+            continue
+          for entry in table.get(value >> (bits - length) << (bits - length), ()):
+            if entry.regex.match(name):
+              return entry.mask
+
+    for entry in self.nicks.get(fold(nick), ()):
+      if entry.regex.match(full):
+        return entry.mask
+
+    for entry in self.others:
+      if entry.regex.match(full):
+        return entry.mask
+
+    return None
+
+  def match(self, nick, user, host, account=None):
+    return self.find(nick, user, host, account) is not None
+
+  # source is an irc.client.NickMask
+  def match_source(self, source, account=None):
+    return self.find(source.nick, source.user, source.host, account) is not None
+
+  def __contains__(self, mask):
+    try:
+      return normalize(mask) in self.masks
+    except ValueError:
+      return False
+
+  def __iter__(self):
+    return iter(sorted(self.masks))
+
+  def __len__(self):
+    return len(self.masks)
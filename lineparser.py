@@ -0,0 +1,258 @@
+import irc.client
+import irc.events
+
+CTCP_DELIMITER         = "\001"
+
+# the connection keeps these up to date, so they are parsed even if no one
+# handles the event
+STATEFUL               = set(["nick", "welcome", "featurelist"])
+
+TAG_ESCAPES            = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+# values of IRCv3 message tags, \: \s \\ \r \n are unescaped
+def unescape_tag(value):
+  if "\\" not in value:
+    return value
+
+  result = []
+  i = 0
+  while i < len(value):
+    if value[i] == "\\" and i + 1 < len(value):
+      result.append(TAG_ESCAPES.get(value[i + 1], value[i + 1]))
+      i += 2
+    else:
+      if value[i] != "\\":
+        result.append(value[i])
+      i += 1
+  return "".join(result)
+
+# a raw line that is only parsed as far as someone asks for
+#
+# the positions of tags, prefix and command are found with find() on the
+# line itself, nothing is copied until a part is actually read. the
+# parameters are split the same way the irc library does.
+class Line(object):
+  __slots__ = ("raw", "tags_end", "prefix_start", "prefix_end", "command_start", "command_end", "_tags", "_params")
+
+  def __init__(self, raw):
+    self.raw = raw
+    self._tags = None
+    self._params = None
+
+    position = 0
+    self.tags_end = 0
+    if raw.startswith("@"):
+      end = raw.find(" ")
+      self.tags_end = end if end >= 0 else len(raw)
+      position = self.skip_spaces(self.tags_end)
+
+    self.prefix_start = self.prefix_end = position
+    if raw.startswith(":", position):
+      end = raw.find(" ", position)
+      self.prefix_end = end if end >= 0 else len(raw)
+      position = self.skip_spaces(self.prefix_end)
+
+    self.command_start = position
+    end = raw.find(" ", position)
+    self.command_end = end if end >= 0 else len(raw)
+
+  def skip_spaces(self, position):
+    while position < len(self.raw) and self.raw[position] == " ":
+      position += 1
+    return position
+
+  @property
+  def prefix(self):
+    if self.prefix_end == self.prefix_start:
+      return None
+    return self.raw[self.prefix_start + 1:self.prefix_end]
+
+  # lower case, numerics translated to their names like the irc library does
+  @property
+  def command(self):
+    command = self.raw[self.command_start:self.command_end].lower()
+    return irc.events.numeric.get(command, command)
+
+  @property
+  def tags(self):
+    if self._tags is None:
+      self._tags = {}
+      if self.tags_end:
+        for tag in self.raw[1:self.tags_end].split(";"):
+          key, _, value = tag.partition("=")
+          if key:
+            self._tags[key] = unescape_tag(value)
+    return self._tags
+
+  # None if there are none, like the irc library
+  def params(self):
+    if self._params is None:
+      rest = self.raw[self.command_end:]
+      if len(rest) < 2:
+        return None
+
+      parts = rest.split(" :", 1)
+      self._params = parts[0].split()
+      if len(parts) == 2:
+        self._params.append(parts[1])
+    return self._params
+
+# a nickmask that is split once instead of on every access, a source
+# without user or host has them empty rather than raising
+class Source(irc.client.NickMask):
+  def parts(self):
+    parts = self.__dict__.get("_parts")
+    if parts is None:
+      nick, _, userhost = self.partition("!")
+      user, _, host = userhost.partition("@")
+      parts = self.__dict__["_parts"] = (nick, userhost, user, host)
+    return parts
+
+  @property
+  def nick(self):
+    return self.parts()[0]
+
+  @property
+  def userhost(self):
+    return self.parts()[1]
+
+  @property
+  def user(self):
+    return self.parts()[2]
+
+  @property
+  def host(self):
+    return self.parts()[3]
+
+# an event that carries its line, so the tags are only decoded if read
+class Event(irc.client.Event):
+  def __init__(self, type, source, target, arguments, line):
+    irc.client.Event.__init__(self, type, source, target, arguments)
+    self.line = line
+
+  @property
+  def tags(self):
+    return self.line.tags
+
+# replaces the line parsing of a server connection
+#
+# the event type of a line is known from its command and, for messages and
+# modes, its target. lines of a type no handler and no on_<type> method of
+# the listener is interested in are dropped right there, before the
+# arguments, the source or any event is built. besides it understands
+# IRCv3 message tags, which the irc library takes for the command.
+class LazyLineParser(object):
+  listener = None
+  on_line = None
+  wanted = None
+  wanted_version = None
+
+  # the listener is the bot, whose on_<type> methods count as handlers,
+  # on_line is called for every line instead of an all_raw_messages event
+  def attach(self, listener, on_line=None):
+    self.listener = listener
+    self.on_line = on_line
+    self.wanted_version = None
+
+  def wants(self, type):
+    handlers = self.irclibobj.handlers
+    connection_handlers = getattr(self, "handlers", {})
+
+    # handlers are only ever added for new types, so their number is enough
+    version = (len(handlers), len(connection_handlers))
+    if version != self.wanted_version:
+      self.wanted = {}
+      self.wanted_version = version
+    elif type in self.wanted:
+      return self.wanted[type]
+
+    if self.listener is None or type in handlers or type in connection_handlers:
+      wanted = True
+    elif type == "all_raw_messages" and self.on_line is not None:
+      wanted = False
+    else:
+      wanted = hasattr(self.listener, "on_" + type)
+
+    self.wanted[type] = wanted
+    return wanted
+
+  def _process_line(self, raw):
+    if self.on_line is not None:
+      self.on_line()
+    if self.wants("all_raw_messages"):
+      self._handle_event(irc.client.Event("all_raw_messages", self.get_server_name(), None, [raw]))
+
+    line = Line(raw)
+    command = line.command
+    if not self.real_server_name and line.prefix:
+      self.real_server_name = line.prefix
+
+    # CTCP messages may turn into several events, they are always parsed
+    ctcp = False
+    type = command
+    if command == "privmsg" or command == "notice":
+      params = line.params()
+      if params is None or len(params) < 2:
+        return
+
+      ctcp = CTCP_DELIMITER in raw
+      channel = irc.client.is_channel(params[0])
+      if command == "privmsg":
+        type = "pubmsg" if channel else "privmsg"
+      else:
+        type = "pubnotice" if channel else "privnotice"
+    elif command == "mode":
+      params = line.params()
+      if not params or not irc.client.is_channel(params[0]):
+        type = "umode"
+
+    wanted = ctcp or self.wants(type)
+    if not wanted and command not in STATEFUL:
+      return
+
+    prefix = line.prefix
+    arguments = line.params() or []
+
+    if command == "nick":
+      if arguments and Source(prefix).nick == self.real_nickname:
+        self.real_nickname = arguments[0]
+    elif command == "welcome" and arguments:
+      self.real_nickname = arguments[0]
+    elif command == "featurelist":
+      self.features.load(arguments)
+
+    if not wanted:
+      return
+
+    if command == "privmsg" or command == "notice":
+      target, message = arguments[0], arguments[1]
+      source = Source(prefix)
+
+      if not ctcp:
+        self._handle_event(Event(type, source, target, [message], line))
+        return
+
+      for m in irc.client._ctcp_dequote(message):
+        if isinstance(m, tuple):
+          event_type = "ctcp" if type in ("privmsg", "pubmsg") else "ctcpreply"
+          m = list(m)
+          self._handle_event(Event(event_type, source, target, m, line))
+          if event_type == "ctcp" and m[0] == "ACTION":
+            self._handle_event(Event("action", prefix, target, m[1:], line))
+        else:
+          self._handle_event(Event(type, source, target, [m], line))
+      return
+
+    target = None
+    if command == "quit":
+      arguments = arguments[:1]
+    elif command == "ping" and arguments:
+      target = arguments[0]
+    elif arguments:
+      target = arguments[0]
+      arguments = arguments[1:]
+
+    self._handle_event(Event(type, Source(prefix), target, arguments, line))
+
+class LazyServerConnection(LazyLineParser, irc.client.ServerConnection):
+  pass
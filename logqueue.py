@@ -0,0 +1,124 @@
+import time
+import Queue
+import logging
+import threading
+
+RATE                   = 1.0    # records per second and call site once the burst is used up, 0 disables the limit
+BURST                  = 20     # records a call site may log at once
+REPORT_INTERVAL        = 10     # seconds between the reports of suppressed records
+MAX_QUEUE              = 10000  # records waiting for the writer, more are dropped
+
+# hands log records to a background thread, which formats and writes them
+#
+# logging a record is a token bucket check per call site (logger, file and
+# line) and a put on a bounded queue, the caller never waits for syslog or a
+# terminal. records are formatted by the writer, so a message should be
+# logged with its arguments ("%s is spamming", nick) rather than formatted
+# already. records over the limit of their call site are only counted, the
+# writer reports how many were suppressed every REPORT_INTERVAL seconds.
+class QueueHandler(logging.Handler):
+  def __init__(self, handlers, rate=RATE, burst=BURST, max_queue=MAX_QUEUE):
+    logging.Handler.__init__(self)
+    self.handlers = handlers
+    self.rate = rate
+    self.burst = burst
+    self.buckets = {}
+    self.suppressed = {}
+    self.dropped = 0
+    self.queue = Queue.Queue(max_queue)
+
+    # not the handler's lock, logging.shutdown() holds that one while it
+    # waits for the writer to finish in close()
+    self.counts_lock = threading.Lock()
+
+    self.writer = threading.Thread(target=self.write_loop, name="logging")
+    self.writer.daemon = True
+    self.writer.start()
+
+  def emit(self, record):
+    with self.counts_lock:
+      if not self.allow(record):
+        return
+
+    try:
+      self.queue.put_nowait(record)
+    except Queue.Full:
+      with self.counts_lock:
+        self.dropped += 1
+
+  # counts the record as suppressed if its call site is over the limit
+  def allow(self, record):
+    if self.rate > 0:
+      key = (record.name, record.pathname, record.lineno)
+      bucket = self.buckets.get(key)
+      if bucket is None:
+        bucket = self.buckets[key] = [self.burst, record.created]
+      else:
+        bucket[0] = min(self.burst, bucket[0] + (record.created - bucket[1]) * self.rate)
+        bucket[1] = record.created
+
+      if bucket[0] < 1:
+        suppressed = self.suppressed.get(key)
+        if suppressed is None:
+          self.suppressed[key] = [1, record.created, record]
+        else:
+          suppressed[0] += 1
+          suppressed[2] = record
+        return False
+      bucket[0] -= 1
+
+    return True
+
+  def write_loop(self):
+    next_report = time.time() + REPORT_INTERVAL
+    running = True
+
+    while running:
+      try:
+        record = self.queue.get(timeout=max(0, next_report - time.time()))
+        if record is None:
+          running = False
+        else:
+          self.write(record)
+      except Queue.Empty:
+        pass
+
+      if not running or time.time() >= next_report:
+        self.report()
+        next_report = time.time() + REPORT_INTERVAL
+
+  def write(self, record):
+    for handler in self.handlers:
+      if record.levelno >= handler.level:
+        handler.handle(record)
+
+  def report(self):
+    with self.counts_lock:
+      suppressed, self.suppressed = self.suppressed, {}
+      dropped, self.dropped = self.dropped, 0
+
+    now = time.time()
+    for count, since, record in suppressed.values():
+      try:
+        message = record.getMessage()
+      except Exception:
+        message = record.msg
+      self.write(logging.makeLogRecord({"name": record.name, "levelno": record.levelno, "levelname": record.levelname,
+        "pathname": record.pathname, "lineno": record.lineno,
+        "msg": "Suppressed %d more like this in %ds, the last one: %s", "args": (count, now - since, message)}))
+
+    if dropped:
+      self.write(logging.makeLogRecord({"name": "DontMindMe", "levelno": logging.WARNING, "levelname": "WARNING",
+        "msg": "Log queue full, dropped %d records!", "args": (dropped,)}))
+
+  # writes everything that is queued, the writer stops on the None
+  def close(self):
+    if self.writer is not None:
+      self.queue.put(None)
+      self.writer.join()
+      self.writer = None
+
+      for handler in self.handlers:
+        handler.close()
+
+    logging.Handler.close(self)
@@ -0,0 +1,167 @@
+import bisect
+import logging
+import threading
+import collections
+import BaseHTTPServer
+
+# upper bounds of the latency buckets in seconds, the last bucket takes the rest
+BUCKETS                = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                          0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("DontMindMe.Metrics")
+
+# a histogram with fixed buckets, latencies by default. observing a value
+# is a bisect and two additions, so it can stay on all the time
+class Histogram(object):
+  __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+  def __init__(self, buckets=BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+    if value > self.max:
+      self.max = value
+
+  def mean(self):
+    if not self.count:
+      return 0.0
+    return self.sum / self.count
+
+  # upper bound of the bucket the percentile falls into
+  def percentile(self, p):
+    rank = self.count * p
+    seen = 0
+    for i, count in enumerate(self.counts):
+      seen += count
+      if seen >= rank and count:
+        return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+    return 0.0
+
+# timings of the plugin handlers, keyed by (plugin, kind, name), where kind
+# is "event", "command" or "offload" (the time spent on a worker thread),
+# and the number of lines received per network. outbound traffic is read
+# from the networks' send queues when needed.
+class Metrics(object):
+  def __init__(self):
+    self.handlers = {}
+    self.errors = collections.Counter()
+    self.inbound = collections.Counter()
+
+  def observe(self, plugin, kind, name, seconds):
+    key = (plugin, kind, name)
+    histogram = self.handlers.get(key)
+    if histogram is None:
+      histogram = self.handlers[key] = Histogram()
+    histogram.observe(seconds)
+
+  def error(self, plugin, kind, name):
+    self.errors[(plugin, kind, name)] += 1
+
+  # sums up the histograms of every plugin
+  def per_plugin(self):
+    plugins = {}
+    for (plugin, kind, name), histogram in list(self.handlers.items()):
+      total = plugins.setdefault(plugin, Histogram())
+      total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+      total.count += histogram.count
+      total.sum += histogram.sum
+      total.max = max(total.max, histogram.max)
+    return plugins
+
+  # Prometheus text exposition format
+  def render(self, networks):
+    lines = []
+
+    lines.append("# HELP dontmindme_handler_seconds Time spent in plugin handlers.")
+    lines.append("# TYPE dontmindme_handler_seconds histogram")
+    for (plugin, kind, name), histogram in sorted(list(self.handlers.items())):
+      labels = 'plugin="%s",kind="%s",name="%s"' % (escape(plugin), kind, escape(name))
+      cumulative = 0
+      for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append('dontmindme_handler_seconds_bucket{%s,le="%s"} %d' % (labels, bound, cumulative))
+      lines.append('dontmindme_handler_seconds_bucket{%s,le="+Inf"} %d' % (labels, histogram.count))
+      lines.append("dontmindme_handler_seconds_sum{%s} %f" % (labels, histogram.sum))
+      lines.append("dontmindme_handler_seconds_count{%s} %d" % (labels, histogram.count))
+
+    lines.append("# HELP dontmindme_handler_errors_total Plugin handlers that raised.")
+    lines.append("# TYPE dontmindme_handler_errors_total counter")
+    for (plugin, kind, name), count in sorted(list(self.errors.items())):
+      lines.append('dontmindme_handler_errors_total{plugin="%s",kind="%s",name="%s"} %d' % (escape(plugin), kind, escape(name), count))
+
+    lines.append("# HELP dontmindme_inbound_lines_total Lines received from the server.")
+    lines.append("# TYPE dontmindme_inbound_lines_total counter")
+    for network in networks:
+      lines.append('dontmindme_inbound_lines_total{network="%s"} %d' % (escape(network.name), self.inbound[network.name]))
+
+    lines.append("# HELP dontmindme_outbound_lines_total Lines sent to the server.")
+    lines.append("# TYPE dontmindme_outbound_lines_total counter")
+    for network in networks:
+      lines.append('dontmindme_outbound_lines_total{network="%s"} %d' % (escape(network.name), network.sendq.sent_lines))
+
+    lines.append("# HELP dontmindme_outbound_messages_total Messages sent, several can share a line.")
+    lines.append("# TYPE dontmindme_outbound_messages_total counter")
+    for network in networks:
+      lines.append('dontmindme_outbound_messages_total{network="%s"} %d' % (escape(network.name), network.sendq.sent_messages))
+
+    lines.append("# HELP dontmindme_moderation_seconds Time from a quiet being requested to its line being queued.")
+    lines.append("# TYPE dontmindme_moderation_seconds histogram")
+    for network in networks:
+      labels = 'network="%s"' % (escape(network.name))
+      histogram = network.moderation.latency
+      cumulative = 0
+      for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append('dontmindme_moderation_seconds_bucket{%s,le="%s"} %d' % (labels, bound, cumulative))
+      lines.append('dontmindme_moderation_seconds_bucket{%s,le="+Inf"} %d' % (labels, histogram.count))
+      lines.append("dontmindme_moderation_seconds_sum{%s} %f" % (labels, histogram.sum))
+      lines.append("dontmindme_moderation_seconds_count{%s} %d" % (labels, histogram.count))
+
+    lines.append("# HELP dontmindme_sendq_depth Messages waiting in the send queue.")
+    lines.append("# TYPE dontmindme_sendq_depth gauge")
+    for network in networks:
+      lines.append('dontmindme_sendq_depth{network="%s"} %d' % (escape(network.name), network.sendq.depth()))
+
+    return "\n".join(lines) + "\n"
+
+def escape(value):
+  return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path != "/metrics":
+      self.send_error(404)
+      return
+
+    body = self.server.core.metrics.render(self.server.core.networks.values())
+    if isinstance(body, unicode):
+      body = body.encode("utf-8")
+
+    self.send_response(200)
+    self.send_header("Content-Type", "text/plain; version=0.0.4")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    logger.debug(format % args)
+
+# serves /metrics on localhost from a thread of its own, the counters are
+# only read there, so a scrape never holds up the bot
+def serve(core, port):
+  server = BaseHTTPServer.HTTPServer(("127.0.0.1", port), MetricsHandler)
+  server.core = core
+
+  thread = threading.Thread(target=server.serve_forever, name="metrics")
+  thread.daemon = True
+  thread.start()
+
+  logger.info("Serving metrics on http://127.0.0.1:%d/metrics" % (port))
+  return server
@@ -0,0 +1,194 @@
+import time
+import logging
+import collections
+
+import metrics
+import hostmask
+from sendqueue import byte_length, MAX_LINE_BYTES, PREFIX_RESERVE
+
+WINDOW                 = 0.5    # seconds between two batches of actions
+RECENT                 = 60     # seconds a mask that was quieted isn't quieted again
+MAX_RECENT             = 10000  # quieted masks remembered at most
+DEFAULT_MODES          = 3      # mode changes per line if the server doesn't advertise MODES
+QUIET_MODE             = "q"
+
+logger = logging.getLogger("DontMindMe.Moderation")
+
+# collects quiets and unquiets and sends them in as few lines as possible
+#
+# a batch is sent after the current events were handled, but at most
+# every WINDOW seconds, so a single spammer is quieted right away while
+# the actions of a spam wave are collected.
+# an action for a channel and mask that is already waiting, or a quiet of
+# a mask quieted less than RECENT seconds ago, is dropped. a quiet and an
+# unquiet of the same mask cancel each other while the first one is still
+# waiting, so nothing is sent for either. if the bot is an
+# operator of the channel and the server has a +q list mode, the actions
+# are set as MODE +qqq lines with as many masks as the server's MODES
+# allows, otherwise they are sent to ChanServ as QUIET and UNQUIET with
+# the same number of masks. the time from an action being requested to its
+# line being handed to the send queue is kept in a histogram.
+class Dispatcher(object):
+  def __init__(self, bot, window=WINDOW, clock=time.time):
+    self.bot = bot
+    self.window = window
+    self.clock = clock
+    self.pending = collections.OrderedDict()   # (channel, mask): (channel name, mask, sign, time requested)
+    self.recent = collections.OrderedDict()    # (channel, mask): time quieted
+    self.flush_scheduled = False
+    self.last_flush = 0
+
+    self.latency = metrics.Histogram()
+    self.requested = 0
+    self.duplicates = 0
+    self.cancelled = 0
+    self.mode_lines = 0
+    self.chanserv_lines = 0
+
+  def quiet(self, channel_name, mask):
+    return self.request(channel_name, mask, "+")
+
+  def unquiet(self, channel_name, mask):
+    return self.request(channel_name, mask, "-")
+
+  # returns False if the action was dropped as a duplicate
+  def request(self, channel_name, mask, sign):
+    now = self.clock()
+    key = (hostmask.fold(channel_name), hostmask.fold(mask))
+    self.requested += 1
+    self.expire(now)
+
+    waiting = self.pending.get(key)
+    if (waiting is not None and waiting[2] == sign) or (sign == "+" and waiting is None and key in self.recent):
+      self.duplicates += 1
+      return False
+
+    # the waiting action was never sent, so both are done without a line.
+    # an unquiet was waiting for a mask that is quieted and stays so
+    if waiting is not None:
+      del self.pending[key]
+      if sign == "+":
+        self.recent[key] = now
+      self.cancelled += 1
+      return True
+
+    if sign == "-":
+      self.recent.pop(key, None)
+    self.pending[key] = (channel_name, mask, sign, now)
+
+    if not self.flush_scheduled:
+      self.flush_scheduled = True
+      self.bot.connection.execute_delayed(max(0, self.last_flush + self.window - now), self.scheduled_flush)
+    return True
+
+  def expire(self, now):
+    while self.recent:
+      key, quieted = next(self.recent.iteritems())
+      if len(self.recent) <= MAX_RECENT and now - quieted < RECENT:
+        break
+      del self.recent[key]
+
+  def scheduled_flush(self):
+    self.flush_scheduled = False
+    self.flush()
+
+  def flush(self):
+    self.last_flush = self.clock()
+    actions, self.pending = self.pending, collections.OrderedDict()
+    channels = collections.OrderedDict()
+    for (channel_key, mask_key), action in actions.items():
+      channels.setdefault(channel_key, []).append(((channel_key, mask_key), action))
+
+    for channel_actions in channels.values():
+      channel_name = channel_actions[0][1][0]
+      if self.can_set_quiets(channel_name):
+        lines = self.mode_batches(channel_name, channel_actions)
+        self.mode_lines += len(lines)
+        for line, batch in lines:
+          self.bot.sendq.send_raw(line)
+          self.sent(batch)
+      else:
+        lines = self.chanserv_batches(channel_name, channel_actions)
+        self.chanserv_lines += len(lines)
+        for line, batch in lines:
+          self.bot.sendq.privmsg("ChanServ", line)
+          self.sent(batch)
+
+  def sent(self, batch):
+    now = self.clock()
+    for key, (channel_name, mask, sign, requested) in batch:
+      self.latency.observe(now - requested)
+      if sign == "+":
+        self.recent.pop(key, None)
+        self.recent[key] = now
+
+  def can_set_quiets(self, channel_name):
+    connection = self.bot.connection
+    if channel_name not in self.bot.channels or not self.bot.channels[channel_name].is_oper(connection.get_nickname()):
+      return False
+
+    chanmodes = getattr(connection.features, "chanmodes", None)
+    return bool(chanmodes) and QUIET_MODE in chanmodes[0] and QUIET_MODE not in connection.features.prefix.values()
+
+  # None if any number fits, MODES without a value means no limit
+  def modes_per_line(self):
+    modes = getattr(self.bot.connection.features, "modes", DEFAULT_MODES)
+    if modes is True:
+      return None
+    return max(1, modes) if isinstance(modes, int) else DEFAULT_MODES
+
+  # splits the actions into batches of at most MODES that fit a line
+  def batches(self, head_length, actions):
+    limit = self.modes_per_line()
+    budget = MAX_LINE_BYTES - PREFIX_RESERVE - head_length - 2
+    batches = []
+    batch = []
+    length = 0
+
+    for action in actions:
+      # a mode character, maybe a sign and the mask with a space
+      needed = 3 + byte_length(action[1][1])
+      if batch and (length + needed > budget or (limit is not None and len(batch) >= limit)):
+        batches.append(batch)
+        batch = []
+        length = 0
+      batch.append(action)
+      length += needed
+
+    if batch:
+      batches.append(batch)
+    return batches
+
+  def mode_batches(self, channel_name, actions):
+    lines = []
+    head = "MODE %s " % (channel_name)
+    for batch in self.batches(byte_length(head), actions):
+      modes = ""
+      sign = None
+      for key, action in batch:
+        if action[2] != sign:
+          sign = action[2]
+          modes += sign
+        modes += QUIET_MODE
+      lines.append((head + modes + " " + " ".join(action[1] for key, action in batch), batch))
+    return lines
+
+  def chanserv_batches(self, channel_name, actions):
+    lines = []
+    for sign, command in (("+", "QUIET"), ("-", "UNQUIET")):
+      head = "%s %s " % (command, channel_name)
+      signed = [x for x in actions if x[1][2] == sign]
+      for batch in self.batches(byte_length("PRIVMSG ChanServ :" + head), signed):
+        lines.append((head + " ".join(action[1] for key, action in batch), batch))
+    return lines
+
+  def depth(self):
+    return len(self.pending)
+
+  def clear(self):
+    self.pending.clear()
+
+  def __str__(self):
+    return "%d pending, %d requested, %d duplicates dropped, %d cancelled, %d MODE and %d ChanServ lines, latency %.0fms avg, p99 < %.0fms, max %.0fms" % (
+      self.depth(), self.requested, self.duplicates, self.cancelled, self.mode_lines, self.chanserv_lines,
+      self.latency.mean() * 1000, self.latency.percentile(0.99) * 1000, self.latency.max * 1000)
@@ -0,0 +1,160 @@
+import time
+import heapq
+import socket
+import binascii
+import collections
+
+import hostmask
+
+MAX_OFFENDERS          = 10000       # offenders kept at most, the least recently punished are dropped first
+RETENTION              = 30 * 86400  # seconds an offender is kept after their last penalty
+IPV4_PREFIX            = 24          # length of the subnets offenders are grouped by
+IPV6_PREFIX            = 64
+KEY_PREFIX             = "offender "
+
+# the IP address in a host, either the host itself or the address of a
+# webchat cloak like gateway/web/freenode/ip.192.0.2.1, None for others
+def host_address(host):
+  if hostmask.parse_ip(host) is not None:
+    return host
+  if "/ip." in host:
+    address = host.rsplit("/ip.", 1)[1]
+    if hostmask.parse_ip(address) is not None:
+      return address
+  return None
+
+# the /24 or /64 an address is in, like 192.0.2.0/24
+def subnet(address):
+  version, value = hostmask.parse_ip(address)
+  if version == 4:
+    bits, length, family = 32, IPV4_PREFIX, socket.AF_INET
+  else:
+    bits, length, family = 128, IPV6_PREFIX, socket.AF_INET6
+
+  network = value >> (bits - length) << (bits - length)
+  packed = binascii.unhexlify("%0*x" % (bits // 4, network))
+  return "%s/%d" % (socket.inet_ntop(family, packed), length)
+
+class Offender(object):
+  __slots__ = ("network", "host", "ip", "subnet", "channels", "first", "last", "penalties")
+
+  def __init__(self, network, host, now):
+    self.network = network
+    self.host = host
+    self.ip = host_address(host)
+    self.subnet = subnet(self.ip) if self.ip is not None else None
+    self.channels = {}   # channel: penalties
+    self.first = now
+    self.last = now
+    self.penalties = 0
+
+  def to_dict(self):
+    return dict((x, getattr(self, x)) for x in self.__slots__)
+
+  @classmethod
+  def from_dict(cls, values):
+    offender = cls(values["network"], values["host"], values["first"])
+    for key in cls.__slots__:
+      setattr(offender, key, values[key])
+    return offender
+
+def offender_key(network, host):
+  return "%s%s %s" % (KEY_PREFIX, network, host.lower())
+
+# every user punished for spam, by network and host
+#
+# besides the host an offender is indexed by the /24 or /64 of their
+# address if the host is one or a cloak containing one, so a join costs a
+# lookup of the host and one of the subnet. offenders are kept in the order
+# they were last punished, the ones not punished for RETENTION seconds and
+# the oldest once there are more than MAX_OFFENDERS are dropped from the
+# front. every change is written to the given persistent store.
+class OffenderIndex(object):
+  def __init__(self, store=None, max_offenders=MAX_OFFENDERS, retention=RETENTION):
+    self.store = store
+    self.max_offenders = max_offenders
+    self.retention = retention
+    self.entries = collections.OrderedDict()
+    self.subnets = {}    # subnet: [offenders, penalties]
+
+    if store is not None:
+      self.restore([x for x in store.items() if x[0].startswith(KEY_PREFIX)])
+      self.expire(time.time())
+
+  # (key, value) pairs as written to the store
+  def restore(self, items):
+    offenders = []
+    for key, values in items:
+      try:
+        offenders.append(Offender.from_dict(values))
+      except (KeyError, TypeError):
+        if self.store is not None:
+          self.store.delete(key)
+
+    for offender in sorted(offenders, key=lambda x: x.last):
+      self.entries[(offender.network, offender.host.lower())] = offender
+      self.count(offender, 1, offender.penalties)
+
+  def count(self, offender, offenders, penalties):
+    if offender.subnet is None:
+      return
+
+    totals = self.subnets.setdefault(offender.subnet, [0, 0])
+    totals[0] += offenders
+    totals[1] += penalties
+    if totals[0] <= 0:
+      del self.subnets[offender.subnet]
+
+  def punish(self, network, host, channel_name, now=None):
+    if now is None:
+      now = time.time()
+
+    offender = self.entries.pop((network, host.lower()), None)
+    if offender is None:
+      offender = Offender(network, host, now)
+      self.count(offender, 1, 0)
+
+    offender.penalties += 1
+    offender.last = now
+    channel_name = channel_name.lower()
+    offender.channels[channel_name] = offender.channels.get(channel_name, 0) + 1
+    self.count(offender, 0, 1)
+
+    self.entries[(network, host.lower())] = offender
+    if self.store is not None:
+      self.store.set(offender_key(network, host), offender.to_dict())
+
+    self.expire(now)
+    return offender
+
+  def expire(self, now):
+    while self.entries:
+      key, offender = next(self.entries.iteritems())
+      if len(self.entries) <= self.max_offenders and now - offender.last < self.retention:
+        break
+
+      del self.entries[key]
+      self.count(offender, -1, -offender.penalties)
+      if self.store is not None:
+        self.store.delete(offender_key(offender.network, offender.host))
+
+  def get(self, network, host):
+    return self.entries.get((network, host.lower()))
+
+  # (offenders, penalties) of the subnet the host is in, None if it has no address
+  def get_subnet(self, host):
+    address = host_address(host)
+    if address is None:
+      return None
+    return tuple(self.subnets.get(subnet(address), (0, 0)))
+
+  # (subnet, offenders, penalties) with the most penalties first
+  def top_subnets(self, count=10):
+    top = heapq.nlargest(count, self.subnets.iteritems(), key=lambda x: (x[1][1], x[1][0]))
+    return [(name, offenders, penalties) for name, (offenders, penalties) in top]
+
+  def top_offenders(self, count=10):
+    return heapq.nlargest(count, self.entries.itervalues(), key=lambda x: (x.penalties, x.last))
+
+  def __len__(self):
+    return len(self.entries)
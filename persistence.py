@@ -0,0 +1,138 @@
+import json
+import time
+import Queue
+import sqlite3
+import logging
+import threading
+
+BATCH_DELAY            = 1.0   # seconds writes are collected before they are committed
+MAX_BATCH              = 1000  # writes committed at most in one transaction
+
+logger = logging.getLogger("DontMindMe.Persistence")
+
+# a key value store in SQLite, split into namespaces
+#
+# the whole database is read once on start, so reads never touch the disk.
+# writes update the cache right away and are queued for a background thread,
+# which commits them in batches, a key written several times in a batch is
+# only written once. without a path nothing is written at all.
+class Database(object):
+  def __init__(self, path=None):
+    self.path = path
+    self.namespaces = {}
+    self.queue = Queue.Queue()
+    self.writer = None
+
+    if path:
+      self.load()
+      self.writer = threading.Thread(target=self.write_loop, name="persistence")
+      self.writer.daemon = True
+      self.writer.start()
+
+  def connect(self):
+    db = sqlite3.connect(self.path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS state (namespace TEXT, key TEXT, value TEXT, PRIMARY KEY (namespace, key))")
+    return db
+
+  def load(self):
+    start = time.time()
+    db = self.connect()
+    count = 0
+    for namespace, key, value in db.execute("SELECT namespace, key, value FROM state"):
+      self.namespace(namespace).data[key] = json.loads(value)
+      count += 1
+    db.close()
+    logger.info("Restored %d keys from '%s' in %.0fms." % (count, self.path, (time.time() - start) * 1000))
+
+  def namespace(self, name):
+    if name not in self.namespaces:
+      self.namespaces[name] = Namespace(self, name)
+    return self.namespaces[name]
+
+  # value None deletes the key
+  def write(self, namespace, key, value):
+    if self.writer is not None:
+      self.queue.put((namespace, key, None if value is None else json.dumps(value)))
+
+  def write_loop(self):
+    db = self.connect()
+    running = True
+
+    while running:
+      batch = {}
+      item = self.queue.get()
+      deadline = time.time() + BATCH_DELAY
+
+      while True:
+        if item is None:
+          running = False
+          break
+
+        namespace, key, value = item
+        batch[(namespace, key)] = value
+        if len(batch) >= MAX_BATCH:
+          break
+
+        try:
+          item = self.queue.get(timeout=max(0, deadline - time.time()))
+        except Queue.Empty:
+          break
+
+      if batch:
+        try:
+          self.commit(db, batch)
+        except sqlite3.Error:
+          logger.exception("Error on writing %d keys to '%s'!" % (len(batch), self.path))
+
+    db.close()
+
+  def commit(self, db, batch):
+    with db:
+      db.executemany("INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+        [(namespace, key, value) for (namespace, key), value in batch.items() if value is not None])
+      db.executemany("DELETE FROM state WHERE namespace = ? AND key = ?",
+        [(namespace, key) for (namespace, key), value in batch.items() if value is None])
+
+  # writes everything that is queued and stops the writer
+  def close(self):
+    if self.writer is None:
+      return
+
+    self.queue.put(None)
+    self.writer.join()
+    self.writer = None
+
+# the part of the database a plugin or a network gets, values have to be
+# serializable as JSON. changing a value that was read doesn't store it,
+# it has to be set again.
+class Namespace(object):
+  def __init__(self, database, name):
+    self.database = database
+    self.name = name
+    self.data = {}
+
+  def get(self, key, default=None):
+    return self.data.get(key, default)
+
+  def set(self, key, value):
+    self.data[key] = value
+    self.database.write(self.name, key, value)
+
+  def delete(self, key):
+    if key in self.data:
+      del self.data[key]
+      self.database.write(self.name, key, None)
+
+  def keys(self):
+    return self.data.keys()
+
+  def items(self):
+    return self.data.items()
+
+  def __contains__(self, key):
+    return key in self.data
+
+  def __len__(self):
+    return len(self.data)
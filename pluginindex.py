@@ -0,0 +1,178 @@
+import os
+import ast
+import logging
+
+logger = logging.getLogger("DontMindMe.PluginIndex")
+
+# what the bot knows about a plugin without importing it
+class PluginInfo(object):
+  __slots__ = ("name", "path", "mtime", "size", "long_name", "author", "description", "commands", "events", "lazy")
+
+  def __init__(self, name, path, mtime, size):
+    self.name = name
+    self.path = path
+    self.mtime = mtime
+    self.size = size
+    self.long_name = name
+    self.author = ""
+    self.description = ""
+    self.commands = []   # (command, usage)
+    self.events = []
+    self.lazy = True
+
+  def to_dict(self):
+    return dict((x, getattr(self, x)) for x in self.__slots__)
+
+  @classmethod
+  def from_dict(cls, values):
+    info = cls(values["name"], values["path"], values["mtime"], values["size"])
+    for key in cls.__slots__:
+      setattr(info, key, values[key])
+    info.commands = [tuple(x) for x in info.commands]
+    return info
+
+def literal(node):
+  if isinstance(node, ast.Str):
+    return node.s
+  if isinstance(node, ast.Name) and node.id in ("True", "False"):
+    return node.id == "True"
+  return None
+
+# reads the class attributes of a plugin's Plugin class and the commands and
+# events it registers with string literals, handlers registered any other
+# way are only known once the plugin is running
+def read_manifest(info, source):
+  tree = ast.parse(source, info.path)
+
+  for node in tree.body:
+    if not isinstance(node, ast.ClassDef) or node.name != "Plugin":
+      continue
+
+    for statement in node.body:
+      if isinstance(statement, ast.Assign) and len(statement.targets) == 1 and isinstance(statement.targets[0], ast.Name):
+        value = literal(statement.value)
+        target = statement.targets[0].id
+        if value is None:
+          continue
+
+        if target == "_name_":
+          info.long_name = value
+        elif target == "_author_":
+          info.author = value
+        elif target == "_description_":
+          info.description = value
+        elif target == "_lazy_":
+          info.lazy = value
+
+    for call in ast.walk(node):
+      if not isinstance(call, ast.Call) or not isinstance(call.func, ast.Attribute) or not call.args:
+        continue
+
+      name = literal(call.args[0])
+      if not isinstance(name, basestring):
+        continue
+
+      if call.func.attr == "add_command_handler":
+        usage = literal(call.args[2]) if len(call.args) > 2 else None
+        for keyword in call.keywords:
+          if keyword.arg == "usage":
+            usage = literal(keyword.value)
+        info.commands.append((name.lower(), usage))
+      elif call.func.attr == "add_event_handler":
+        info.events.append(name)
+
+# an index of the plugins directory
+#
+# the directory is only listed again when its mtime changed, a plugin only
+# parsed again when its own mtime or size did. the index is kept in the
+# given persistent store, so a restart doesn't have to parse anything that
+# didn't change. compiled plugins are cached the same way for the lifetime
+# of the process, a reload of an unchanged plugin doesn't compile it again.
+class PluginIndex(object):
+  def __init__(self, directory, store=None):
+    self.directory = directory
+    self.store = store
+    self.directory_mtime = None
+    self.entries = {}
+    self.code = {}
+
+    if store is not None:
+      for name, values in store.items():
+        try:
+          self.entries[name] = PluginInfo.from_dict(values)
+        except (KeyError, TypeError):
+          store.delete(name)
+
+  def refresh(self):
+    try:
+      mtime = os.stat(self.directory).st_mtime
+    except OSError:
+      mtime = None
+
+    if mtime != self.directory_mtime:
+      self.directory_mtime = mtime
+      names = []
+      if mtime is not None:
+        names = [x[:-3] for x in os.listdir(self.directory) if os.path.splitext(x)[1].lower() == ".py" and x != "__init__.py"]
+
+      for name in set(self.entries) - set(names):
+        self.forget(name)
+      for name in names:
+        self.update(name)
+    else:
+      for name in list(self.entries):
+        self.update(name)
+
+  def update(self, name):
+    path = os.path.join(self.directory, name + ".py")
+    try:
+      stat = os.stat(path)
+    except OSError:
+      self.forget(name)
+      return None
+
+    info = self.entries.get(name)
+    if info is not None and info.mtime == stat.st_mtime and info.size == stat.st_size:
+      return info
+
+    info = PluginInfo(name, path, stat.st_mtime, stat.st_size)
+    try:
+      with open(path) as f:
+        read_manifest(info, f.read())
+    except (IOError, SyntaxError, TypeError):
+      logger.warning("Couldn't read the manifest of plugin '%s', it is loaded on start." % (name))
+      info.lazy = False
+
+    self.entries[name] = info
+    if self.store is not None:
+      self.store.set(name, info.to_dict())
+    return info
+
+  def forget(self, name):
+    self.entries.pop(name, None)
+    self.code.pop(name, None)
+    if self.store is not None:
+      self.store.delete(name)
+
+  def names(self):
+    self.refresh()
+    return sorted(self.entries)
+
+  # the info of a single plugin, only its own file is checked
+  def get(self, name):
+    return self.update(name)
+
+  # raises SyntaxError or IOError like compile and open
+  def get_code(self, name):
+    info = self.get(name)
+    if info is None:
+      raise IOError("No such plugin '%s'!" % (name))
+
+    cached = self.code.get(name)
+    if cached is not None and cached[0] == (info.mtime, info.size):
+      return cached[1]
+
+    with open(info.path) as f:
+      code = compile(f.read(), info.path, "exec")
+    self.code[name] = ((info.mtime, info.size), code)
+    return code
@@ -1,20 +1,198 @@
+import re
 import time
 import logging
+import collections
+
+import hostmask
+import offenders
+import sketches
 
 MIN_SECONDS_BETWEEN_MESSAGES = 4  # minimal delay in seconds two messages should have
 WEBCHAT_MULTIPLIER = 1.5          # additional penalty for webchat users
+REGISTERED_LENIENCY = 2           # users logged in to services are punished at this multiple of MAX_FLOOD_SCORE
 MAX_FLOOD_SCORE = 15              # maximum score a client can reach before being punished
+MAX_ENTRIES = 10000               # default number of users tracked at most, bounds the memory used
+ENTRY_TTL = 3600                  # default seconds after which the data of an idle user is dropped
+HISTORY_SIZE = 5                  # default number of recent messages a new message is compared to
+SIMILARITY = 0.75                 # default similarity from which on two messages count as repeated
+SHINGLE_SIZE = 3                  # length of the substrings messages are compared by
+MAX_COMPARE_LENGTH = 300          # only this many characters of a message are compared
+FLOOD_WINDOW = 10                 # seconds channel-wide joins and mass highlights are counted over
+JOIN_FLOOD_LIMIT = 8              # joins within the window that make a join flood in a small, quiet channel
+USERS_PER_JOIN = 25               # channel members per join the join flood limit grows by
+JOIN_RATE_WINDOW = 900            # seconds the normal join rate of a channel is averaged over
+JOIN_RATE_FACTOR = 3              # multiple of the normal joins within the window that make a join flood
+SPLIT_MEMORY = 3600               # seconds a user that quit in a netsplit may rejoin without counting as a join
+MAX_HIGHLIGHTS = 5                # distinct nicks in a single message that make a mass highlight
+MASS_HIGHLIGHT_LIMIT = 3          # mass highlights within the window that make a highlight flood
+LOCKDOWN_MODE = "+r"              # channel mode set during a join or highlight flood
+LOCKDOWN_TIME = 300               # seconds the lockdown mode stays set
+OFFENDER_SCORE = 4                # flood score a known offender joins with per earlier penalty
+SUBNET_SCORE = 2                  # flood score a user joins with whose /24 or /64 has offenders
+MAX_OFFENDER_SCORE = 10           # flood score a user joins with at most, below MAX_FLOOD_SCORE
 
 logger = logging.getLogger("Core.AntiSpam")
 
+# a netsplit is announced as a QUIT with the names of the two servers that
+# lost each other, like "irc.example.net hub.example.net" or, with hidden
+# server names, "*.net *.split". servers prefix the reasons users give with
+# "Quit: ", so users can't fake it
+SPLIT_REASON = re.compile(r"^[\w*-]+(\.[\w*-]+)+ [\w*-]+(\.[\w*-]+)+$")
+
+# the set of all substrings of length SHINGLE_SIZE of a message
+def shingles(message):
+  message = message[:MAX_COMPARE_LENGTH].lower()
+  if len(message) <= SHINGLE_SIZE:
+    return set([message])
+  return set([message[i:i + SHINGLE_SIZE] for i in xrange(len(message) - SHINGLE_SIZE + 1)])
+
+# checks if a message is a near-duplicate of any of the messages in history,
+# (message, number of shingles) pairs, using the jaccard similarity of their
+# shingles. the similarity can never exceed the ratio of the two numbers of
+# shingles, so most pairs are ruled out before the shingles of the earlier
+# message are built. the length of a message is no such bound, a phrase
+# repeated three or twelve times has the very same shingles
+def is_repeated(message_shingles, history, threshold):
+  size = len(message_shingles)
+
+  for previous, previous_size in history:
+    if min(size, previous_size) < threshold * max(size, previous_size):
+      continue
+
+    previous_shingles = shingles(previous)
+    common = len(message_shingles & previous_shingles)
+    if common >= threshold * (size + previous_size - common):
+      return True
+
+  return False
+
+# sliding windows of channel-wide events, one per channel
+class ChannelWatch(object):
+  __slots__ = ("joins", "highlights", "locked", "join_rate", "size")
+
+  def __init__(self):
+    self.joins = collections.deque()
+    self.highlights = collections.deque()
+    self.locked = False
+    self.join_rate = sketches.Rate(JOIN_RATE_WINDOW, time.time())
+    self.size = 0   # most members seen, a netsplit doesn't make the channel smaller
+
+  # the configured limit grows with the size of the channel and is at least
+  # a few times the joins the channel normally sees within the window
+  def join_limit(self, limit, members, now):
+    self.size = max(self.size, members)
+    limit += self.size // USERS_PER_JOIN
+    return max(limit, JOIN_RATE_FACTOR * self.join_rate.per_second(now) * FLOOD_WINDOW)
+
+  # adds an event to a window and returns the number of events in it
+  @staticmethod
+  def count(window, now):
+    window.append(now)
+    while now - window[0] > FLOOD_WINDOW:
+      window.popleft()
+    return len(window)
+
 class AntiSpamData(object):
-  flood_score = 0
-  last_message_time = 0
-  last_message = ""
-  similar_message_count = 0
-  flooding = False
-  penalty_count = 0
-  uses_webchat = False
+  __slots__ = ("flood_score", "last_message_time", "history", "similar_message_count",
+               "flooding", "uses_webchat", "last_seen")
+
+  def __init__(self):
+    self.flood_score = 0
+    self.last_message_time = 0
+    self.history = ()
+    self.similar_message_count = 0
+    self.flooding = False
+    self.uses_webchat = False
+    self.last_seen = 0
+
+# keeps the spam data of users per (network, channel, account or host).
+# users logged in to services are kept by account, so users sharing a host
+# or bouncer don't share a flood score and one's score follows them across
+# hosts. everyone else is kept by host, which survives nick changes.
+# entries are kept in least recently seen order, so idle users and
+# the oldest users in case the store is full can be dropped from the front.
+# penalties are remembered across restarts by the offender index.
+class AntiSpamStore(object):
+  def __init__(self, max_entries=MAX_ENTRIES, ttl=ENTRY_TTL):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.entries = collections.OrderedDict()
+
+  def get(self, network, channel_name, host, account=None):
+    key = (network, channel_name.lower(), user_key(host, account))
+    now = time.time()
+
+    data = self.entries.pop(key, None)
+    if data is None:
+      data = AntiSpamData()
+
+      # check if users is connected via freenode webchat
+      if host.startswith("gateway/web"):
+        data.uses_webchat = True
+
+    data.last_seen = now
+    self.entries[key] = data
+    self.expire(now)
+    return data
+
+  def expire(self, now):
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+    while self.entries:
+      key, data = next(self.entries.iteritems())
+      if now - data.last_seen < self.ttl:
+        break
+      del self.entries[key]
+
+  def __len__(self):
+    return len(self.entries)
+
+# accounts are written like in hostmasks, so they can't be taken for a host
+def user_key(host, account=None):
+  if account:
+    return hostmask.ACCOUNT_PREFIX + hostmask.fold(account)
+  return host
+
+# penalty counts were kept per channel and host before the offender index
+# had them, they are dropped from stores written back then
+def drop_penalty_counts(persistent):
+  for key in [x for x in persistent.keys() if x.startswith("penalty ")]:
+    persistent.delete(key)
+
+# the options and spam data of a network
+#
+# the plugin is set up once for all networks, so the options are read when
+# a network is handled for the first time, [antispam:<network>] before
+# [antispam]. once changed by !whitelist, the stored whitelist of the
+# network replaces the config's. entries are hostmasks, a plain nick
+# stands for nick!*@*
+class Settings(object):
+  def __init__(self, plugin, persistent, network):
+    get = plugin.get_config_value
+    self.history_size = int(get("history", HISTORY_SIZE))
+    self.similarity = float(get("similarity", SIMILARITY))
+    self.join_flood_limit = int(get("join_flood_limit", JOIN_FLOOD_LIMIT))
+    self.max_highlights = int(get("max_highlights", MAX_HIGHLIGHTS))
+    self.lockdown_mode = get("lockdown_mode", LOCKDOWN_MODE)
+    self.store = AntiSpamStore(int(get("max_entries", MAX_ENTRIES)), int(get("ttl", ENTRY_TTL)))
+
+    self.whitelist_key = "whitelist " + network
+    self.whitelist = hostmask.MaskSet()
+    # "whitelist" is where the whitelist was kept before it was per network
+    for key in (self.whitelist_key, "whitelist"):
+      if key in persistent:
+        self.whitelist = hostmask.MaskSet(persistent.get(key))
+        logger.info("Restored whitelist of %s: %s" % (network, ', '.join(self.whitelist)))
+        break
+    else:
+      if get("whitelist"):
+        for mask in get("whitelist").split(","):
+          try:
+            self.whitelist.add(mask)
+          except ValueError, e:
+            logger.warning("Skipping whitelist entry of %s from config file: %s", network, e)
+        logger.info("Loaded whitelist of %s from config file: %s" % (network, ', '.join(self.whitelist)))
 
 class Plugin(object):
   _name_ = "AntiSpam"
@@ -29,19 +207,35 @@ class Plugin(object):
     self.plugin.add_command_handler("!quiet", self.quiet_handler)
     self.plugin.add_command_handler("!unquiet", self.unquiet_handler)
     self.plugin.add_command_handler("!antispam", self.antispam_handler)
+    self.plugin.add_command_handler("!offenders", self.offenders_handler)
 
     self.plugin.add_event_handler("PUBMSG", self.pubmsg_handler)
-
-    self.whitelist = set()
-    if self.plugin.get_config_value("whitelist"):
-      self.whitelist = set([x.strip() for x in self.plugin.get_config_value("whitelist").split(",")])
-      logger.info("Loaded whitelist from config file: %s" % (', '.join(self.whitelist)))
+    self.plugin.add_event_handler("JOIN", self.join_handler)
+    self.plugin.add_event_handler("QUIT", self.quit_handler)
+
+    self.persistent = self.plugin.get_store()
+    drop_penalty_counts(self.persistent)
+    self.networks = {}   # network: Settings
+    self.channel_watch = {}
+    self.split_users = collections.OrderedDict()   # (network, folded nick): time of the netsplit QUIT
+
+    # the offenders of all networks are kept in one index, so its options
+    # are only read from [antispam]
+    self.offenders = offenders.OffenderIndex(self.persistent, int(self.plugin.get_config_value("max_offenders", offenders.MAX_OFFENDERS)),
+      int(self.plugin.get_config_value("offender_ttl", offenders.RETENTION)))
+
+  # has to be called while the network is handled, for its section of the config
+  def settings(self, network):
+    settings = self.networks.get(network)
+    if settings is None:
+      settings = self.networks[network] = Settings(self.plugin, self.persistent, network)
+    return settings
 
   def antispam_handler(self, conn, params, data):
     nick = data.source.nick
 
     if len(params) != 1:
-      conn.privmsg(nick, "!antispam on|off - Activate/Deactivate the automatic spam control")
+      conn.privmsg(nick, "!antispam on|off|status - Activate/Deactivate the automatic spam control")
       return
 
     if params[0].lower() == "on":
@@ -50,9 +244,42 @@ class Plugin(object):
     elif params[0].lower() == "off":
       self.active = False
       conn.privmsg(nick, "Deactivated automatic flood protection!")
+    elif params[0].lower() == "status":
+      store = self.settings(data.network).store
+      conn.privmsg(nick, "Flood protection is %s, tracking %d of at most %d users." % ("on" if self.active else "off", len(store), store.max_entries))
     else:
       conn.privmsg("Use 'on' or 'off'!")
 
+  def offenders_handler(self, conn, params, data):
+    nick = data.source.nick
+
+    if len(params) < 1 or (params[0] in ("top", "subnets") and len(params) > 2):
+      conn.privmsg(nick, "!offenders top [<n>]|subnets [<n>]|<host> - Show the users punished for spam")
+      return
+
+    count = 10
+    if len(params) == 2 and params[1].isdigit():
+      count = int(params[1])
+
+    if params[0] == "top":
+      conn.privmsg(nick, "%d offenders in %d subnets" % (len(self.offenders), len(self.offenders.subnets)))
+      for offender in self.offenders.top_offenders(count):
+        conn.privmsg(nick, "%s on %s: %d penalties in %s, last %s" % (offender.host, offender.network, offender.penalties,
+          ", ".join(sorted(offender.channels)), time.strftime("%Y-%m-%d %H:%M", time.localtime(offender.last))))
+    elif params[0] == "subnets":
+      for name, count, penalties in self.offenders.top_subnets(count):
+        conn.privmsg(nick, "%s: %d offenders, %d penalties" % (name, count, penalties))
+    else:
+      offender = self.offenders.get(data.network, params[0])
+      subnet = self.offenders.get_subnet(params[0])
+      if offender is None:
+        conn.privmsg(nick, "%s was never punished" % (params[0]))
+      else:
+        conn.privmsg(nick, "%s: %d penalties in %s since %s" % (offender.host, offender.penalties, ", ".join(sorted(offender.channels)),
+          time.strftime("%Y-%m-%d %H:%M", time.localtime(offender.first))))
+      if subnet is not None:
+        conn.privmsg(nick, "Its subnet: %d offenders, %d penalties" % subnet)
+
   def quiet_handler(self, conn, params, data):
     nick = data.source.nick
 
@@ -61,7 +288,7 @@ class Plugin(object):
       return
    
     conn.privmsg(nick, "Trying to quiet %s ..." % (params[1]))
-    conn.privmsg("ChanServ", "QUIET " + params[0] + " " + params[1])
+    self.plugin.get_bot().moderation.quiet(params[0], params[1])
 
   def unquiet_handler(self, conn, params, data):
     nick = data.source.nick
@@ -71,18 +298,20 @@ class Plugin(object):
       return
    
     conn.privmsg(nick, "Trying to unquiet %s ..." % (params[1]))
-    conn.privmsg("ChanServ", "UNQUIET " + params[0] + " " + params[1])
+    self.plugin.get_bot().moderation.unquiet(params[0], params[1])
 
   def whitelist_handler(self, conn, params, data):
     nick = data.source.nick
+    settings = self.settings(data.network)
+    whitelist = settings.whitelist
 
     if len(params) < 1:
-      conn.privmsg(nick, "!whitelist add <nick>|del <nick>|list - Manage the bot's whitelist")
+      conn.privmsg(nick, "!whitelist add <hostmask>|del <hostmask>|list - Manage the bot's whitelist")
       return
     
     if params[0] == "list":
-      if len(self.whitelist):
-        conn.privmsg(nick, "Whitelist: " + ', '.join(self.whitelist))
+      if len(whitelist):
+        conn.privmsg(nick, "Whitelist: " + ', '.join(whitelist))
       else:
         conn.privmsg(nick, "Whitelist is empty")
       return
@@ -93,47 +322,174 @@ class Plugin(object):
     target = params[1]
       
     if params[0] == "add":
-      self.whitelist.add(target)
+      try:
+        target = whitelist.add(target)
+      except ValueError, e:
+        conn.privmsg(nick, str(e))
+        return
+      self.persistent.set(settings.whitelist_key, list(whitelist))
       conn.privmsg(nick, "User '%s' added to whitelist" % (target))
     elif params[0] == "del":
-      if target in self.whitelist:
-        self.whitelist.remove(target)
+      if target in whitelist:
+        whitelist.remove(target)
+        self.persistent.set(settings.whitelist_key, list(whitelist))
         conn.privmsg(nick, "User '%s' removed from whitelist" % (target))
       else:
         conn.privmsg(nick, "User '%s' not on whitelist" % (target))
 
+  def get_channel_watch(self, network, channel_name):
+    key = (network, channel_name.lower())
+    if key not in self.channel_watch:
+      self.channel_watch[key] = ChannelWatch()
+    return self.channel_watch[key]
+
+  # counts the distinct nicks of the channel that are mentioned in a message,
+  # every word costs a lookup in the network's user registry
+  def count_highlights(self, channel, message):
+    words = set(message.replace(",", " ").replace(":", " ").split())
+    return sum(1 for word in words if channel.has_user(word))
+
+  # sets a restrictive mode on the channel for a while
+  def lockdown(self, conn, channel_name, reason):
+    bot = self.plugin.get_bot()
+    lockdown_mode = self.settings(bot.name).lockdown_mode
+    watch = self.get_channel_watch(bot.name, channel_name)
+    if watch.locked:
+      return
+
+    # stays locked even if we can't set the mode to not repeat the warning
+    logger.warning("%s in %s!", reason, channel_name)
+    watch.locked = True
+
+    mode_set = False
+    if not self.active:
+      pass
+    elif not bot.get_channel(channel_name).is_oper(conn.get_nickname()):
+      logger.warning("Can't lock down %s, not an operator.", channel_name)
+    else:
+      conn.mode(channel_name, lockdown_mode)
+      mode_set = True
+
+    # the timer isn't run for a network, so the bot and the mode are passed along
+    conn.execute_delayed(LOCKDOWN_TIME, self.lift_lockdown, (conn, bot, channel_name, lockdown_mode if mode_set else None))
+
+  def lift_lockdown(self, conn, bot, channel_name, lockdown_mode):
+    watch = self.get_channel_watch(bot.name, channel_name)
+    watch.locked = False
+
+    if lockdown_mode is not None and channel_name in bot.channels:
+      logger.info("Lifting lockdown of %s." % (channel_name))
+      conn.mode(channel_name, "-" + lockdown_mode.lstrip("+"))
+
+  def join_handler(self, conn, data):
+    if data.source.nick == conn.get_nickname():
+      return
+
+    settings = self.settings(data.network)
+    now = time.time()
+
+    # users coming back from a netsplit all rejoin at once, that's no flood
+    if not self.returns_from_split(data.network, data.source.nick, now):
+      watch = self.get_channel_watch(data.network, data.target)
+      members = len(self.plugin.get_bot().get_channel(data.target).members)
+      limit = watch.join_limit(settings.join_flood_limit, members, now)
+      watch.join_rate.add(now)
+
+      joins = ChannelWatch.count(watch.joins, now)
+      if joins >= limit:
+        self.lockdown(conn, data.target, "Join flood (%d joins in %d seconds)" % (joins, FLOOD_WINDOW))
+
+    account = self.account(data.source.nick)
+    if settings.whitelist.match_source(data.source, account):
+      return
+
+    # known offenders start with a raised score that decays as usual
+    # while they are quiet, so spamming right away gets them punished sooner
+    score = self.offender_score(data.network, data.source.host)
+    if score:
+      logger.info("User '%s' (%s) joined %s with a flood score of %d.", data.source.nick, data.source.host, data.target, score)
+      user = settings.store.get(data.network, data.target, data.source.host, account)
+      user.flood_score = max(user.flood_score, score)
+      user.last_message_time = time.time()
+
+  # remembers who quit in a netsplit, a later QUIT of the nick replaces it
+  def quit_handler(self, conn, data):
+    now = time.time()
+    key = (data.network, hostmask.fold(data.source.nick))
+    self.split_users.pop(key, None)
+    if data.arguments and SPLIT_REASON.match(data.arguments[0]):
+      self.split_users[key] = now
+
+    # the oldest entries are first
+    while self.split_users and now - next(self.split_users.itervalues()) > SPLIT_MEMORY:
+      self.split_users.popitem(last=False)
+
+  # the entry is kept, a user rejoins all their channels after a netsplit
+  def returns_from_split(self, network, nick, now):
+    split = self.split_users.get((network, hostmask.fold(nick)))
+    return split is not None and now - split <= SPLIT_MEMORY
+
+  # the services account of a user in one of our channels, None if they
+  # aren't logged in or the server doesn't tell (extended-join, account-notify)
+  def account(self, nick):
+    user = self.plugin.get_bot().users.get(nick)
+    return user.account if user is not None else None
+
+  # a lookup of the host and one of its subnet
+  def offender_score(self, network, host):
+    score = 0
+    offender = self.offenders.get(network, host)
+    if offender is not None:
+      score += OFFENDER_SCORE * offender.penalties
+
+    subnet = self.offenders.get_subnet(host)
+    if subnet is not None and subnet[0] > (offender is not None):
+      score += SUBNET_SCORE
+    return min(score, MAX_OFFENDER_SCORE)
+
   def pubmsg_handler(self, conn, data):
     channel_name = data.target
-    channel = self.plugin.get_bot().get_channel(channel_name)
-    
-    user = channel.get_user(data.source.nick)
-    message = data.arguments[0].split(":", 1)
+    nick = data.source.nick
+    host = data.source.host
+    message = data.arguments[0]
+    account = self.account(nick)
+    settings = self.settings(data.network)
 
-    # inject anti spam data into new users
-    if not hasattr(user, "plugin_antispam"):
-      user.plugin_antispam = {}
-      
-    if channel_name not in user.plugin_antispam:
-      user.plugin_antispam[channel_name] = AntiSpamData()
+    if settings.whitelist.match_source(data.source, account):
+      return
 
-      # check if users is connected via freenode webchat
-      if user.get_host().startswith("gateway/web"):
-        user.plugin_antispam[channel_name].uses_webchat = True
+    # the data is kept by account or host, so it survives rejoins and nick changes
+    user = settings.store.get(data.network, channel_name, host, account)
+    self.update(settings, user, message, account is not None)
 
-    if user.nick in self.whitelist:
-      return
+    highlights = self.count_highlights(self.plugin.get_bot().get_channel(channel_name), message)
+    if highlights >= settings.max_highlights:
+      logger.info("User '%s' (%s, %s) highlighted %d users!", nick, host, channel_name, highlights)
+      user.flooding = True
 
-    self.update(user.plugin_antispam[channel_name], message)
+      mass_highlights = ChannelWatch.count(self.get_channel_watch(data.network, channel_name).highlights, time.time())
+      if mass_highlights >= MASS_HIGHLIGHT_LIMIT:
+        self.lockdown(conn, channel_name, "Highlight flood (%d mass highlights in %d seconds)" % (mass_highlights, FLOOD_WINDOW))
 
-    if user.plugin_antispam[channel_name].flooding:
-      logger.info("User '%s' (%s, %s) is spamming!" % (user.get_nick(), user.get_host(), channel_name))
+    if user.flooding:
+      logger.info("User '%s' (%s, %s) is spamming!", nick, host, channel_name)
+      self.offenders.punish(data.network, host, channel_name)
 
+      # repeated quiets of a spammer are dropped by the dispatcher
       if self.active:
-        conn.privmsg("ChanServ", "QUIET " + channel_name + " " + user.get_nick())
+        self.plugin.get_bot().moderation.quiet(channel_name, self.quiet_mask(conn, host, account))
+
+      user.flooding = False
 
-      user.plugin_antispam[channel_name].flooding = False
+  # logged in users are quieted by account where the server has the $a
+  # extban (EXTBAN=$,a...), so others behind the same host aren't hit
+  def quiet_mask(self, conn, host, account):
+    prefix, _, types = str(getattr(conn.features, "extban", "")).partition(",")
+    if account and prefix == "$" and "a" in types:
+      return hostmask.ACCOUNT_PREFIX + account
+    return "*!*@" + host
 
-  def update(self, user, message):
+  def update(self, settings, user, message, registered=False):
     # a pause of a few seconds between messages keeps flood_score at 0
     msg_length = len(message)
     min_message_delay = MIN_SECONDS_BETWEEN_MESSAGES + (user.uses_webchat*2)
@@ -147,15 +503,15 @@ class Plugin(object):
       user.flood_score = 0
 
     # repeating messages increases flood_score
-    # this string comparison could be implemented as a levenshtein ratio
-    # to make it more robust against small text changes
-    if message == user.last_message:
+    # small changes to the text don't help against this
+    message_shingles = shingles(message)
+    if is_repeated(message_shingles, user.history, settings.similarity):
       user.similar_message_count += 1
       user.flood_score *= (user.similar_message_count)
     else:
       user.similar_message_count = 0
-    
-    user.last_message = message
+
+    user.history = ((message, len(message_shingles)),) + user.history[:settings.history_size - 1]
 
     # webchat users are more likely to be evil
     # proven by several studies
@@ -163,19 +519,17 @@ class Plugin(object):
       user.flood_score *= WEBCHAT_MULTIPLIER
 
     # TODO check for nazi scum catchphrases
-    # TODO Decrease flood score for registered users
 
-    # flood_score threshhold
-    if user.flood_score >= MAX_FLOOD_SCORE:
+    # flood_score threshhold, registered users are less likely to be
+    # throwaway spam accounts and get a higher one. their score still
+    # grows with every fast line, so a registered spammer is caught later
+    # but caught all the same
+    max_score = MAX_FLOOD_SCORE * (REGISTERED_LENIENCY if registered else 1)
+    if user.flood_score >= max_score:
       user.flooding = True
-      user.penalty_count += 1
-      
+
       # reset flood_score once a user is blamed
       # to avoid keeping a user in jail repeatedly
       user.flood_score = 0
     else:
       user.flooding = False
-
-
-
-
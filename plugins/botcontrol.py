@@ -16,7 +16,7 @@ class Plugin(object):
     self.plugin.add_command_handler("!channels", self.channels_handler)
 
   def channels_handler(self, conn, params, data):
-    conn.privmsg(data.source.nick, "Current channels: %s" % (", ".join(self.plugin.bot.channels)))
+    conn.privmsg(data.source.nick, "Current channels: %s" % (", ".join(self.plugin.get_bot().channels)))
 
   def join_handler(self, conn, params, data):
     if len(params) != 1:
@@ -1,39 +1,195 @@
+import os
+import json
+import time
 import logging
+import collections
+
+import metrics
+import hostmask
+import sketches
 
 logger = logging.getLogger("Core.Stats")
 
+# handlers listed by !stats handlers at most
+MAX_LINES              = 10
+
+LENGTH_BUCKETS         = (10, 20, 40, 60, 80, 120, 160, 240, 320, 400, 512)        # characters per message
+GAP_BUCKETS            = (1, 2, 4, 8, 15, 30, 60, 120, 300, 600, 1800, 3600)       # seconds between two messages of a speaker
+MAX_SPEAKERS           = 1000  # speakers per channel whose last message is remembered for the gaps
+EXPORT_FILE            = "chatter-stats.json"
+
+# streaming aggregates of the chatter in a channel
+#
+# everything is a counter, a fixed histogram or a sketch: the unique
+# speakers are counted by a HyperLogLog, the most active speakers by a
+# count-min sketch, so the memory used doesn't grow with the users passing
+# through. only the gaps need the last message time of a speaker, which is
+# kept for the MAX_SPEAKERS most recent ones.
+class ChannelStats(object):
+  def __init__(self, network, channel_name, now):
+    self.network = network
+    self.channel_name = channel_name
+    self.since = now
+    self.messages = 0
+    self.joins = 0
+    self.parts = 0
+    self.rates = [sketches.Rate(60, now), sketches.Rate(900, now)]
+    self.join_rate = sketches.Rate(60, now)
+    self.lengths = metrics.Histogram(LENGTH_BUCKETS)
+    self.gaps = metrics.Histogram(GAP_BUCKETS)
+    self.speakers = sketches.HyperLogLog()
+    self.top_speakers = sketches.HeavyHitters()
+    self.last_message = collections.OrderedDict()
+
+  def message(self, nick, message, now):
+    self.messages += 1
+    for rate in self.rates:
+      rate.add(now)
+    self.lengths.observe(len(message))
+
+    # one hash of the nick serves both sketches
+    key = hostmask.fold(nick)
+    first, second = sketches.hash64(key)
+    self.speakers.add_hash(first)
+    self.top_speakers.add_hash(key, first, second)
+
+    last = self.last_message.pop(key, None)
+    if last is not None:
+      self.gaps.observe(now - last)
+    self.last_message[key] = now
+    if len(self.last_message) > MAX_SPEAKERS:
+      self.last_message.popitem(last=False)
+
+  def join(self, now):
+    self.joins += 1
+    self.join_rate.add(now)
+
+  def part(self):
+    self.parts += 1
+
+  def summary(self, now):
+    return "%s on %s: %.1f/%.1f messages per minute (1m/15m), %d messages by ~%d speakers, %d joins, %d parts, length p50 < %d p90 < %d, gap p50 < %.1fs p90 < %.1fs, top: %s" % (
+      self.channel_name, self.network, self.rates[0].per_second(now) * 60, self.rates[1].per_second(now) * 60, self.messages, self.speakers.count(),
+      self.joins, self.parts, self.lengths.percentile(0.5), self.lengths.percentile(0.9), self.gaps.percentile(0.5), self.gaps.percentile(0.9),
+      ", ".join("%s (%d)" % x for x in self.top_speakers.most_common()[:5]) or "-")
+
+  def to_dict(self, now):
+    return {
+      "network": self.network,
+      "channel": self.channel_name,
+      "since": self.since,
+      "messages": self.messages,
+      "joins": self.joins,
+      "parts": self.parts,
+      "messages_per_minute": [rate.per_second(now) * 60 for rate in self.rates],
+      "joins_per_minute": self.join_rate.per_second(now) * 60,
+      "unique_speakers": self.speakers.count(),
+      "top_speakers": self.top_speakers.most_common(),
+      "line_lengths": {"buckets": list(LENGTH_BUCKETS), "counts": self.lengths.counts, "sum": self.lengths.sum, "max": self.lengths.max},
+      "gaps": {"buckets": list(GAP_BUCKETS), "counts": self.gaps.counts, "sum": self.gaps.sum, "max": self.gaps.max},
+      "speaker_registers": self.speakers.to_dict(),
+    }
+
 class Plugin(object):
   _name_ = "Statistics"
   _author_ = "Fabian Schlager"
-  _description_ = "Basic bot control commands such as !join, !part, ..."
+  _description_ = "Collects statistics about the bot's channels."
+  _help_ = "!stats plugins - Time spent in the handlers of every plugin\n!stats handlers [<plugin>] - The slowest handlers\n!stats traffic - Lines received and sent per network\n!stats channels [<channel>] - Chatter statistics of the channels\n!stats export - Write the chatter statistics of all channels to a file"
 
   def __init__(self, plugin):
     self.plugin = plugin
 
-    self.plugin.add_command_handler("!join", self.join_handler)
-    self.plugin.add_command_handler("!part", self.part_handler)
-    self.plugin.add_command_handler("!nick", self.nick_handler)
-
-  def join_handler(self, conn, params, data):
-    if len(params) != 1:
-      conn.privmsg(data.source.nick, "Usage: !join <channel>")
-      return
-    
-    logger.info("Joining channel '%s'" % (params[0]))
-    conn.join(params[0])
-
-  def part_handler(self, conn, params, data):
-    if len(params) != 1:
-      conn.privmsg(data.source.nick, "Usage: !part <channel>")
-      return
-
-    logger.info("Parting channel '%s'" % (params[0]))
-    conn.part(params[0])
-
-  def nick_handler(self, conn, params, data):
-    if len(params) != 1:
-      conn.privmsg(data.source.nick, "Usage: !nick <nick>")
-      return
-
-    logger.info("Changing nick to '%s'" % (params[0]))
-    conn.nick(params[0])
+    self.plugin.add_command_handler("!stats", self.stats_handler, "!stats plugins|handlers [<plugin>]|traffic|channels [<channel>]|export - Show handler timings, traffic and chatter statistics")
+
+    self.plugin.add_event_handler("PUBMSG", self.pubmsg_handler)
+    self.plugin.add_event_handler("JOIN", self.join_handler)
+    self.plugin.add_event_handler("PART", self.part_handler)
+
+    self.channels = {}
+
+  def get_channel_stats(self, network, channel_name):
+    key = (network, channel_name.lower())
+    stats = self.channels.get(key)
+    if stats is None:
+      stats = self.channels[key] = ChannelStats(network, channel_name, time.time())
+    return stats
+
+  def pubmsg_handler(self, conn, data):
+    self.get_channel_stats(data.network, data.target).message(data.source.nick, data.arguments[0], time.time())
+
+  def join_handler(self, conn, data):
+    if data.source.nick != conn.get_nickname():
+      self.get_channel_stats(data.network, data.target).join(time.time())
+
+  def part_handler(self, conn, data):
+    if data.source.nick != conn.get_nickname():
+      self.get_channel_stats(data.network, data.target).part()
+
+  # all channels in one file, written to a temporary file first so a
+  # reader never sees half of it
+  def export(self, path):
+    now = time.time()
+    channels = [stats.to_dict(now) for stats in self.channels.values()]
+    with open(path + ".tmp", "w") as f:
+      json.dump({"time": now, "channels": channels}, f)
+    os.rename(path + ".tmp", path)
+    return len(channels)
+
+  def format(self, name, histogram):
+    return "%s: %d calls, %.2fms avg, p99 < %.2fms, max %.2fms, %.2fs total" % (name, histogram.count, histogram.mean() * 1000, histogram.percentile(0.99) * 1000, histogram.max * 1000, histogram.sum)
+
+  def stats_handler(self, conn, params, data):
+    nick = data.source.nick
+    metrics = self.plugin.get_metrics()
+    what = params[0] if params else "plugins"
+
+    if what == "plugins":
+      plugins = metrics.per_plugin()
+      if not plugins:
+        conn.privmsg(nick, "No plugin handler has run yet.")
+
+      for name in sorted(plugins, key=lambda x: -plugins[x].sum):
+        conn.privmsg(nick, self.format(name, plugins[name]))
+
+    elif what == "handlers":
+      handlers = sorted(metrics.handlers.items(), key=lambda x: -x[1].sum)
+      if len(params) > 1:
+        handlers = [x for x in handlers if x[0][0] == params[1]]
+
+      if not handlers:
+        conn.privmsg(nick, "No handler has run yet.")
+
+      for (plugin, kind, name), histogram in handlers[:MAX_LINES]:
+        line = self.format("%s %s %s" % (plugin, kind, name), histogram)
+        if metrics.errors[(plugin, kind, name)]:
+          line += ", %d errors" % (metrics.errors[(plugin, kind, name)])
+        conn.privmsg(nick, line)
+
+    elif what == "traffic":
+      for network in self.plugin.get_networks().values():
+        conn.privmsg(nick, "%s: %d lines received, %d lines sent for %d messages, %d queued" % (network.name, metrics.inbound[network.name], network.sendq.sent_lines, network.sendq.sent_messages, network.sendq.depth()))
+
+    elif what == "channels":
+      now = time.time()
+      channels = sorted(self.channels.values(), key=lambda x: -x.messages)
+      if len(params) > 1:
+        channels = [x for x in channels if x.channel_name.lower() == params[1].lower()]
+
+      if not channels:
+        conn.privmsg(nick, "No chatter seen yet.")
+
+      for stats in channels[:MAX_LINES]:
+        conn.privmsg(nick, stats.summary(now))
+
+    elif what == "export":
+      path = self.plugin.get_config_value("export", EXPORT_FILE)
+      try:
+        count = self.export(path)
+      except (IOError, OSError), e:
+        logger.error("Couldn't export the chatter statistics to '%s': %s", path, e)
+        conn.privmsg(nick, "Couldn't export the chatter statistics: %s" % (e))
+        return
+      conn.privmsg(nick, "Exported the chatter statistics of %d channels to '%s'." % (count, path))
+
+    else:
+      conn.privmsg(nick, "Usage: !stats plugins|handlers [<plugin>]|traffic|channels [<channel>]|export")
@@ -0,0 +1,249 @@
+import time
+import collections
+import logging
+
+import irc.client
+
+PRIORITY_CONTROL       = 0
+PRIORITY_NORMAL        = 1
+
+MAX_LINE_BYTES         = 512   # RFC 1459 line limit including CR LF
+PREFIX_RESERVE         = 100   # room for the ":nick!user@host " the server prepends when relaying
+COALESCE_SEPARATOR     = " | "
+
+# messages to these targets are sent ahead of everything else and never merged
+CONTROL_TARGETS        = set(["chanserv", "nickserv"])
+
+logger = logging.getLogger("DontMindMe.SendQueue")
+
+def byte_length(text):
+  if isinstance(text, unicode):
+    return len(text.encode("utf-8"))
+  return len(text)
+
+# the longest start of a word that fits budget bytes and the rest, a UTF-8
+# sequence is never cut in two
+def cut(word, budget):
+  if isinstance(word, unicode):
+    head = word.encode("utf-8")[:budget].decode("utf-8", "ignore")
+    return head, word[len(head):]
+
+  # continuation bytes of a sequence are 10xxxxxx
+  end = budget
+  while end > 0 and 0x80 <= ord(word[end]) < 0xc0:
+    end -= 1
+  if end == 0:
+    end = budget
+  return word[:end], word[end:]
+
+# splits a message that does not fit into a single line at word boundaries
+def split_message(text, budget):
+  if byte_length(text) <= budget:
+    return [text]
+
+  parts = []
+  line = ""
+  for word in text.split(" "):
+    while byte_length(word) > budget:
+      if line:
+        parts.append(line)
+        line = ""
+      part, word = cut(word, budget)
+      parts.append(part)
+
+    if not line:
+      line = word
+    elif byte_length(line) + 1 + byte_length(word) <= budget:
+      line += " " + word
+    else:
+      parts.append(line)
+      line = word
+
+  if line:
+    parts.append(line)
+  return parts
+
+# JOIN lines with as many channels as fit a line and the server's TARGMAX
+# for JOIN allows, limit None means any number
+def join_lines(channels, limit=None):
+  budget = MAX_LINE_BYTES - 2 - byte_length("JOIN ")
+  lines = []
+  batch = []
+  length = 0
+
+  for channel in channels:
+    needed = byte_length(channel) + (1 if batch else 0)
+    if batch and (length + needed > budget or (limit is not None and len(batch) >= limit)):
+      lines.append("JOIN " + ",".join(batch))
+      batch = []
+      length = 0
+      needed -= 1
+    batch.append(channel)
+    length += needed
+
+  if batch:
+    lines.append("JOIN " + ",".join(batch))
+  return lines
+
+# outbound message queue with a token bucket for flood control
+#
+# control traffic (raw commands, services) is sent first, as is and right away.
+# chatty replies are only sent once the current batch of events has been
+# handled, merged per target into as few lines as fit the line limit.
+# everything that is not a message is passed through to the connection.
+class SendQueue(object):
+  def __init__(self, connection, rate=1.0, burst=5, clock=time.time):
+    self.connection = connection
+    self.rate = rate
+    self.burst = burst
+    self.clock = clock
+    self.tokens = float(burst)
+    self.last_refill = clock()
+    self.flush_scheduled = False
+
+    self.control = collections.deque()
+    self.pending = collections.OrderedDict()
+    self.pending_count = 0
+
+    self.sent_lines = 0
+    self.sent_messages = 0
+    self.latency_last = 0.0
+    self.latency_avg = 0.0
+    self.latency_max = 0.0
+
+  # anything we don't queue goes straight to the connection
+  def __getattr__(self, name):
+    return getattr(self.connection, name)
+
+  def privmsg(self, target, text, priority=None):
+    self.enqueue("PRIVMSG", target, text, priority)
+
+  def notice(self, target, text, priority=None):
+    self.enqueue("NOTICE", target, text, priority)
+
+  def mode(self, target, command):
+    self.send_raw("MODE %s %s" % (target, command))
+
+  def send_raw(self, line):
+    self.control.append((line, self.clock()))
+    self.pending_count += 1
+    self.flush()
+
+  def enqueue(self, command, target, text, priority=None):
+    if priority is None:
+      priority = PRIORITY_CONTROL if target.lower() in CONTROL_TARGETS else PRIORITY_NORMAL
+
+    head = "%s %s :" % (command, target)
+    now = self.clock()
+
+    if priority == PRIORITY_CONTROL:
+      self.control.append((head + text, now))
+      self.pending_count += 1
+      self.flush()
+    else:
+      queue = self.pending.setdefault((command, target), collections.deque())
+      for part in split_message(text, self.line_budget(head)):
+        queue.append((part, now))
+        self.pending_count += 1
+      self.schedule_flush(0)
+
+  def line_budget(self, head):
+    return MAX_LINE_BYTES - PREFIX_RESERVE - byte_length(head) - 2
+
+  def depth(self):
+    return self.pending_count
+
+  def clear(self):
+    self.control.clear()
+    self.pending.clear()
+    self.pending_count = 0
+
+  def refill(self):
+    now = self.clock()
+    self.tokens = min(float(self.burst), self.tokens + (now - self.last_refill) * self.rate)
+    self.last_refill = now
+
+  def schedule_flush(self, delay):
+    if not self.flush_scheduled:
+      self.flush_scheduled = True
+      self.connection.execute_delayed(delay, self.scheduled_flush)
+
+  def scheduled_flush(self):
+    self.flush_scheduled = False
+    self.flush()
+
+  # sends as many lines as the bucket allows and schedules the rest
+  def flush(self):
+    if self.rate > 0:
+      self.refill()
+
+    while self.control or self.pending:
+      if self.rate > 0 and self.tokens < 1:
+        break
+
+      if self.control:
+        line, enqueued = self.control.popleft()
+        latencies = [enqueued]
+      else:
+        line, latencies = self.next_line()
+
+      try:
+        self.connection.send_raw(line)
+      except irc.client.ServerConnectionError:
+        logger.warning("Not connected, dropping %d queued messages." % (self.pending_count))
+        self.clear()
+        return
+      except (irc.client.MessageTooLong, irc.client.InvalidCharacters):
+        logger.exception("Dropping invalid line: %r", line)
+
+      if self.rate > 0:
+        self.tokens -= 1
+
+      self.record_latency(self.clock() - min(latencies))
+      self.pending_count -= len(latencies)
+      self.sent_lines += 1
+      self.sent_messages += len(latencies)
+
+    if self.control or self.pending:
+      self.schedule_flush((1 - self.tokens) / self.rate)
+
+  # takes the first target in line and packs as many of its messages as fit,
+  # targets with messages left over are put back to the end for fairness
+  def next_line(self):
+    (command, target), queue = self.pending.popitem(last=False)
+
+    text, enqueued = queue.popleft()
+    latencies = [enqueued]
+
+    head = "%s %s :" % (command, target)
+    budget = self.line_budget(head)
+    length = byte_length(text)
+
+    # CTCP messages must stay on a line of their own
+    while queue and not text.startswith("\001") and not queue[0][0].startswith("\001"):
+      next_length = byte_length(queue[0][0])
+      if length + len(COALESCE_SEPARATOR) + next_length > budget:
+        break
+
+      part, enqueued = queue.popleft()
+      text += COALESCE_SEPARATOR + part
+      length += len(COALESCE_SEPARATOR) + next_length
+      latencies.append(enqueued)
+
+    line = head + text
+
+    if queue:
+      self.pending[(command, target)] = queue
+
+    return line, latencies
+
+  def record_latency(self, latency):
+    self.latency_last = latency
+    if self.sent_lines:
+      self.latency_avg = self.latency_avg * 0.9 + latency * 0.1
+    else:
+      self.latency_avg = latency
+    self.latency_max = max(self.latency_max, latency)
+
+  def __str__(self):
+    return "%d queued, %d lines sent for %d messages, latency %.0fms avg, %.0fms max" % (self.depth(), self.sent_lines, self.sent_messages, self.latency_avg * 1000, self.latency_max * 1000)
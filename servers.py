@@ -0,0 +1,150 @@
+import time
+import random
+import socket
+import logging
+import threading
+
+BACKOFF_BASE           = 2      # seconds before reconnecting the first time, doubled with every failed attempt
+BACKOFF_MAX            = 300    # seconds between two attempts at most
+LAG_INTERVAL           = 60     # seconds between two PINGs measuring the lag of the current server
+LAG_TIMEOUT            = 120    # seconds without a PONG after which the connection counts as dead
+PROBE_TIMEOUT          = 5      # seconds a probe waits for the TCP handshake
+LATENCY_WEIGHT         = 0.3    # weight of a new sample in a server's average latency
+
+logger = logging.getLogger("DontMindMe.Servers")
+
+# a comma separated list of host[:port], IPv6 addresses in brackets like [2001:db8::1]:6697
+def parse_servers(value, default_port):
+  servers = []
+  for entry in value.split(","):
+    entry = entry.strip()
+    if not entry:
+      continue
+
+    host, port = entry, default_port
+    if entry.startswith("["):
+      host, _, rest = entry[1:].partition("]")
+      if rest.startswith(":"):
+        port = int(rest[1:])
+    elif entry.count(":") == 1:
+      host, port = entry.split(":")
+      port = int(port)
+    servers.append(Server(host, int(port)))
+  return servers
+
+# equal jitter: half of the delay is fixed, the other half random, so the
+# bots of a network don't all come back at the same moment after a netsplit
+def backoff(attempts, base=BACKOFF_BASE, cap=BACKOFF_MAX, rnd=random):
+  delay = min(cap, base * 2 ** attempts)
+  return delay / 2.0 + rnd.uniform(0, delay / 2.0)
+
+class Server(object):
+  __slots__ = ("host", "port", "password", "latency", "reachable", "failures", "retry_at")
+
+  def __init__(self, host, port, password=None):
+    self.host = host
+    self.port = port
+    self.password = password
+    self.latency = None     # average of handshake and PING round trip times, None until measured
+    self.reachable = None   # result of the last probe
+    self.failures = 0       # failed connects since the last successful one
+    self.retry_at = 0
+
+  def observe(self, latency):
+    if self.latency is None:
+      self.latency = latency
+    else:
+      self.latency += LATENCY_WEIGHT * (latency - self.latency)
+
+  def __str__(self):
+    if ":" in self.host:
+      return "[%s]:%d" % (self.host, self.port)
+    return "%s:%d" % (self.host, self.port)
+
+# the servers of a network and how well they did
+#
+# a server that couldn't be connected to, dropped us before the welcome or
+# stopped answering PINGs is skipped for an exponentially growing, jittered
+# time. of the others the one with the fewest failures, then a successful
+# last probe, then the lowest latency is picked, the order of the config
+# breaks ties. after losing the connection all servers are probed with a
+# TCP handshake on a background thread, the probes only update the
+# latencies and reachability the next pick is based on.
+class ServerPool(object):
+  def __init__(self, servers, base=BACKOFF_BASE, cap=BACKOFF_MAX, clock=time.time, rnd=random):
+    self.servers = servers
+    self.base = base
+    self.cap = cap
+    self.clock = clock
+    self.random = rnd
+    self.current = servers[0]
+    self.probing = False
+
+  def backoff(self, attempts):
+    return backoff(attempts, self.base, self.cap, self.random)
+
+  def choose(self):
+    now = self.clock()
+    ready = [x for x in self.servers if x.retry_at <= now]
+    if not ready:
+      ready = [min(self.servers, key=lambda x: x.retry_at)]
+
+    order = dict((x, i) for i, x in enumerate(self.servers))
+    self.current = min(ready, key=lambda x: (x.failures, x.reachable is False,
+      x.latency if x.latency is not None else float("inf"), order[x]))
+    return self.current
+
+  # seconds until the next attempt, BACKOFF_BASE / 2 to BACKOFF_BASE as
+  # long as a server hasn't failed yet, only growing once all of them did
+  def delay(self):
+    now = self.clock()
+    earliest = min(x.retry_at for x in self.servers)
+    return max(self.backoff(min(x.failures for x in self.servers)), earliest - now)
+
+  def failed(self, server):
+    server.failures += 1
+    server.retry_at = self.clock() + self.backoff(server.failures)
+
+  def connected(self, server):
+    server.failures = 0
+    server.retry_at = 0
+    server.reachable = True
+
+  def probe(self, timeout=PROBE_TIMEOUT):
+    if self.probing or len(self.servers) < 2:
+      return
+
+    self.probing = True
+    thread = threading.Thread(target=self.run_probes, args=(list(self.servers), timeout), name="DontMindMe.Servers")
+    thread.daemon = True
+    thread.start()
+
+  def run_probes(self, servers, timeout):
+    try:
+      for server in servers:
+        start = time.time()
+        try:
+          socket.create_connection((server.host, server.port), timeout).close()
+        except (socket.error, socket.timeout), e:
+          server.reachable = False
+          logger.info("Probe of %s failed: %s", server, e)
+        else:
+          server.reachable = True
+          server.observe(time.time() - start)
+    finally:
+      self.probing = False
+
+  def __str__(self):
+    now = self.clock()
+    states = []
+    for server in self.servers:
+      if server.retry_at > now:
+        state = "%d failures, retry in %ds" % (server.failures, server.retry_at - now)
+      elif server.reachable is False:
+        state = "unreachable"
+      elif server.latency is not None:
+        state = "%.0fms" % (server.latency * 1000)
+      else:
+        state = "not measured"
+      states.append("%s%s (%s)" % ("*" if server is self.current else "", server, state))
+    return ", ".join(states)
@@ -0,0 +1,150 @@
+import math
+import array
+import struct
+import hashlib
+
+HLL_PRECISION          = 10    # 2^10 one byte registers, about 3% standard error
+CMS_WIDTH              = 1024  # counters per row of a count-min sketch
+CMS_DEPTH              = 4     # rows, each with its own hash
+TOP_K                  = 10    # heavy hitters kept with their counts
+
+# 2^-rank for every rank a register can hold
+POWERS                 = [2.0 ** -x for x in xrange(65)]
+
+# two independent 64 bit hashes of a key, a count-min sketch derives all
+# its rows from them
+def hash64(key):
+  if isinstance(key, unicode):
+    key = key.encode("utf-8")
+  return struct.unpack("<QQ", hashlib.md5(key).digest())
+
+# counts distinct keys in a fixed 2^precision bytes
+class HyperLogLog(object):
+  __slots__ = ("precision", "registers")
+
+  def __init__(self, precision=HLL_PRECISION):
+    self.precision = precision
+    self.registers = bytearray(1 << precision)
+
+  def add(self, key):
+    self.add_hash(hash64(key)[0])
+
+  def add_hash(self, value):
+    index = value & ((1 << self.precision) - 1)
+    rest = value >> self.precision
+    rank = 64 - self.precision - rest.bit_length() + 1
+    if rank > self.registers[index]:
+      self.registers[index] = rank
+
+  def count(self):
+    m = len(self.registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(POWERS[x] for x in self.registers)
+
+    # linear counting is more accurate while many registers are still empty
+    zeros = self.registers.count("\0")
+    if estimate <= 2.5 * m and zeros:
+      estimate = m * math.log(float(m) / zeros)
+    return int(round(estimate))
+
+  def merge(self, other):
+    for i, rank in enumerate(other.registers):
+      if rank > self.registers[i]:
+        self.registers[i] = rank
+
+  def to_dict(self):
+    return {"precision": self.precision, "registers": list(self.registers)}
+
+# estimates how often a key was added, never less than the real count, in
+# a fixed width * depth counters. counters are only raised as far as the
+# smallest of them needs to (conservative update), which keeps the
+# overestimate of rare keys low.
+class CountMinSketch(object):
+  __slots__ = ("width", "depth", "rows", "total")
+
+  def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH):
+    self.width = width
+    self.depth = depth
+    self.rows = [array.array("I", [0]) * width for _ in xrange(depth)]
+    self.total = 0
+
+  # the counter of the key in every row, row i uses the hash first + i * second
+  def cells(self, first, second):
+    cells = []
+    for row in self.rows:
+      cells.append((row, first % self.width))
+      first += second
+    return cells
+
+  # returns the new estimate of the key
+  def add_hash(self, first, second, count=1):
+    cells = self.cells(first, second)
+    estimate = min([row[i] for row, i in cells]) + count
+    for row, i in cells:
+      if row[i] < estimate:
+        row[i] = estimate
+    self.total += count
+    return estimate
+
+  def add(self, key, count=1):
+    return self.add_hash(*hash64(key), count=count)
+
+  def estimate(self, key):
+    return min([row[i] for row, i in self.cells(*hash64(key))])
+
+# the k keys with the highest counts according to a count-min sketch,
+# a key replaces the smallest of them once its estimate exceeds it. counts
+# only grow, so the smallest count is only looked for again once an
+# estimate exceeds the one found last time.
+class HeavyHitters(object):
+  __slots__ = ("k", "sketch", "top", "floor")
+
+  def __init__(self, k=TOP_K, width=CMS_WIDTH, depth=CMS_DEPTH):
+    self.k = k
+    self.sketch = CountMinSketch(width, depth)
+    self.top = {}
+    self.floor = 0
+
+  def add(self, key):
+    self.add_hash(key, *hash64(key))
+
+  def add_hash(self, key, first, second):
+    estimate = self.sketch.add_hash(first, second)
+    if key in self.top or len(self.top) < self.k:
+      self.top[key] = estimate
+      return
+    if estimate <= self.floor:
+      return
+
+    smallest = min(self.top, key=self.top.get)
+    if estimate > self.top[smallest]:
+      del self.top[smallest]
+      self.top[key] = estimate
+      smallest = min(self.top, key=self.top.get)
+    self.floor = self.top[smallest]
+
+  # (key, estimated count) with the highest first
+  def most_common(self):
+    return sorted(self.top.items(), key=lambda x: -x[1])
+
+# events per second, exponentially decayed over window seconds like the
+# load average, constant memory however many events there are
+class Rate(object):
+  __slots__ = ("window", "value", "updated")
+
+  def __init__(self, window, now=0):
+    self.window = float(window)
+    self.value = 0.0
+    self.updated = now
+
+  def decay(self, now):
+    if now > self.updated:
+      self.value *= math.exp((self.updated - now) / self.window)
+      self.updated = now
+
+  def add(self, now, count=1):
+    self.decay(now)
+    self.value += count
+
+  def per_second(self, now):
+    self.decay(now)
+    return self.value / self.window
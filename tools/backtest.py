@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# replays AntiSpam's per message scoring (Plugin.update) over recorded
+# channel logs for a whole grid of parameter sets at once and reports how
+# many users every set would have quieted, with precision and recall
+# against a labelled sample of hosts
+#
+# the log is read into columns and sorted by user and time. which messages
+# are repeated and how many in a row only depends on the log, so that is
+# worked out once with array operations. the scores are then updated for
+# the n-th message of every user at the same time, for all parameter sets
+# in one (users, parameter sets) array, so the loop runs as often as the
+# most active user spoke rather than once per message.
+#
+# the log has a line per message: <unix time> <channel> <nick!user@host>
+# <message>, separated by tabs. the labels have a line per host: <host>
+# spam|ham, hosts without a label count for neither precision nor recall.
+# the log doesn't say who was logged in to services, the hosts of users
+# that were can be given one per line with --registered, their threshold
+# is raised by the registered leniency.
+#
+# repeated messages are the same after lower casing and dropping digits
+# and whitespace, the plugin's near-duplicate check also catches other
+# small changes, so on such spam the recall is a lower bound. mass
+# highlights and lockdowns are not replayed.
+from __future__ import print_function, division
+
+import os
+import ast
+import json
+import time
+import random
+import string
+import argparse
+import itertools
+
+import numpy
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# the length penalty of Plugin.update, min(11, (length / 80) ** 1.7) with
+# the integer division of Python 2
+LENGTH_DIVISOR = 80
+LENGTH_EXPONENT = 1.7
+MAX_LENGTH_PENALTY = 11
+
+# dropped before messages are compared
+NOISE = b"0123456789 \t\x0b\x0c"
+
+# the module level numbers of the plugin, read without importing it
+def read_constants(path):
+  with open(path) as f:
+    tree = ast.parse(f.read(), path)
+
+  constants = {}
+  for node in tree.body:
+    if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+      try:
+        value = ast.literal_eval(node.value)
+      except ValueError:
+        continue
+      if isinstance(value, (int, float)):
+        constants[node.targets[0].id] = value
+  return constants
+
+class Log(object):
+  def __init__(self):
+    self.times = []
+    self.users = []
+    self.lengths = []
+    self.hashes = []
+    self.user_ids = {}     # (channel, host): user
+    self.hosts = []        # host of every user
+    self.registered = set()  # hosts logged in to services
+
+  # channel, source and message as UTF-8 encoded bytes
+  def add(self, timestamp, channel, source, message):
+    host = source.rpartition(b"@")[2]
+    key = (channel.lower(), host)
+    user = self.user_ids.get(key)
+    if user is None:
+      user = self.user_ids[key] = len(self.hosts)
+      self.hosts.append(host.decode("utf-8", "replace"))
+
+    self.times.append(timestamp)
+    self.users.append(user)
+    self.lengths.append(len(message.decode("utf-8", "replace")))
+    self.hashes.append(hash(message.lower().translate(None, NOISE)))
+
+  # read as bytes, only the host of every user is decoded
+  def read(self, path):
+    with open(path, "rb") as f:
+      for line in f:
+        parts = line.rstrip(b"\r\n").split(b"\t", 3)
+        if len(parts) != 4:
+          continue
+        try:
+          timestamp = float(parts[0])
+        except ValueError:
+          continue
+        self.add(timestamp, parts[1], parts[2], parts[3])
+
+  def __len__(self):
+    return len(self.times)
+
+def read_hosts(path):
+  with open(path) as f:
+    return set(line.strip() for line in f if line.strip() and not line.startswith("#"))
+
+def read_labels(path):
+  labels = {}
+  with open(path) as f:
+    for line in f:
+      parts = line.split()
+      if len(parts) == 2 and not parts[0].startswith("#"):
+        labels[parts[0]] = parts[1].lower() in ("spam", "1", "yes")
+  return labels
+
+# a day in a few channels: users chatting at their own pace and spammers
+# repeating a line with a counter every second or two, spammers are never
+# logged in to services
+def synthetic(users, spammer_ratio, webchat_ratio, registered_ratio, seed):
+  rnd = random.Random(seed)
+  words = ["".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(2, 9))) for _ in range(2000)]
+  log = Log()
+  labels = {}
+  events = []
+
+  for i in range(users):
+    host = "gateway/web/freenode/ip.192.0.%d.%d" % (i // 250 % 250, i % 250) if rnd.random() < webchat_ratio else "host%d.example.com" % (i)
+    source = "user%d!u@%s" % (i, host)
+    channel = "#channel%d" % (rnd.randrange(10))
+    now = rnd.uniform(0, 86400)
+    spammer = rnd.random() < spammer_ratio
+    labels[host] = spammer
+    if not spammer and rnd.random() < registered_ratio:
+      log.registered.add(host)
+
+    if spammer:
+      line = " ".join(rnd.choice(words) for _ in range(rnd.randint(5, 20)))
+      for n in range(rnd.randint(5, 40)):
+        events.append((now, channel, source, "%s %d" % (line, n)))
+        now += rnd.uniform(0.3, 3)
+    else:
+      for _ in range(int(rnd.expovariate(1 / 30)) + 1):
+        events.append((now, channel, source, " ".join(rnd.choice(words) for _ in range(rnd.randint(1, 25)))))
+        now += rnd.expovariate(1 / 40) + 1
+
+  for now, channel, source, message in events:
+    log.add(now, channel.encode("utf-8"), source.encode("utf-8"), message.encode("utf-8"))
+  return log, labels
+
+def parse_list(text, type):
+  return [type(x) for x in text.split(",") if x.strip()]
+
+# the product of all values, one row per parameter set
+def grid(args):
+  names = ("min_delay", "webchat_multiplier", "max_score", "registered_leniency", "length_divisor", "length_exponent")
+  values = (parse_list(args.min_delay, float), parse_list(args.webchat_multiplier, float), parse_list(args.max_score, float),
+    parse_list(args.registered_leniency, float), parse_list(args.length_divisor, int), parse_list(args.length_exponent, float))
+  return names, numpy.array(list(itertools.product(*values)), dtype=float)
+
+def backtest(log, params, history, ttl):
+  times = numpy.array(log.times, dtype=float)
+  users = numpy.array(log.users, dtype=numpy.int64)
+  lengths = numpy.array(log.lengths, dtype=float)
+  hashes = numpy.array(log.hashes, dtype=numpy.int64)
+  webchat_users = numpy.array([x.startswith("gateway/web") for x in log.hosts], dtype=bool)
+  registered_users = numpy.array([x in log.registered for x in log.hosts], dtype=bool)
+
+  order = numpy.lexsort((times, users))
+  times, users, lengths, hashes = times[order], users[order], lengths[order], hashes[order]
+  webchat = webchat_users[users]
+  registered = registered_users[users]
+
+  # the plugin drops the data of a user idle for ttl seconds, so the
+  # history only reaches back to the start of the current session
+  first = numpy.r_[True, users[1:] != users[:-1]]
+  gaps = numpy.r_[numpy.inf, numpy.diff(times)]
+  gaps[first] = numpy.inf
+  sessions = numpy.cumsum(first | (gaps > ttl))
+
+  # repeated like one of the last history messages
+  repeated = numpy.zeros(len(times), dtype=bool)
+  for j in range(1, history + 1):
+    repeated[j:] |= (sessions[j:] == sessions[:-j]) & (hashes[j:] == hashes[:-j])
+
+  # the score is multiplied by the number of repeated messages in a row
+  count = numpy.cumsum(repeated)
+  run = count - numpy.maximum.accumulate(numpy.where(repeated, 0, count))
+  factors = numpy.where(repeated, run, 1).astype(float)
+
+  # the n-th message of every user is scored in step n
+  starts = numpy.flatnonzero(first)
+  ranks = numpy.arange(len(times)) - numpy.repeat(starts, numpy.diff(numpy.r_[starts, len(times)]))
+  steps = numpy.argsort(ranks, kind="stable")
+  bounds = numpy.searchsorted(ranks[steps], numpy.arange(ranks.max() + 2 if len(ranks) else 0))
+
+  # the length penalty of every message for every distinct divisor and exponent
+  min_delay, multiplier, max_score, leniency = params[:, :4].T
+  lengths_params, penalty_columns = numpy.unique(params[:, 4:], axis=0, return_inverse=True)
+  penalties = numpy.minimum(MAX_LENGTH_PENALTY, numpy.floor(lengths[:, None] / lengths_params[:, 0]) ** lengths_params[:, 1])
+
+  scores = numpy.zeros((len(log.hosts), len(params)))
+  quiets = numpy.zeros((len(log.hosts), len(params)), dtype=numpy.int64)
+
+  for step in range(len(bounds) - 1):
+    messages = steps[bounds[step]:bounds[step + 1]]
+    step_users = users[messages]
+    step_webchat = webchat[messages][:, None]
+
+    score = scores[step_users]
+    score += min_delay + 2 * step_webchat - gaps[messages][:, None]
+    penalty = penalties[messages]
+    score += penalty if len(lengths_params) == 1 else penalty[:, penalty_columns.ravel()]
+    numpy.maximum(score, 0, out=score)
+    score *= factors[messages][:, None] * numpy.where(step_webchat, multiplier, 1.0)
+
+    quieted = score >= max_score * numpy.where(registered[messages][:, None], leniency, 1.0)
+    score[quieted] = 0
+    scores[step_users] = score
+    quiets[step_users] += quieted
+
+  return quiets
+
+def evaluate(log, quiets, labels):
+  quieted = quiets > 0
+  label = numpy.array([labels.get(x, -1) for x in log.hosts], dtype=numpy.int64)[:, None]
+
+  true_positives = (quieted & (label == 1)).sum(0)
+  false_positives = (quieted & (label == 0)).sum(0)
+  false_negatives = (~quieted & (label == 1)).sum(0)
+
+  with numpy.errstate(divide="ignore", invalid="ignore"):
+    precision = true_positives / (true_positives + false_positives)
+    recall = true_positives / (true_positives + false_negatives)
+    f1 = 2 * precision * recall / (precision + recall)
+
+  return {"users": quieted.sum(0), "quiets": quiets.sum(0), "true_positives": true_positives, "false_positives": false_positives,
+    "false_negatives": false_negatives, "precision": precision, "recall": recall, "f1": f1}
+
+def main():
+  constants = read_constants(os.path.join(ROOT, "plugins", "antispam.py"))
+
+  parser = argparse.ArgumentParser(description="Replay the AntiSpam scoring over a channel log for a grid of parameters.")
+  parser.add_argument("log", nargs="?", help="Channel log, <time> <channel> <nick!user@host> <message> separated by tabs")
+  parser.add_argument("--labels", help="Labelled hosts, <host> spam|ham per line")
+  parser.add_argument("--synthetic", type=int, metavar="USERS", help="Generate a labelled log of that many users instead")
+  parser.add_argument("--spammers", type=float, default=0.03, help="Ratio of spammers in the synthetic log")
+  parser.add_argument("--webchat", type=float, default=0.2, help="Ratio of webchat users in the synthetic log")
+  parser.add_argument("--registered-ratio", type=float, default=0.3, help="Ratio of users logged in to services in the synthetic log")
+  parser.add_argument("--registered", help="Hosts of users logged in to services, one per line")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--min-delay", default="2,3,4,5,6", help="MIN_SECONDS_BETWEEN_MESSAGES values, comma separated")
+  parser.add_argument("--webchat-multiplier", default="1,1.5,2", help="WEBCHAT_MULTIPLIER values")
+  parser.add_argument("--max-score", default="10,15,20,25", help="MAX_FLOOD_SCORE values")
+  parser.add_argument("--registered-leniency", default="1,2,3", help="REGISTERED_LENIENCY values")
+  parser.add_argument("--length-divisor", default=str(LENGTH_DIVISOR), help="Characters per step of the length penalty")
+  parser.add_argument("--length-exponent", default=str(LENGTH_EXPONENT), help="Exponent of the length penalty")
+  parser.add_argument("--history", type=int, default=constants["HISTORY_SIZE"], help="Messages a message is compared to")
+  parser.add_argument("--ttl", type=float, default=constants["ENTRY_TTL"], help="Seconds after which an idle user is forgotten")
+  parser.add_argument("--sort", choices=("f1", "precision", "recall", "users", "grid"), default="f1")
+  parser.add_argument("--top", type=int, default=20, help="Parameter sets shown, 0 for all")
+  parser.add_argument("--output", help="Write the results of all parameter sets as JSON to this file")
+  args = parser.parse_args()
+
+  start = time.time()
+  labels = {}
+  if args.synthetic:
+    log, labels = synthetic(args.synthetic, args.spammers, args.webchat, args.registered_ratio, args.seed)
+  elif args.log:
+    log = Log()
+    log.read(args.log)
+  else:
+    parser.error("Either a log or --synthetic is needed")
+  if args.labels:
+    labels.update(read_labels(args.labels))
+  if args.registered:
+    log.registered.update(read_hosts(args.registered))
+  loaded = time.time()
+
+  names, params = grid(args)
+  quiets = backtest(log, params, args.history, args.ttl)
+  results = evaluate(log, quiets, labels)
+  done = time.time()
+
+  print("%d messages of %d users, %d labelled, %d parameter sets: loaded in %.2fs, replayed in %.2fs" % (len(log), len(log.hosts),
+    sum(1 for x in log.hosts if x in labels), len(params), loaded - start, done - loaded))
+
+  current = numpy.array([constants["MIN_SECONDS_BETWEEN_MESSAGES"], constants["WEBCHAT_MULTIPLIER"], constants["MAX_FLOOD_SCORE"],
+    constants["REGISTERED_LENIENCY"], LENGTH_DIVISOR, LENGTH_EXPONENT])
+  rows = list(range(len(params)))
+  if args.sort != "grid":
+    key = results[args.sort].astype(float)
+    key = numpy.where(numpy.isnan(key), -1, key)
+    rows.sort(key=lambda x: -key[x])
+  if args.top:
+    rows = rows[:args.top]
+
+  print("\n  min_delay  webchat  max_score  registered  length   users   quiets  precision  recall     f1")
+  for i in rows:
+    print("%s %8.1f %8.1f %10.1f %11.1f %4d/%-3.1f %7d %8d %10.3f %7.3f %6.3f" % ("*" if numpy.allclose(params[i], current) else " ",
+      params[i][0], params[i][1], params[i][2], params[i][3], params[i][4], params[i][5], results["users"][i], results["quiets"][i],
+      results["precision"][i], results["recall"][i], results["f1"][i]))
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump([dict([(name, float(params[i][j])) for j, name in enumerate(names)] +
+        [(key, None if numpy.isnan(float(values[i])) else float(values[i])) for key, values in results.items()]) for i in range(len(params))], f, indent=2)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# measures the cost of AntiSpam's per message scoring, including the
+# near-duplicate detection, with synthetic chatter and spam
+from __future__ import print_function
+
+import os
+import sys
+import imp
+import random
+import string
+import timeit
+import argparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import persistence
+
+class FakePlugin(object):
+  def __init__(self, config):
+    self.config = config
+
+  def add_command_handler(self, command, handler, usage=None):
+    pass
+
+  def add_event_handler(self, event, handler):
+    pass
+
+  def get_config_value(self, key, default=""):
+    return self.config.get(key, default)
+
+  def get_store(self):
+    return persistence.Database().namespace("plugin:antispam")
+
+def random_message(rnd, words):
+  return " ".join(rnd.choice(words) for _ in xrange(rnd.randint(3, 30)))
+
+# a spammer repeating one line with a single character changed each time
+def mutate(rnd, message):
+  i = rnd.randrange(len(message))
+  return message[:i] + rnd.choice(string.ascii_letters) + message[i + 1:]
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the AntiSpam scoring per message.")
+  parser.add_argument("--messages", type=int, default=20000, help="Messages per run")
+  parser.add_argument("--history", type=int, default=5, help="History size")
+  parser.add_argument("--similarity", type=float, default=0.75, help="Similarity threshold")
+  parser.add_argument("--seed", type=int, default=1)
+  args = parser.parse_args()
+
+  antispam = imp.load_source("antispam", os.path.join(ROOT, "plugins", "antispam.py"))
+  plugin = antispam.Plugin(FakePlugin({"history": args.history, "similarity": args.similarity}))
+  settings = plugin.settings("bench")
+
+  rnd = random.Random(args.seed)
+  words = ["".join(rnd.choice(string.ascii_lowercase) for _ in xrange(rnd.randint(2, 9))) for _ in xrange(2000)]
+  chatter = [random_message(rnd, words) for _ in xrange(args.messages)]
+
+  spam = [random_message(rnd, words)]
+  for _ in xrange(args.messages - 1):
+    spam.append(mutate(rnd, spam[-1]))
+
+  for name, messages in (("chatter", chatter), ("spam", spam)):
+    user = antispam.AntiSpamData()
+    repeated = [0]
+
+    def run():
+      for message in messages:
+        plugin.update(settings, user, message)
+        repeated[0] += user.similar_message_count > 0
+
+    seconds = min(timeit.repeat(run, number=1, repeat=3))
+    print("%-8s %8.2f us/message, %5.1f%% detected as repeated" % (name, seconds / len(messages) * 1e6, repeated[0] * 100.0 / (3 * len(messages))))
+
+if __name__ == "__main__":
+  main()
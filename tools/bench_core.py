@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# micro-benchmarks for FloodBot's event path
+#
+# drives the bot's event handlers with synthetic events and a fake connection
+# for different numbers of loaded plugins and users per channel and writes
+# throughput and latency percentiles as JSON, e.g.
+#
+#   python tools/bench_core.py --output bench.json
+#
+# logging is disabled while measuring, the numbers are for the bot's own work
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import random
+import string
+import logging
+import platform
+import argparse
+import subprocess
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, ROOT)
+
+import irc.client
+import irc.features
+import bot
+
+BOT_NICK = "DontMindMe"
+CHANNEL = "#bench"
+
+class FakeConnection(object):
+  def __init__(self):
+    self.lines = 0
+    self.features = irc.features.FeatureSet()
+
+  def get_nickname(self):
+    return BOT_NICK
+
+  def is_connected(self):
+    return True
+
+  def send_raw(self, line):
+    self.lines += 1
+
+  def privmsg(self, target, text):
+    self.send_raw("PRIVMSG %s :%s" % (target, text))
+
+  def mode(self, target, command):
+    self.send_raw("MODE %s %s" % (target, command))
+
+  def join(self, channel, key=""):
+    self.send_raw("JOIN " + channel)
+
+  def part(self, channel, message=""):
+    self.send_raw("PART " + channel)
+
+  def nick(self, nick):
+    self.send_raw("NICK " + nick)
+
+  # only things due right away are run, nothing else is waited for
+  def execute_delayed(self, delay, function, arguments=()):
+    if delay <= 0:
+      function(*arguments)
+
+  def execute_every(self, period, function, arguments=()):
+    pass
+
+# a plugin that handles the common events and does nothing
+class NoopPlugin(object):
+  _name_ = "Noop"
+  _author_ = "Benchmark"
+  _description_ = "Does nothing."
+
+  def __init__(self, plugin):
+    for event in ("PUBMSG", "JOIN", "PART", "PRIVNOTICE"):
+      plugin.add_event_handler(event, self.handler)
+
+  def handler(self, conn, data):
+    pass
+
+def event(type, source, target, arguments):
+  return irc.client.Event(type, irc.client.NickMask(source), target, arguments)
+
+def random_word(rnd, length):
+  return "".join(rnd.choice(string.ascii_lowercase) for _ in range(length))
+
+def make_bot(plugins, extra_plugins, users, rnd):
+  conn = FakeConnection()
+  core = bot.BotCore(logging.getLogger("DontMindMe"), None, BOT_NICK, "localhost", 6667)
+  b = core.networks["default"]
+  b.connection = conn
+  b.sendq.connection = conn
+  b.sendq.rate = 0
+
+  for name in plugins:
+    core.load_plugin(name)
+
+  for i in range(extra_plugins):
+    name = "noop%d" % (i)
+    core.plugin_load_count += 1
+    plugin = bot.Plugin(core, name, NoopPlugin._name_, NoopPlugin._author_, NoopPlugin._description_)
+    plugin.load_order = core.plugin_load_count
+    core.plugins[name] = plugin
+    plugin.set_instance(NoopPlugin(plugin))
+
+  b._on_join(conn, event("join", "%s!bot@bench" % (BOT_NICK), CHANNEL, []))
+
+  nicks = ["u%d%s" % (i, random_word(rnd, 4)) for i in range(users)]
+  for start in range(0, len(nicks), 40):
+    names = " ".join(("@" if i % 50 == 0 else "") + nick for i, nick in enumerate(nicks[start:start + 40], start))
+    b._on_namreply(conn, event("namreply", "irc.bench", None, ["=", CHANNEL, names]))
+
+  b.admins.add(irc.client.NickMask("admin!admin@bench"))
+  return b, conn, nicks
+
+def percentile(values, p):
+  return values[min(len(values) - 1, int(len(values) * p))]
+
+def measure(func, args_list):
+  timer = timeit.default_timer
+  latencies = []
+
+  start = timer()
+  for args in args_list:
+    t = timer()
+    func(*args)
+    latencies.append(timer() - t)
+  total = timer() - start
+
+  latencies.sort()
+  return {
+    "iterations": len(latencies),
+    "ops_per_sec": len(latencies) / total if total else None,
+    "latency_us": {
+      "mean": sum(latencies) / len(latencies) * 1e6,
+      "p50": percentile(latencies, 0.50) * 1e6,
+      "p90": percentile(latencies, 0.90) * 1e6,
+      "p99": percentile(latencies, 0.99) * 1e6,
+      "max": latencies[-1] * 1e6,
+    },
+  }
+
+def run_scenario(name, plugins, extra_plugins, users, iterations, rnd):
+  b, conn, nicks = make_bot(plugins, extra_plugins, users, rnd)
+  words = [random_word(rnd, rnd.randint(2, 9)) for _ in range(500)]
+
+  def message():
+    return " ".join(rnd.choice(words) for _ in range(rnd.randint(2, 20)))
+
+  def sources():
+    return ["%s!user@host%d.bench" % (nick, i) for i, nick in enumerate(rnd.choice(nicks) for _ in range(iterations))]
+
+  results = []
+
+  def record(operation, func, args_list):
+    result = measure(func, args_list)
+    result.update({"scenario": name, "plugins": len(b.core.plugins), "users": users, "operation": operation})
+    results.append(result)
+    print("%-8s plugins=%-3d users=%-6d %-20s %10.0f ops/s  p50 %7.1fus  p99 %7.1fus" % (name, len(b.core.plugins), users, operation, result["ops_per_sec"], result["latency_us"]["p50"], result["latency_us"]["p99"]))
+
+  record("on_pubmsg", b.on_pubmsg, [(conn, event("pubmsg", source, CHANNEL, [message()])) for source in sources()])
+  record("plugin_handle_event", b.plugin_handle_event, [(b.sendq, "PUBMSG", event("pubmsg", source, CHANNEL, [message()])) for source in sources()])
+  record("on_privmsg_admin", b.on_privmsg, [(conn, event("privmsg", "admin!admin@bench", BOT_NICK, ["!sendq"]))] * iterations)
+  record("on_privmsg_denied", b.on_privmsg, [(conn, event("privmsg", source, BOT_NICK, ["!help"])) for source in sources()])
+
+  names = " ".join(nicks[:40])
+  record("_on_namreply", b._on_namreply, [(conn, event("namreply", "irc.bench", None, ["=", CHANNEL, names]))] * iterations)
+
+  # every iteration joins a new user, who is taken out again untimed
+  joins = [event("join", "joiner%d!user@host%d.bench" % (i, i), CHANNEL, []) for i in range(iterations)]
+
+  def join(e):
+    b._on_join(conn, e)
+    b.on_join(b.sendq, e)
+
+  record("_on_join+on_join", join, [(e,) for e in joins])
+  for e in joins:
+    b._on_quit(conn, event("quit", e.source, None, ["bench"]))
+
+  return results
+
+def git_revision():
+  try:
+    return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT).strip().decode("ascii")
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark FloodBot's event path.")
+  parser.add_argument("--iterations", type=int, default=5000, help="Events per operation and scenario")
+  parser.add_argument("--users", type=str, default="10,100,1000,10000", help="Comma separated channel sizes")
+  parser.add_argument("--extra-plugins", type=int, default=8, help="No-op plugins loaded in addition to all plugins in the N scenario")
+  parser.add_argument("--output", "-o", type=str, default="", help="Write the results as JSON to this file")
+  parser.add_argument("--seed", type=int, default=1)
+  args = parser.parse_args()
+
+  # plugins are loaded relative to the working directory
+  os.chdir(ROOT)
+  logging.disable(logging.CRITICAL)
+
+  all_plugins = sorted(x[:-3] for x in os.listdir("plugins") if x.endswith(".py") and x != "__init__.py")
+  scenarios = [
+    ("0", [], 0),
+    ("1", ["antispam"], 0),
+    ("N", all_plugins, args.extra_plugins),
+  ]
+
+  rnd = random.Random(args.seed)
+  results = []
+  for users in [int(x) for x in args.users.split(",")]:
+    for name, plugins, extra_plugins in scenarios:
+      results.extend(run_scenario(name, plugins, extra_plugins, users, args.iterations, rnd))
+
+  report = {
+    "meta": {
+      "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+      "revision": git_revision(),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "iterations": args.iterations,
+    },
+    "results": results,
+  }
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+    print("Results written to %s" % (args.output))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# compares the irc library's line parser with the lazy one
+#
+# feeds the lines of a netsplit rejoin storm (joins, ops, quits, chatter
+# and numerics nothing handles) through a FloodBot's connection, once with
+# each parser, and prints the time per line, e.g.
+#
+#   python tools/bench_parser.py --users 5000
+#
+# logging is disabled while measuring, replies go nowhere
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import random
+import logging
+import argparse
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, ROOT)
+
+import bot
+
+BOT_NICK = "DontMindMe"
+CHANNEL = "#bench"
+
+class FakeConnection(object):
+  def get_nickname(self):
+    return BOT_NICK
+
+  def is_connected(self):
+    return True
+
+  def send_raw(self, line):
+    pass
+
+def storm(users, rnd):
+  nicks = ["u%d" % (i) for i in range(users)]
+  lines = [":%s!%s@host%d.bench JOIN %s" % (nick, nick, i, CHANNEL) for i, nick in enumerate(nicks)]
+  lines += [":ChanServ!ChanServ@services. MODE %s +o %s" % (CHANNEL, nick) for nick in nicks[::20]]
+  lines += [":irc.bench 352 %s %s %s host%d.bench irc.bench %s H :0 %s" % (BOT_NICK, CHANNEL, nick, i, nick, nick) for i, nick in enumerate(nicks)]
+  lines += [":%s!%s@host%d.bench AWAY :gone" % (nick, nick, i) for i, nick in enumerate(nicks[::3])]
+  lines += [":%s!%s@host%d.bench PRIVMSG %s :back again %d" % (nick, nick, i, CHANNEL, i) for i, nick in enumerate(nicks[::5])]
+  lines += [":%s!%s@host%d.bench QUIT :*.net *.split" % (nick, nick, i) for i, nick in enumerate(nicks)]
+  rnd.shuffle(lines)
+
+  # everybody has to join before they can do anything else
+  joins = [x for x in lines if " JOIN " in x]
+  return joins + [x for x in lines if " JOIN " not in x]
+
+def run(lazy, plugins, lines):
+  core = bot.BotCore(logging.getLogger("DontMindMe"), None, BOT_NICK, "localhost", 6667)
+  b = core.networks["default"]
+  if lazy:
+    b.use_lazy_parser()
+  b.sendq.connection = FakeConnection()
+  b.sendq.rate = 0
+
+  for name in plugins:
+    core.load_plugin(name)
+
+  connection = b.connection
+  connection.send_raw = lambda line: None
+  connection.real_nickname = BOT_NICK
+  connection.real_server_name = "irc.bench"
+  connection.handlers = {}
+  connection._process_line(":%s!bot@bench JOIN %s" % (BOT_NICK, CHANNEL))
+
+  # like timeit, the collector would only add noise
+  timer = timeit.default_timer
+  gc.collect()
+  gc.disable()
+  try:
+    start = timer()
+    for line in lines:
+      connection._process_line(line)
+    return (timer() - start) / len(lines)
+  finally:
+    gc.enable()
+
+def main():
+  parser = argparse.ArgumentParser(description="Compare the line parsers.")
+  parser.add_argument("--users", type=int, default=5000, help="Users rejoining after the split")
+  parser.add_argument("--repeat", type=int, default=5, help="Runs per parser, the fastest counts")
+  parser.add_argument("--seed", type=int, default=1)
+  args = parser.parse_args()
+
+  # plugins are loaded relative to the working directory
+  os.chdir(ROOT)
+  logging.disable(logging.CRITICAL)
+
+  lines = storm(args.users, random.Random(args.seed))
+  for plugins in ([], ["antispam"]):
+    stock = min(run(False, plugins, lines) for _ in range(args.repeat))
+    lazy = min(run(True, plugins, lines) for _ in range(args.repeat))
+    print("plugins=%-10s lines=%-6d stock %6.1fus/line  lazy %6.1fus/line  %.0f%% less" % (",".join(plugins) or "none", len(lines), stock * 1e6, lazy * 1e6, (1 - lazy / stock) * 100))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,623 @@
+#!/usr/bin/env python
+# a local stand-in for an IRC server plus a load generator
+#
+# starts a minimal RFC 1459 server on localhost, runs the bot against it and
+# lets simulated users chat, join and flood the channels listed under
+# channels= in the bot's config. measures the time from a flooding PRIVMSG to
+# the bot's QUIET (through ChanServ or MODE +q) and samples the bot's CPU
+# usage and RSS. everything runs offline on one box, e.g.
+#
+#   python tools/fakeircd.py --config dontmindme.conf --duration 60 --flooders 5
+#
+# the simulated users have no sockets of their own, the server just makes up
+# their lines and sends them to the bot
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import select
+import socket
+import string
+import argparse
+import itertools
+import tempfile
+import subprocess
+
+try:
+  import ConfigParser as configparser
+except ImportError:
+  import configparser
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+SERVER_NAME = "fake.irc"
+CAPABILITIES = ("multi-prefix", "userhost-in-names", "extended-join", "account-notify", "away-notify", "message-tags")
+
+def percentiles(values):
+  if not values:
+    return None
+
+  values = sorted(values)
+  pick = lambda p: values[min(len(values) - 1, int(len(values) * p))] * 1000
+  return {"count": len(values), "p50_ms": pick(0.5), "p90_ms": pick(0.9), "p99_ms": pick(0.99), "max_ms": values[-1] * 1000}
+
+class VirtualUser(object):
+  def __init__(self, nick, host):
+    self.nick = nick
+    self.host = host
+    self.account = None
+    self.away = False
+    self.flooder = False
+    self.quieted = False
+    self.first_flood = None
+    self.last_flood = None
+
+  def source(self):
+    return "%s!%s@%s" % (self.nick, self.nick[:9], self.host)
+
+class Client(object):
+  def __init__(self, sock):
+    self.sock = sock
+    self.buffer = b""
+    self.nick = None
+    self.user = None
+    self.registered = False
+    self.channels = set()
+    self.caps = set()
+    self.negotiating = False
+
+class FakeIRCServer(object):
+  def __init__(self, port, users_per_channel, webchat_ratio, registered_ratio, rnd):
+    self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.listener.bind(("127.0.0.1", port))
+    self.listener.listen(5)
+    self.port = self.listener.getsockname()[1]
+
+    self.rnd = rnd
+    self.users_per_channel = users_per_channel
+    self.webchat_ratio = webchat_ratio
+    self.registered_ratio = registered_ratio
+    self.clients = {}
+    self.channels = {}
+    self.user_count = 0
+
+    # flood measurements
+    self.quiet_latencies = []
+    self.detection_times = []
+    self.lines_in = 0
+    self.lines_out = 0
+    self.join_lines = 0
+
+  def make_user(self):
+    self.user_count += 1
+    nick = "u%d%s" % (self.user_count, "".join(self.rnd.choice(string.ascii_lowercase) for _ in range(3)))
+    if self.rnd.random() < self.webchat_ratio:
+      host = "gateway/web/freenode/ip.10.%d.%d.%d" % (self.rnd.randint(0, 255), self.rnd.randint(0, 255), self.rnd.randint(1, 254))
+    else:
+      host = "host%d.users.fake" % (self.user_count)
+
+    user = VirtualUser(nick, host)
+    if self.rnd.random() < self.registered_ratio:
+      user.account = nick
+    return user
+
+  def channel_users(self, channel):
+    if channel not in self.channels:
+      self.channels[channel] = dict((u.nick.lower(), u) for u in (self.make_user() for _ in range(self.users_per_channel)))
+    return self.channels[channel]
+
+  def send(self, client, line):
+    try:
+      client.sock.sendall((line + "\r\n").encode("utf-8"))
+      self.lines_out += 1
+    except socket.error:
+      self.drop(client)
+
+  def numeric(self, client, number, text):
+    self.send(client, ":%s %s %s %s" % (SERVER_NAME, number, client.nick or "*", text))
+
+  def drop(self, client):
+    if client.sock.fileno() in self.clients:
+      del self.clients[client.sock.fileno()]
+    try:
+      client.sock.close()
+    except socket.error:
+      pass
+
+  def sockets(self):
+    return [self.listener] + [c.sock for c in self.clients.values()]
+
+  def poll(self, timeout):
+    readable, _, _ = select.select(self.sockets(), [], [], timeout)
+    for sock in readable:
+      if sock is self.listener:
+        conn, _ = self.listener.accept()
+        self.clients[conn.fileno()] = Client(conn)
+        continue
+
+      client = self.clients.get(sock.fileno())
+      if client is None:
+        continue
+
+      try:
+        data = sock.recv(65536)
+      except socket.error:
+        data = b""
+
+      if not data:
+        self.drop(client)
+        continue
+
+      client.buffer += data
+      while b"\n" in client.buffer:
+        line, client.buffer = client.buffer.split(b"\n", 1)
+        line = line.rstrip(b"\r").decode("utf-8", "replace")
+        if line:
+          self.lines_in += 1
+          self.handle_line(client, line)
+
+  def handle_line(self, client, line):
+    if " :" in line:
+      head, trailing = line.split(" :", 1)
+      params = head.split() + [trailing]
+    else:
+      params = line.split()
+
+    command = params[0].upper()
+    params = params[1:]
+    handler = getattr(self, "cmd_" + command.lower(), None)
+
+    if handler is None:
+      self.numeric(client, "421", "%s :Unknown command" % (command))
+    else:
+      handler(client, params)
+
+  def cmd_nick(self, client, params):
+    old = client.nick
+    client.nick = params[0]
+    if client.registered and old:
+      self.send(client, ":%s!bot@bot.fake NICK :%s" % (old, client.nick))
+    self.try_register(client)
+
+  def cmd_user(self, client, params):
+    client.user = params[0]
+    self.try_register(client)
+
+  # registration waits for CAP END once the client sent CAP LS
+  def try_register(self, client):
+    if client.registered or client.negotiating or not client.nick or not client.user:
+      return
+
+    client.registered = True
+    self.numeric(client, "001", ":Welcome to the fake IRC network %s" % (client.nick))
+    self.numeric(client, "005", "PREFIX=(ov)@+ CHANTYPES=# CHANMODES=beIqr,k,l,imnpst MODES=4 TARGMAX=JOIN:,PRIVMSG:4 NETWORK=Fake :are supported by this server")
+    self.numeric(client, "376", ":End of /MOTD command.")
+
+  def cmd_ping(self, client, params):
+    self.send(client, ":%s PONG %s :%s" % (SERVER_NAME, SERVER_NAME, params[0] if params else ""))
+
+  def cmd_pong(self, client, params):
+    pass
+
+  def cmd_join(self, client, params):
+    self.join_lines += 1
+    for channel in params[0].split(","):
+      client.channels.add(channel.lower())
+      if "extended-join" in client.caps:
+        self.send(client, ":%s!bot@bot.fake JOIN %s * :%s" % (client.nick, channel, client.nick))
+      else:
+        self.send(client, ":%s!bot@bot.fake JOIN %s" % (client.nick, channel))
+      self.cmd_names(client, [channel])
+
+  def cmd_names(self, client, params):
+    channel = params[0]
+    if "userhost-in-names" in client.caps:
+      nicks = [u.source() for u in self.channel_users(channel.lower()).values()] + ["%s!bot@bot.fake" % (client.nick)]
+    else:
+      nicks = [u.nick for u in self.channel_users(channel.lower()).values()] + [client.nick]
+    for start in range(0, len(nicks), 30):
+      self.numeric(client, "353", "= %s :%s" % (channel, " ".join(nicks[start:start + 30])))
+    self.numeric(client, "366", "%s :End of /NAMES list." % (channel))
+
+  def cmd_part(self, client, params):
+    for channel in params[0].split(","):
+      client.channels.discard(channel.lower())
+      self.send(client, ":%s!bot@bot.fake PART %s" % (client.nick, channel))
+
+  def cmd_mode(self, client, params):
+    if len(params) < 2 or not params[0].startswith("#"):
+      return
+
+    # +q masks count as quiets, just like QUIET through ChanServ
+    modes, masks = params[1], params[2:]
+    if modes.startswith("+") and set(modes[1:]) == set("q"):
+      for mask in masks:
+        self.quiet(params[0], mask)
+    self.send(client, ":%s!bot@bot.fake MODE %s" % (client.nick, " ".join(params)))
+
+  def cmd_privmsg(self, client, params):
+    if len(params) < 2:
+      return
+
+    target, text = params[0], params[1]
+    if target.lower() == "chanserv" and text.upper().startswith("QUIET "):
+      args = text.split()
+      for mask in args[2:]:
+        self.quiet(args[1], mask)
+
+  def cmd_notice(self, client, params):
+    pass
+
+  def cmd_cap(self, client, params):
+    subcommand = params[0].upper() if params else ""
+    if subcommand == "LS":
+      client.negotiating = not client.registered
+      self.send(client, ":%s CAP %s LS :%s" % (SERVER_NAME, client.nick or "*", " ".join(CAPABILITIES)))
+    elif subcommand == "REQ" and len(params) > 1:
+      caps = params[1].split()
+      if set(x.lstrip("-") for x in caps) <= set(CAPABILITIES):
+        for cap in caps:
+          if cap.startswith("-"):
+            client.caps.discard(cap[1:])
+          else:
+            client.caps.add(cap)
+        self.send(client, ":%s CAP %s ACK :%s" % (SERVER_NAME, client.nick or "*", params[1]))
+      else:
+        self.send(client, ":%s CAP %s NAK :%s" % (SERVER_NAME, client.nick or "*", params[1]))
+    elif subcommand == "END":
+      client.negotiating = False
+      self.try_register(client)
+    else:
+      self.numeric(client, "410", "%s :Invalid CAP command" % (subcommand))
+
+  def cmd_quit(self, client, params):
+    self.drop(client)
+
+  # a quiet is matched to the flooder by nick or by host
+  def quiet(self, channel, mask):
+    now = time.time()
+    users = self.channels.get(channel.lower(), {})
+    nick = mask.split("!", 1)[0].lower()
+    host = mask.split("@", 1)[1] if "@" in mask else None
+
+    for user in users.values():
+      if user.quieted or user.last_flood is None:
+        continue
+      if user.nick.lower() == nick or (host and user.host == host):
+        user.quieted = True
+        self.quiet_latencies.append(now - user.last_flood)
+        self.detection_times.append(now - user.first_flood)
+
+  # drops every client, like a netsplit between the bot and its server
+  def netsplit(self):
+    for client in list(self.clients.values()):
+      self.send(client, "ERROR :Closing Link: 127.0.0.1 (*.net *.split)")
+      self.drop(client)
+    self.join_lines = 0
+
+  # away-notify, coming back is an AWAY without parameters
+  def broadcast_away(self, channel, user):
+    line = ":%s AWAY :Gone" % (user.source()) if user.away else ":%s AWAY" % (user.source())
+    for client in list(self.clients.values()):
+      if client.registered and channel in client.channels and "away-notify" in client.caps:
+        self.send(client, line)
+
+  def in_channels(self, channels):
+    return any(c.registered and set(channels) <= c.channels for c in self.clients.values())
+
+  def broadcast(self, channel, line):
+    for client in list(self.clients.values()):
+      if client.registered and channel in client.channels:
+        self.send(client, line)
+
+  # with extended-join the account and real name follow the channel
+  def broadcast_join(self, channel, user):
+    for client in list(self.clients.values()):
+      if client.registered and channel in client.channels:
+        if "extended-join" in client.caps:
+          self.send(client, ":%s JOIN %s %s :%s" % (user.source(), channel, user.account or "*", user.nick))
+        else:
+          self.send(client, ":%s JOIN %s" % (user.source(), channel))
+
+class LoadGenerator(object):
+  def __init__(self, server, channels, args, rnd):
+    self.server = server
+    self.channels = [c.lower() for c in channels]
+    self.args = args
+    self.rnd = rnd
+    self.words = ["".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(2, 9))) for _ in range(1000)]
+    self.events = []
+    self.sequence = itertools.count()
+    self.flood_lines = 0
+    self.chat_lines = 0
+    self.away_lines = 0
+    self.joins = 0
+    self.split_quits = 0
+
+  def schedule(self, at, action, *args):
+    heapq.heappush(self.events, (at, next(self.sequence), action, args))
+
+  def start(self, now):
+    for channel in self.channels:
+      if self.args.chat_rate > 0:
+        self.schedule(now + self.rnd.expovariate(self.args.chat_rate), self.chat, channel)
+      if self.args.join_rate > 0:
+        self.schedule(now + self.rnd.expovariate(self.args.join_rate), self.join, channel)
+      for _ in range(self.args.flooders):
+        self.schedule(now + self.rnd.uniform(0, 5), self.start_flooder, channel)
+    if self.args.user_split > 0:
+      self.schedule(now + self.args.user_split, self.split)
+
+  def run_due(self, now):
+    while self.events and self.events[0][0] <= now:
+      _, _, action, args = heapq.heappop(self.events)
+      action(now, *args)
+
+  def next_due(self):
+    return self.events[0][0] if self.events else None
+
+  def message(self):
+    return " ".join(self.rnd.choice(self.words) for _ in range(self.rnd.randint(2, 15)))
+
+  def say(self, channel, user, text):
+    self.server.broadcast(channel, ":%s PRIVMSG %s :%s" % (user.source(), channel, text))
+
+  def chat(self, now, channel):
+    users = self.server.channel_users(channel)
+    if users:
+      user = self.rnd.choice(list(users.values()))
+      self.say(channel, user, self.message())
+      self.chat_lines += 1
+
+      # now and then someone goes away for a few seconds
+      if not user.away and self.rnd.random() < 0.1:
+        self.set_away(now, channel, user, True)
+        self.schedule(now + self.rnd.uniform(1, 3), self.set_away, channel, user, False)
+    self.schedule(now + self.rnd.expovariate(self.args.chat_rate), self.chat, channel)
+
+  def set_away(self, now, channel, user, away):
+    user.away = away
+    self.server.broadcast_away(channel, user)
+    self.away_lines += 1
+
+  # a user joins and another one leaves, so the channel keeps its size
+  def join(self, now, channel):
+    users = self.server.channel_users(channel)
+    user = self.server.make_user()
+    users[user.nick.lower()] = user
+    self.server.broadcast_join(channel, user)
+    self.joins += 1
+
+    leaving = self.rnd.choice(list(users.values()))
+    if leaving is not user and not leaving.flooder:
+      del users[leaving.nick.lower()]
+      self.server.broadcast(channel, ":%s PART %s" % (leaving.source(), channel))
+
+    self.schedule(now + self.rnd.expovariate(self.args.join_rate), self.join, channel)
+
+  # another server of the network splits off: a share of every channel
+  # quits with a netsplit reason and all of them rejoin once it is back
+  def split(self, now):
+    for channel in self.channels:
+      users = self.server.channel_users(channel)
+      gone = [u for u in users.values() if not u.flooder and self.rnd.random() < self.args.split_ratio]
+      for user in gone:
+        del users[user.nick.lower()]
+        self.server.broadcast(channel, ":%s QUIT :*.net *.split" % (user.source()))
+        self.split_quits += 1
+      self.schedule(now + self.rnd.uniform(2, 4), self.heal, channel, gone)
+
+  def heal(self, now, channel, users):
+    for user in users:
+      self.server.channel_users(channel)[user.nick.lower()] = user
+      self.server.broadcast_join(channel, user)
+      self.joins += 1
+
+  # a flooder repeats a line with small changes until it is quieted,
+  # then a new flooder takes its place
+  def start_flooder(self, now, channel):
+    user = self.server.make_user()
+    # spammers don't bother registering their nicks
+    user.account = None
+    user.flooder = True
+    self.server.channel_users(channel)[user.nick.lower()] = user
+    self.server.broadcast_join(channel, user)
+    self.schedule(now + 1, self.flood, channel, user, self.message())
+
+  def flood(self, now, channel, user, text):
+    if user.quieted:
+      self.schedule(now + self.rnd.uniform(1, 5), self.start_flooder, channel)
+      return
+
+    if user.first_flood is None:
+      user.first_flood = now
+    elif now - user.first_flood > self.args.give_up:
+      # never quieted, try again with someone else
+      self.schedule(now, self.start_flooder, channel)
+      return
+
+    user.last_flood = now
+    i = self.rnd.randrange(len(text))
+    text = text[:i] + self.rnd.choice(string.ascii_letters) + text[i + 1:]
+    self.say(channel, user, text)
+    self.flood_lines += 1
+    self.schedule(now + 1.0 / self.args.flood_rate, self.flood, channel, user, text)
+
+class ProcessSampler(object):
+  def __init__(self, pid):
+    self.pid = pid
+    self.ticks = os.sysconf("SC_CLK_TCK")
+    self.page_size = os.sysconf("SC_PAGE_SIZE")
+    self.rss = []
+    self.start_cpu = self.cpu_seconds()
+    self.start_time = time.time()
+
+  def cpu_seconds(self):
+    try:
+      with open("/proc/%d/stat" % (self.pid)) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+      return (int(fields[11]) + int(fields[12])) / float(self.ticks)
+    except (IOError, OSError):
+      return None
+
+  def sample(self):
+    try:
+      with open("/proc/%d/statm" % (self.pid)) as f:
+        self.rss.append(int(f.read().split()[1]) * self.page_size)
+    except (IOError, OSError):
+      pass
+
+  def report(self):
+    cpu = self.cpu_seconds()
+    elapsed = time.time() - self.start_time
+    return {
+      "cpu_seconds": None if cpu is None else cpu - self.start_cpu,
+      "cpu_percent": None if cpu is None or not elapsed else (cpu - self.start_cpu) / elapsed * 100,
+      "rss_start_kb": self.rss[0] // 1024 if self.rss else None,
+      "rss_max_kb": max(self.rss) // 1024 if self.rss else None,
+      "rss_end_kb": self.rss[-1] // 1024 if self.rss else None,
+    }
+
+def write_bot_config(config_file, port, dead_server=False):
+  config = configparser.RawConfigParser()
+  if config_file and not config.read(config_file):
+    raise SystemExit("Could not read config file '%s'!" % (config_file))
+
+  if not config.has_section("core"):
+    config.add_section("core")
+  config.set("core", "server", "127.0.0.1")
+  config.set("core", "port", str(port))
+
+  # a port nothing listens on ahead of ours, the bot has to fall back
+  if dead_server:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    config.set("core", "server", "127.0.0.1:%d,127.0.0.1:%d" % (sock.getsockname()[1], port))
+    sock.close()
+
+  channels = ["#loadtest"]
+  if config.has_option("core", "channels"):
+    channels = [c.strip() for c in config.get("core", "channels").split(",") if c.strip()]
+  else:
+    config.set("core", "channels", ",".join(channels))
+
+  fd, path = tempfile.mkstemp(prefix="dontmindme-loadtest-", suffix=".conf")
+  with os.fdopen(fd, "w") as f:
+    config.write(f)
+  return path, channels
+
+def main():
+  parser = argparse.ArgumentParser(description="Run the bot against a local fake IRC server under load.")
+  parser.add_argument("--config", "-c", type=str, default=os.path.join(ROOT, "dontmindme.conf"), help="Bot config, server and port are replaced")
+  parser.add_argument("--port", type=int, default=0, help="Port to listen on, 0 picks a free one")
+  parser.add_argument("--duration", type=float, default=60, help="Seconds to run the load")
+  parser.add_argument("--warmup", type=float, default=5, help="Seconds to wait for the bot to join before the load starts")
+  parser.add_argument("--users", type=int, default=500, help="Simulated users per channel")
+  parser.add_argument("--webchat-ratio", type=float, default=0.1, help="Share of users connecting through a web gateway")
+  parser.add_argument("--registered-ratio", type=float, default=0.3, help="Share of users logged in to services")
+  parser.add_argument("--chat-rate", type=float, default=5, help="Chat messages per second and channel")
+  parser.add_argument("--join-rate", type=float, default=0.5, help="Joins per second and channel")
+  parser.add_argument("--flooders", type=int, default=2, help="Simultaneous flooders per channel")
+  parser.add_argument("--flood-rate", type=float, default=4, help="Messages per second of a flooder")
+  parser.add_argument("--give-up", type=float, default=30, help="Seconds after which an unnoticed flooder is replaced")
+  parser.add_argument("--python", type=str, default=sys.executable, help="Interpreter to run the bot with")
+  parser.add_argument("--no-spawn", action="store_true", help="Don't start the bot, wait for one to connect")
+  parser.add_argument("--asyncio", action="store_true", help="Run the bot on its asyncio core")
+  parser.add_argument("--output", "-o", type=str, default="", help="Write the results as JSON to this file")
+  parser.add_argument("--netsplit", type=float, default=0, help="Seconds into the load after which the bot's connection is dropped, 0 for never")
+  parser.add_argument("--user-split", type=float, default=0, help="Seconds into the load after which some users quit in a netsplit and rejoin, 0 for never")
+  parser.add_argument("--split-ratio", type=float, default=0.2, help="Share of every channel's users lost in the --user-split netsplit")
+  parser.add_argument("--dead-server", action="store_true", help="List an unreachable server before this one in the bot's config")
+  parser.add_argument("--seed", type=int, default=1)
+  args = parser.parse_args()
+
+  rnd = random.Random(args.seed)
+  server = FakeIRCServer(args.port, args.users, args.webchat_ratio, args.registered_ratio, rnd)
+  config_path, channels = write_bot_config(args.config if os.path.exists(args.config) else None, server.port, args.dead_server)
+  print("Fake IRC server listening on 127.0.0.1:%d, channels: %s" % (server.port, ", ".join(channels)))
+
+  process = None
+  sampler = None
+  if not args.no_spawn:
+    command = [args.python, os.path.join(ROOT, "bot.py"), "--foreground", "--stdout", "--log-level", "WARNING", "--config", config_path]
+    if args.asyncio:
+      command.append("--asyncio")
+    process = subprocess.Popen(command, cwd=ROOT)
+
+  try:
+    # wait for the bot to be in all channels
+    deadline = time.time() + args.warmup
+    while time.time() < deadline or not server.clients:
+      server.poll(0.1)
+      if process is not None and process.poll() is not None:
+        raise SystemExit("The bot exited with code %d!" % (process.returncode))
+
+    if process is not None:
+      sampler = ProcessSampler(process.pid)
+      sampler.sample()
+
+    load = LoadGenerator(server, channels, args, rnd)
+    start = time.time()
+    load.start(start)
+    next_sample = start + 1
+    netsplit_at = start + args.netsplit if args.netsplit > 0 else None
+    split = None
+    rejoin_time = None
+
+    while time.time() - start < args.duration:
+      now = time.time()
+      if netsplit_at is not None and now >= netsplit_at:
+        netsplit_at = None
+        split = now
+        server.netsplit()
+      elif split is not None and rejoin_time is None and server.in_channels([c.lower() for c in channels]):
+        rejoin_time = now - split
+
+      load.run_due(now)
+      due = load.next_due()
+      server.poll(max(0, min(0.05, (due - time.time()) if due else 0.05)))
+
+      if sampler is not None and now >= next_sample:
+        sampler.sample()
+        next_sample += 1
+
+    elapsed = time.time() - start
+    process_report = sampler.report() if sampler else None
+  finally:
+    if process is not None and process.poll() is None:
+      process.terminate()
+      process.wait()
+    os.unlink(config_path)
+
+  report = {
+    "duration": elapsed,
+    "channels": channels,
+    "users_per_channel": args.users,
+    "lines_to_bot": server.lines_out,
+    "lines_from_bot": server.lines_in,
+    "lines_per_second": server.lines_out / elapsed,
+    "chat_lines": load.chat_lines,
+    "away_lines": load.away_lines,
+    "flood_lines": load.flood_lines,
+    "joins": load.joins,
+    "quiet_latency": percentiles(server.quiet_latencies),
+    "detection_time": percentiles(server.detection_times),
+    "bot_process": process_report,
+  }
+  if args.user_split > 0:
+    report["split_quits"] = load.split_quits
+  if args.netsplit > 0:
+    report["rejoin_seconds"] = rejoin_time
+    report["rejoin_join_lines"] = server.join_lines
+
+  print(json.dumps(report, indent=2, sort_keys=True))
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+  main()
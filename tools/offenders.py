@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# queries the offenders the AntiSpam plugin recorded in the bot's database,
+# the bot may keep running while this reads it
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+
+try:
+  import ConfigParser as configparser
+except ImportError:
+  import configparser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import offenders
+
+def load(path, namespace):
+  db = sqlite3.connect(path)
+  rows = db.execute("SELECT key, value FROM state WHERE namespace = ? AND key LIKE ?", (namespace, offenders.KEY_PREFIX + "%")).fetchall()
+  db.close()
+
+  index = offenders.OffenderIndex()
+  index.restore([(key, json.loads(value)) for key, value in rows])
+  return index
+
+def main():
+  parser = argparse.ArgumentParser(description="Show the offenders recorded by the AntiSpam plugin.")
+  parser.add_argument("--config", "-c", default="dontmindme.conf", help="Bot config, for the path of the database")
+  parser.add_argument("--database", help="Path of the database, instead of the one in the config")
+  parser.add_argument("--count", "-n", type=int, default=10, help="Number of entries to show")
+  parser.add_argument("query", nargs="?", choices=("subnets", "offenders", "summary"), default="summary")
+  args = parser.parse_args()
+
+  path = args.database
+  if path is None:
+    config = configparser.RawConfigParser()
+    if not config.read(args.config):
+      raise SystemExit("Could not read config file '%s'!" % (args.config))
+    if not config.has_option("core", "database"):
+      raise SystemExit("No database in [core] of '%s'!" % (args.config))
+    path = config.get("core", "database")
+
+  start = time.time()
+  index = load(path, "plugin:antispam")
+  print("Loaded %d offenders in %d subnets in %.0fms." % (len(index), len(index.subnets), (time.time() - start) * 1000))
+
+  if args.query in ("subnets", "summary"):
+    print("\nSubnet                                    Offenders  Penalties")
+    for name, count, penalties in index.top_subnets(args.count):
+      print("%-42s %9d %10d" % (name, count, penalties))
+
+  if args.query in ("offenders", "summary"):
+    print("\nHost                                      Network      Penalties  Last")
+    for offender in index.top_offenders(args.count):
+      print("%-42s %-12s %9d  %s" % (offender.host, offender.network, offender.penalties,
+        time.strftime("%Y-%m-%d %H:%M", time.localtime(offender.last))))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,158 @@
+import sys
+import time
+import logging
+import collections
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+
+WORKERS                = 4
+TIMEOUT                = 10    # seconds an offloaded handler may run
+MAX_PENDING            = 20    # offloaded calls per plugin that may wait or run
+POLL_INTERVAL          = 0.01  # select timeout while offloaded calls are running
+
+# these only read the connection's state, so they are answered right away
+READ_ONLY              = set(["get_nickname", "get_server_name", "is_connected"])
+
+logger = logging.getLogger("DontMindMe.Workers")
+
+# stands in for the connection while a handler runs on a worker thread.
+# calls are recorded and replayed on the real connection once the handler
+# is done, so nothing is ever sent or scheduled from another thread
+class DeferredConnection(object):
+  def __init__(self, connection):
+    self.connection = connection
+    self.calls = []
+
+  def __getattr__(self, name):
+    if name in READ_ONLY:
+      return getattr(self.connection, name)
+
+    def record(*args, **kwargs):
+      self.calls.append((name, args, kwargs))
+
+    return record
+
+  def replay(self):
+    for name, args, kwargs in self.calls:
+      getattr(self.connection, name)(*args, **kwargs)
+
+class Job(object):
+  __slots__ = ("plugin", "name", "network", "conn", "deadline", "error", "timed_out", "runtime")
+
+  def __init__(self, plugin, name, network, conn, deadline):
+    self.plugin = plugin
+    self.name = name
+    self.network = network
+    self.conn = conn
+    self.deadline = deadline
+    self.error = None
+    self.timed_out = False
+    self.runtime = 0.0
+
+# runs offloaded plugin handlers on a bounded thread pool
+#
+# finished jobs are handed back through a deque and processed on the
+# reactor thread by process(), which the core calls from its loop. a
+# plugin whose handler runs into the timeout is unloaded, its thread can't
+# be stopped but whatever the handler does afterwards is thrown away.
+class WorkerPool(object):
+  def __init__(self, core, size=WORKERS, timeout=TIMEOUT, max_pending=MAX_PENDING):
+    self.core = core
+    self.size = size
+    self.timeout = timeout
+    self.max_pending = max_pending
+    self.pool = None
+    self.running = set()
+    self.done = collections.deque()
+    self.pending = collections.Counter()
+    self.full = set()
+
+    # set by aiocore to wake the event loop when a job is done
+    self.notify = None
+
+  # returns False if the plugin has too many calls queued already
+  def submit(self, plugin, name, handler, conn, args):
+    if self.pending[plugin] >= self.max_pending:
+      if plugin not in self.full:
+        logger.warning("Plugin '%s' has %d offloaded calls pending, dropping new ones." % (plugin.name, self.pending[plugin]))
+        self.full.add(plugin)
+      return False
+
+    # threads are only started once a plugin makes use of them
+    if self.pool is None:
+      self.pool = ThreadPool(self.size)
+
+    job = Job(plugin, name, self.core.current, DeferredConnection(conn), time.time() + self.timeout)
+    self.pending[plugin] += 1
+    self.running.add(job)
+    self.pool.apply_async(self.run, (job, handler, args))
+
+    # the deadline is checked on the reactor thread even if nothing else happens
+    conn.execute_delayed(self.timeout, self.process)
+    return True
+
+  # called on a worker thread
+  def run(self, job, handler, args):
+    self.core.current = job.network
+
+    start = default_timer()
+    try:
+      handler(job.conn, *args)
+    except Exception:
+      job.error = sys.exc_info()
+    job.runtime = default_timer() - start
+
+    self.done.append(job)
+    if self.notify is not None:
+      self.notify()
+
+  def busy(self):
+    return len(self.running) > 0
+
+  # replays the output of finished jobs and disables plugins that timed out
+  def process(self):
+    while self.done:
+      self.finish(self.done.popleft())
+
+    now = time.time()
+    for job in [x for x in self.running if now >= x.deadline]:
+      self.expire(job)
+
+  def finish(self, job):
+    if job.timed_out:
+      return
+
+    self.release(job)
+    self.core.metrics.observe(job.plugin.name, "offload", job.name, job.runtime)
+
+    # the plugin might have been unloaded in the meantime
+    if self.core.plugins.get(job.plugin.name) is not job.plugin:
+      return
+
+    if job.error is not None:
+      self.core.metrics.error(job.plugin.name, "offload", job.name)
+      self.core.logger.error("Error on running offloaded handler for '%s' in plugin '%s', unloading it!" % (job.name, job.plugin.name), exc_info=job.error)
+      self.core.unload_plugin(job.plugin.name)
+      return
+
+    self.core.current = job.network
+    try:
+      job.conn.replay()
+    except Exception:
+      logger.exception("Error on sending the output of '%s' in plugin '%s'!" % (job.name, job.plugin.name))
+
+  def expire(self, job):
+    job.timed_out = True
+    self.release(job)
+    self.core.metrics.error(job.plugin.name, "offload", job.name)
+
+    if self.core.plugins.get(job.plugin.name) is job.plugin:
+      self.core.logger.error("Offloaded handler for '%s' in plugin '%s' timed out after %ds, unloading it!" % (job.name, job.plugin.name, self.timeout))
+      self.core.unload_plugin(job.plugin.name)
+
+  def release(self, job):
+    self.running.discard(job)
+    self.pending[job.plugin] -= 1
+    if self.pending[job.plugin] <= 0:
+      del self.pending[job.plugin]
+    self.full.discard(job.plugin)